@@ -18,8 +18,8 @@ def get_database_url() -> str:
     return _default_database_url()
 
 
-async def create_engine_and_init() -> AsyncEngine:
-    url = get_database_url()
+async def create_engine_and_init(url: Optional[str] = None) -> AsyncEngine:
+    url = url or get_database_url()
     engine: AsyncEngine = create_async_engine(url, echo=False, pool_pre_ping=True)
     async with engine.begin() as conn:
         # SQLite tuning: WAL mode and reasonable sync settings
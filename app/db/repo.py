@@ -1,80 +1,247 @@
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from sqlalchemy import insert, select, delete
+from sqlalchemy import BigInteger, func, insert, select, delete, inspect, text
 from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 
 from app.db.tables import (
     metadata,
     samples_tcp, samples_dns, samples_http,
     targets_tcp, jobs_dns, jobs_http,
-    aggregates_tcp_1m, aggregates_dns_1m, aggregates_http_1m,
+    rollup_watermarks, app_settings,
 )
+from app.utils.fast_json import dumps
 
 
 def utc_now() -> datetime:
     return datetime.now(timezone.utc)
 
 
+class epoch_seconds(FunctionElement):
+    """Whole UTC epoch seconds of a DateTime column, computed in SQL."""
+
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(epoch_seconds)
+def _epoch_seconds_default(element, compiler, **kw):
+    return "CAST(FLOOR(EXTRACT(EPOCH FROM %s)) AS BIGINT)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds, "sqlite")
+def _epoch_seconds_sqlite(element, compiler, **kw):
+    # Naive timestamps are stored as UTC text, which strftime reads as UTC
+    return "CAST(strftime('%%s', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+def _add_missing_columns(sync_conn) -> None:
+    # create_all never alters existing tables; add nullable columns introduced later
+    inspector = inspect(sync_conn)
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            col_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+
 async def init_schema(engine: AsyncEngine) -> None:
     async with engine.begin() as conn:
         await conn.run_sync(metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
 
 
-async def insert_tcp_sample(engine: AsyncEngine, record: Dict[str, Any]) -> None:
-    async with engine.begin() as conn:
-        await conn.execute(insert(samples_tcp).values(record))
+SAMPLE_TABLES = {
+    "tcp": samples_tcp,
+    "dns": samples_dns,
+    "http": samples_http,
+}
 
 
-async def insert_dns_sample(engine: AsyncEngine, record: Dict[str, Any]) -> None:
-    async with engine.begin() as conn:
-        await conn.execute(insert(samples_dns).values(record))
+async def insert_samples_batch(engine: AsyncEngine, batches: Dict[str, List[Dict[str, Any]]]) -> int:
+    """Insert records for several sample tables in a single transaction.
 
-
-async def insert_http_sample(engine: AsyncEngine, record: Dict[str, Any]) -> None:
+    ``batches`` maps a probe kind (``tcp``/``dns``/``http``) to its records.
+    Records may omit nullable columns (local probes have no ``vantage``); they
+    are filled out to every column, as an executemany binds the key set of
+    the first record for all of them.
+    """
+    total = 0
+    async with engine.begin() as conn:
+        for kind, records in batches.items():
+            if not records:
+                continue
+            columns = sample_columns(kind)
+            rows = [{column: record.get(column) for column in columns} for record in records]
+            await conn.execute(insert(SAMPLE_TABLES[kind]), rows)
+            total += len(records)
+    return total
+
+
+def sample_columns(kind: str) -> List[str]:
+    return [c.name for c in SAMPLE_TABLES[kind].columns if c.name != "id"]
+
+
+async def insert_sample_rows(engine: AsyncEngine, rows: Dict[str, List[tuple]]) -> Dict[str, Tuple[int, int]]:
+    """Bulk insert tuples ordered as ``sample_columns(kind)`` in one transaction.
+
+    ``ts`` is a ``datetime``; naive values are UTC. On SQLite each batch is
+    sent as a single JSON array and unpacked by ``json_each`` inside the
+    database: rows are not bound one by one in Python, so the driver thread
+    runs the whole insert without the GIL, and ``strftime`` converts the
+    timestamps to UTC in the stored format. Returns the id range
+    ``(first_id, last_id)`` of the new rows per kind.
+    """
+    ranges: Dict[str, Tuple[int, int]] = {}
     async with engine.begin() as conn:
-        await conn.execute(insert(samples_http).values(record))
+        for kind, batch in rows.items():
+            if not batch:
+                continue
+            table = SAMPLE_TABLES[kind]
+            columns = sample_columns(kind)
+            if engine.dialect.name == "sqlite":
+                # Timestamps serialise as 'YYYY-MM-DDTHH:MM:SS[.ffffff][+HH:MM]'. The fraction
+                # is copied over because strftime's %f keeps only milliseconds
+                ts = (
+                    "strftime('%Y-%m-%d %H:%M:%S', ts) || "
+                    "CASE WHEN substr(ts, 20, 1) = '.' THEN substr(ts, 20, 7) ELSE '.000000' END"
+                )
+                values = [ts] + [f"value ->> {i}" for i in range(1, len(columns))]
+                await conn.exec_driver_sql(
+                    f"INSERT INTO {table.name} ({', '.join(columns)}) SELECT {', '.join(values)} "
+                    "FROM (SELECT value, value ->> 0 AS ts FROM json_each(?))",
+                    (dumps(batch).decode("utf-8"),),
+                )
+            else:
+                records = [dict(zip(columns, row)) for row in batch]
+                for record in records:
+                    if record["ts"].tzinfo is not None:
+                        record["ts"] = record["ts"].astimezone(timezone.utc)
+                await conn.execute(insert(table), records)
+            # The write lock is held, so the new rows are the last len(batch) ids
+            last_id = (await conn.execute(select(func.max(table.c.id)))).scalar() or 0
+            ranges[kind] = (last_id - len(batch) + 1, last_id)
+    return ranges
+
+
+async def sample_buckets(engine: AsyncEngine, kind: str, first_id: int, last_id: int) -> List[int]:
+    """Distinct minute buckets (epoch seconds) of the samples with ids in a range."""
+    table = SAMPLE_TABLES[kind]
+    minute = epoch_seconds(table.c.ts) // 60
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            select(minute).where(table.c.id.between(first_id, last_id)).distinct()
+        )).all()
+    return [int(row[0]) * 60 for row in rows]
 
 
-async def fetch_tcp_samples_between(
-    engine: AsyncEngine, start: datetime, end: datetime, host: Optional[str] = None
+async def prune_retention(engine: AsyncEngine, older_than: datetime) -> None:
+    # Only rows the rollups have folded in (id <= watermark), so backfilled
+    # old samples reach the aggregates before they are pruned
+    async with engine.begin() as conn:
+        for table in SAMPLE_TABLES.values():
+            rolled_up = select(rollup_watermarks.c.last_id).where(
+                rollup_watermarks.c.name == table.name
+            ).scalar_subquery()
+            await conn.execute(
+                delete(table).where(table.c.ts < older_than, table.c.id <= func.coalesce(rolled_up, 0))
+            )
+
+
+async def fetch_aggregates_between(
+    engine: AsyncEngine,
+    table,
+    start: datetime,
+    end: datetime,
+    filters: Optional[Dict[str, List[Any]]] = None,
 ) -> List[Dict[str, Any]]:
-    stmt = select(
-        samples_tcp.c.ts,
-        samples_tcp.c.host,
-        samples_tcp.c.port,
-        samples_tcp.c.latency_ms,
-        samples_tcp.c.success,
-    ).where(samples_tcp.c.ts >= start, samples_tcp.c.ts <= end)
-    if host:
-        stmt = stmt.where(samples_tcp.c.host == host)
+    stmt = select(table).where(table.c.bucket >= start, table.c.bucket <= end)
+    for column, values in (filters or {}).items():
+        if values:
+            stmt = stmt.where(table.c[column].in_(values))
     async with engine.begin() as conn:
         rows = (await conn.execute(stmt)).mappings().all()
     return [dict(r) for r in rows]
 
 
-async def prune_retention(engine: AsyncEngine, older_than: datetime) -> None:
+async def fetch_watermark(engine: AsyncEngine, name: str) -> Optional[int]:
     async with engine.begin() as conn:
-        await conn.execute(delete(samples_tcp).where(samples_tcp.c.ts < older_than))
-        await conn.execute(delete(samples_dns).where(samples_dns.c.ts < older_than))
-        await conn.execute(delete(samples_http).where(samples_http.c.ts < older_than))
+        value = (await conn.execute(
+            select(rollup_watermarks.c.last_id).where(rollup_watermarks.c.name == name)
+        )).scalar()
+    return int(value) if value is not None else None
+
+
+async def fetch_samples_after(
+    engine: AsyncEngine,
+    table,
+    after_id: int,
+    start: datetime,
+    end: datetime,
+    filters: Optional[Dict[str, List[Any]]] = None,
+) -> List[Tuple[int, float, bool]]:
+    """``(ts_sec, latency_ms, success)`` rows in [start, end] with an id above ``after_id``.
+
+    Timestamps come back as epoch seconds so callers can bucket them with
+    integer arithmetic instead of building a datetime per row.
+    """
+    stmt = select(epoch_seconds(table.c.ts), table.c.latency_ms, table.c.success).where(
+        table.c.id > after_id, table.c.ts >= start, table.c.ts <= end
+    )
+    for column, values in (filters or {}).items():
+        if values:
+            stmt = stmt.where(table.c[column].in_(values))
+    async with engine.begin() as conn:
+        rows = (await conn.execute(stmt)).all()
+    return [tuple(r) for r in rows]
 
 
-async def fetch_dns_samples_between(
-    engine: AsyncEngine, start: datetime, end: datetime, fqdn: Optional[str] = None
-) -> List[Dict[str, Any]]:
-    stmt = select(
-        samples_dns.c.ts,
-        samples_dns.c.fqdn,
-        samples_dns.c.record_type,
-        samples_dns.c.resolver,
-        samples_dns.c.latency_ms,
-        samples_dns.c.rcode,
-        samples_dns.c.success,
-    ).where(samples_dns.c.ts >= start, samples_dns.c.ts <= end)
-    if fqdn:
-        stmt = stmt.where(samples_dns.c.fqdn == fqdn)
-    async with engine.begin() as conn:
-        rows = (await conn.execute(stmt)).mappings().all()
-    return [dict(r) for r in rows]
+CONFIG_TABLES = {
+    "tcp": targets_tcp,
+    "dns": jobs_dns,
+    "http": jobs_http,
+}
 
+
+async def fetch_config_rows(engine: AsyncEngine) -> Dict[str, List[Dict[str, Any]]]:
+    """All persisted targets/jobs, one SELECT per table on a single connection."""
+    result: Dict[str, List[Dict[str, Any]]] = {}
+    async with engine.connect() as conn:
+        for kind, table in CONFIG_TABLES.items():
+            rows = (await conn.execute(select(table))).mappings().all()
+            result[kind] = [dict(r) for r in rows]
+    return result
+
+
+async def fetch_setting(engine: AsyncEngine, key: str) -> Optional[str]:
+    async with engine.connect() as conn:
+        return (await conn.execute(select(app_settings.c.value).where(app_settings.c.key == key))).scalar()
+
+
+async def apply_config_rows(
+    engine: AsyncEngine,
+    upserts: Dict[str, List[Dict[str, Any]]],
+    deletes: Dict[str, List[str]],
+    settings: Optional[Dict[str, str]] = None,
+) -> None:
+    """Upsert and delete config rows for several kinds (and ``settings``) in one transaction."""
+    async with engine.begin() as conn:
+        if settings:
+            await conn.execute(
+                insert(app_settings).prefix_with("OR REPLACE"),
+                [{"key": key, "value": value} for key, value in settings.items()],
+            )
+        for kind, ids in deletes.items():
+            table = CONFIG_TABLES[kind]
+            # Chunked to stay under SQLite's bound-parameter limit
+            for i in range(0, len(ids), 10000):
+                await conn.execute(delete(table).where(table.c.id.in_(ids[i:i + 10000])))
+        for kind, rows in upserts.items():
+            if rows:
+                await conn.execute(insert(CONFIG_TABLES[kind]).prefix_with("OR REPLACE"), rows)
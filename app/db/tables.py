@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    MetaData, Table, Column, Integer, String, Float, Boolean, DateTime, Text, JSON, Index
+    MetaData, Table, Column, Integer, String, Float, Boolean, DateTime, Text, JSON, Index, LargeBinary
 )
 
 
@@ -13,6 +13,7 @@ targets_tcp = Table(
     Column("host", String, nullable=False),
     Column("port", Integer, nullable=False, default=443),
     Column("interval_sec", Float, nullable=False, default=5.0),
+    Column("family", String, nullable=True, default="both"),  # both | v4 | v6
 )
 
 
@@ -34,6 +35,7 @@ jobs_http = Table(
     Column("url", String, nullable=False),
     Column("method", String, nullable=False, default="GET"),
     Column("interval_sec", Float, nullable=False, default=5.0),
+    Column("mode", String, nullable=True, default="cold"),  # cold | warm
 )
 
 
@@ -47,6 +49,13 @@ samples_tcp = Table(
     Column("port", Integer, nullable=False),
     Column("latency_ms", Float, nullable=False),
     Column("success", Boolean, nullable=False),
+    Column("resolve_ms", Float, nullable=True),
+    Column("connect_ms", Float, nullable=True),
+    Column("address", String, nullable=True),  # address that won the connect race
+    Column("family", String, nullable=True),
+    # Worst event-loop lag seen while the probe was in flight (see app/utils/loop_monitor.py)
+    Column("loop_lag_ms", Float, nullable=True),
+    Column("vantage", String, nullable=True),  # probing agent; NULL for this instance's own probes
     Index("idx_tcp_ts", "ts"),
 )
 
@@ -63,6 +72,8 @@ samples_dns = Table(
     Column("latency_ms", Float, nullable=False),
     Column("rcode", String, nullable=True),
     Column("success", Boolean, nullable=False),
+    Column("loop_lag_ms", Float, nullable=True),
+    Column("vantage", String, nullable=True),
     Index("idx_dns_ts", "ts"),
 )
 
@@ -79,6 +90,15 @@ samples_http = Table(
     Column("latency_ms", Float, nullable=False),
     Column("success", Boolean, nullable=False),
     Column("error", String, nullable=True),
+    # Phase breakdown; dns/connect/tls are NULL when a keep-alive connection was reused
+    Column("dns_ms", Float, nullable=True),
+    Column("connect_ms", Float, nullable=True),
+    Column("tls_ms", Float, nullable=True),
+    Column("ttfb_ms", Float, nullable=True),
+    Column("transfer_ms", Float, nullable=True),
+    Column("reused", Boolean, nullable=True),
+    Column("loop_lag_ms", Float, nullable=True),
+    Column("vantage", String, nullable=True),
     Index("idx_http_ts", "ts"),
 )
 
@@ -97,6 +117,7 @@ aggregates_tcp_1m = Table(
     Column("avg", Float, nullable=True),
     Column("min", Float, nullable=True),
     Column("max", Float, nullable=True),
+    Column("sketch", LargeBinary, nullable=True),  # encoded app.utils.sketch of latencies
 )
 
 
@@ -113,6 +134,7 @@ aggregates_dns_1m = Table(
     Column("avg", Float, nullable=True),
     Column("min", Float, nullable=True),
     Column("max", Float, nullable=True),
+    Column("sketch", LargeBinary, nullable=True),  # encoded app.utils.sketch of latencies
 )
 
 
@@ -129,5 +151,76 @@ aggregates_http_1m = Table(
     Column("avg", Float, nullable=True),
     Column("min", Float, nullable=True),
     Column("max", Float, nullable=True),
+    Column("sketch", LargeBinary, nullable=True),  # encoded app.utils.sketch of latencies
 )
 
+
+
+# Coarser downsampling tiers share the 1-minute layout and are built from the tier below
+def _aggregate_table(name: str, *key_columns: Column) -> Table:
+    return Table(
+        name,
+        metadata,
+        Column("bucket", DateTime, primary_key=True),
+        *key_columns,
+        Column("count", Integer, nullable=False),
+        Column("success_count", Integer, nullable=False),
+        Column("p50", Float, nullable=True),
+        Column("p95", Float, nullable=True),
+        Column("avg", Float, nullable=True),
+        Column("min", Float, nullable=True),
+        Column("max", Float, nullable=True),
+        Column("sketch", LargeBinary, nullable=True),
+    )
+
+
+def _tcp_keys():
+    return Column("host", String, primary_key=True), Column("port", Integer, primary_key=True)
+
+
+def _dns_keys():
+    return Column("fqdn", String, primary_key=True), Column("resolver", String, primary_key=True)
+
+
+def _http_keys():
+    return Column("url", String, primary_key=True), Column("method", String, primary_key=True)
+
+
+aggregates_tcp_5m = _aggregate_table("aggregates_tcp_5m", *_tcp_keys())
+aggregates_tcp_1h = _aggregate_table("aggregates_tcp_1h", *_tcp_keys())
+aggregates_tcp_1d = _aggregate_table("aggregates_tcp_1d", *_tcp_keys())
+aggregates_dns_5m = _aggregate_table("aggregates_dns_5m", *_dns_keys())
+aggregates_dns_1h = _aggregate_table("aggregates_dns_1h", *_dns_keys())
+aggregates_dns_1d = _aggregate_table("aggregates_dns_1d", *_dns_keys())
+aggregates_http_5m = _aggregate_table("aggregates_http_5m", *_http_keys())
+aggregates_http_1h = _aggregate_table("aggregates_http_1h", *_http_keys())
+aggregates_http_1d = _aggregate_table("aggregates_http_1d", *_http_keys())
+
+
+# Tier buckets whose source rows changed and must be rebuilt (tier = "5m"/"1h"/"1d")
+rollup_dirty = Table(
+    "rollup_dirty",
+    metadata,
+    Column("tier", String, primary_key=True),
+    Column("kind", String, primary_key=True),
+    Column("bucket", DateTime, primary_key=True),
+)
+
+
+# Incremental rollup progress: highest sample id already folded into aggregates
+rollup_watermarks = Table(
+    "rollup_watermarks",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("last_id", Integer, nullable=False),
+    Column("updated_at", DateTime, nullable=True),
+)
+
+
+# Small key/value facts about this database (e.g. whether the default config was seeded)
+app_settings = Table(
+    "app_settings",
+    metadata,
+    Column("key", String, primary_key=True),
+    Column("value", String, nullable=True),
+)
@@ -1,3 +1,4 @@
+import os
 from contextlib import asynccontextmanager
 from typing import AsyncIterator, Dict, Any
 
@@ -7,17 +8,24 @@ from app.routers.ping import router as ping_router
 from app.routers.stream import router as stream_router
 from app.routers.metrics import router as metrics_router
 from app.routers.config import router as config_router
-from app.routers.http_probe import router as http_router
+from app.routers.http_probe import router as http_router, create_http_clients, close_http_clients
+from app.routers.ingest import router as ingest_router
 from app.utils.event_bus import create_event_bus
 from app.utils.ring_buffer import create_ring_buffer
+from app.utils.address_cache import create_address_cache
+from app.utils.loop_monitor import create_loop_monitor
 from fastapi.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
 from starlette.staticfiles import StaticFiles
-from app.services.scheduler import run_scheduler
+from app.services.scheduler import notify_config_changed, run_scheduler
+from app.services.config_registry import create_config_registry
 from app.db.engine import create_engine_and_init
 from app.db.repo import init_schema
 import anyio
 from app.services.rollups import run_maintenance
+from app.services.sample_writer import create_sample_writer
+from app.services.measurement import create_measurement_engine
+from app.services.probe_workers import run_probe_workers
 
 
 def create_app_state() -> Dict[str, Any]:
@@ -28,6 +36,9 @@ def create_app_state() -> Dict[str, Any]:
         },
         "event_bus": create_event_bus(),
         "ring_buffer": create_ring_buffer(),
+        "address_cache": create_address_cache(),
+        "resolver_limiters": {},
+        "loop_monitor": create_loop_monitor(),
     }
 
 
@@ -38,20 +49,46 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     engine = await create_engine_and_init()
     await init_schema(engine)
     app.state.runtime["db_engine"] = engine
+    registry = create_config_registry(engine, on_change=lambda: notify_config_changed(app))
+    await registry["load"]()
+    app.state.runtime["config_registry"] = registry
+    app.state.runtime["config"] = registry["snapshot"]()
+    writer = create_sample_writer(engine)
+    app.state.runtime["sample_writer"] = writer
+    app.state.runtime["http_clients"] = create_http_clients()
+    # MEASUREMENT_LOOPS > 0 moves probe timing onto that many dedicated event loops
+    measurement = None
+    loops = int(os.environ.get("MEASUREMENT_LOOPS", "0") or 0)
+    if loops > 0:
+        measurement = create_measurement_engine(loops)
+        await measurement["start"]()
+        app.state.runtime["measurement"] = measurement
     async with anyio.create_task_group() as tg:
-        tg.start_soon(run_scheduler, app)
+        tg.start_soon(app.state.runtime["loop_monitor"]["run"])
+        tg.start_soon(writer["run"])
+        # PROBE_WORKERS > 0 runs the probes in that many worker processes, sharded by target
+        probe_workers = int(os.environ.get("PROBE_WORKERS", "0") or 0)
+        if probe_workers > 0:
+            tg.start_soon(run_probe_workers, app, probe_workers)
+        else:
+            tg.start_soon(run_scheduler, app)
         tg.start_soon(run_maintenance, app)
         try:
             yield
         finally:
             tg.cancel_scope.cancel()
-            # Dispose DB engine to shutdown aiosqlite worker thread cleanly
-            engine = app.state.runtime.get("db_engine")
-            if engine is not None:
-                try:
-                    await engine.dispose()
-                except Exception:
-                    pass
+    if measurement is not None:
+        await measurement["stop"]()
+    # Probe loops are stopped now; commit whatever they queued before exiting
+    await writer["close"]()
+    await close_http_clients(app.state.runtime["http_clients"])
+    # Dispose DB engine to shutdown aiosqlite worker thread cleanly
+    engine = app.state.runtime.get("db_engine")
+    if engine is not None:
+        try:
+            await engine.dispose()
+        except Exception:
+            pass
     app.state.runtime["in_memory_store"]["started"] = False
 
 
@@ -84,6 +121,7 @@ app.include_router(stream_router)
 app.include_router(metrics_router)
 app.include_router(config_router)
 app.include_router(http_router)
+app.include_router(ingest_router)
 
 # Serve static frontend (fallback index.html)
 app.mount("/", StaticFiles(directory="app/static", html=True), name="static")
@@ -1,7 +1,8 @@
-from typing import Any, Dict, List, Optional
+import json
+from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi import APIRouter, HTTPException, Request
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 
 
 router = APIRouter(prefix="/api/config", tags=["config"])
@@ -12,6 +13,7 @@ class TcpTarget(BaseModel):
     host: str
     port: int = 443
     interval_sec: float = Field(5.0, ge=0.5, le=60.0)
+    family: str = Field("both", pattern="^(both|v4|v6)$")
 
 
 class DnsJob(BaseModel):
@@ -29,121 +31,174 @@ class ConfigState(BaseModel):
     http: List[Dict[str, Any]] = []
 
 
-def _get_config(app) -> Dict[str, Any]:
-    cfg = app.state.runtime.setdefault("config", {
-        "version": 1,
-        "tcp": [
-            {"id": "cf-1.1.1.1", "host": "1.1.1.1", "port": 443, "interval_sec": 5.0},
-            {"id": "ggl-8.8.8.8", "host": "8.8.8.8", "port": 443, "interval_sec": 5.0},
-        ],
-        "dns": [
-            {"id": "dns-google", "fqdn": "google.com", "record_type": "A", "resolvers": ["1.1.1.1", "8.8.8.8"], "interval_sec": 5.0},
-        ],
-        "http": [
-            {"id": "http-google", "url": "https://www.google.com", "method": "GET", "interval_sec": 10.0},
-        ],
-    })
-    # Normalize: assign IDs if missing (scheduler defaults may omit them)
-    tcp = []
-    for i, t in enumerate(cfg.get("tcp", [])):
-        if "id" not in t or not t["id"]:
-            t = dict(t)
-            t["id"] = f"tcp-{t.get('host','host')}-{t.get('port','0')}-{i}"
-        tcp.append(t)
-    dns = []
-    for i, d in enumerate(cfg.get("dns", [])):
-        if "id" not in d or not d["id"]:
-            d = dict(d)
-            d["id"] = f"dns-{d.get('fqdn','name')}-{i}"
-        dns.append(d)
-    http = []
-    for i, h in enumerate(cfg.get("http", [])):
-        if "id" not in h or not h["id"]:
-            h = dict(h)
-            h["id"] = f"http-{h.get('method','GET')}-{i}"
-        http.append(h)
-    cfg["tcp"], cfg["dns"], cfg["http"] = tcp, dns, http
-    return cfg
+class HttpJob(BaseModel):
+    id: str
+    url: str
+    method: str = "GET"
+    interval_sec: float = Field(10.0, ge=0.5, le=120.0)
+    mode: str = Field("cold", pattern="^(cold|warm)$")
+
+
+def _registry(app) -> Dict[str, Any]:
+    return app.state.runtime["config_registry"]
+
+
+def _state(registry: Dict[str, Any]) -> ConfigState:
+    cfg = registry["snapshot"]()
+    return ConfigState(
+        version=cfg["version"],
+        tcp=registry["entries"]("tcp"),
+        dns=registry["entries"]("dns"),
+        http=registry["entries"]("http"),
+    )
+
+
+async def _add(request: Request, kind: str, entry: BaseModel, label: str) -> ConfigState:
+    registry = _registry(request.app)
+    if registry["get"](kind, entry.id) is not None:
+        raise HTTPException(status_code=409, detail=f"{label} id exists")
+    await registry["apply"](upserts={kind: [entry.model_dump()]})
+    return _state(registry)
+
+
+async def _delete(request: Request, kind: str, entry_id: str) -> ConfigState:
+    registry = _registry(request.app)
+    if registry["get"](kind, entry_id) is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    await registry["apply"](deletes={kind: [entry_id]})
+    return _state(registry)
 
 
 @router.get("/state", response_model=ConfigState)
 async def get_state(request: Request) -> ConfigState:
-    cfg = _get_config(request.app)
-    # Validate/normalize to model instances to guarantee IDs exist
-    tcp = [TcpTarget(**t) for t in cfg.get("tcp", [])]
-    dns = [DnsJob(**d) for d in cfg.get("dns", [])]
-    http = cfg.get("http", [])
-    return ConfigState(version=cfg["version"], tcp=tcp, dns=dns, http=http)
+    return _state(_registry(request.app))
 
 
 @router.post("/tcp", response_model=ConfigState)
 async def add_tcp(request: Request, target: TcpTarget) -> ConfigState:
-    cfg = _get_config(request.app)
-    if any(t["id"] == target.id for t in cfg["tcp"]):
-        raise HTTPException(status_code=409, detail="TCP target id exists")
-    cfg["tcp"].append(target.model_dump())
-    cfg["version"] += 1
-    return ConfigState(version=cfg["version"], tcp=cfg["tcp"], dns=cfg["dns"], http=cfg.get("http", []))
+    return await _add(request, "tcp", target, "TCP target")
 
 
 @router.delete("/tcp/{target_id}", response_model=ConfigState)
 async def delete_tcp(request: Request, target_id: str) -> ConfigState:
-    cfg = _get_config(request.app)
-    before = len(cfg["tcp"])
-    cfg["tcp"] = [t for t in cfg["tcp"] if t["id"] != target_id]
-    if len(cfg["tcp"]) == before:
-        raise HTTPException(status_code=404, detail="Not found")
-    cfg["version"] += 1
-    return ConfigState(version=cfg["version"], tcp=cfg["tcp"], dns=cfg["dns"], http=cfg.get("http", []))
+    return await _delete(request, "tcp", target_id)
 
 
 @router.post("/dns", response_model=ConfigState)
 async def add_dns(request: Request, job: DnsJob) -> ConfigState:
-    cfg = _get_config(request.app)
-    if any(j["id"] == job.id for j in cfg["dns"]):
-        raise HTTPException(status_code=409, detail="DNS job id exists")
-    cfg["dns"].append(job.model_dump())
-    cfg["version"] += 1
-    return ConfigState(version=cfg["version"], tcp=cfg["tcp"], dns=cfg["dns"], http=cfg.get("http", []))
+    return await _add(request, "dns", job, "DNS job")
 
 
 @router.delete("/dns/{job_id}", response_model=ConfigState)
 async def delete_dns(request: Request, job_id: str) -> ConfigState:
-    cfg = _get_config(request.app)
-    before = len(cfg["dns"])
-    cfg["dns"] = [j for j in cfg["dns"] if j["id"] != job_id]
-    if len(cfg["dns"]) == before:
-        raise HTTPException(status_code=404, detail="Not found")
-    cfg["version"] += 1
-    return ConfigState(version=cfg["version"], tcp=cfg["tcp"], dns=cfg["dns"], http=cfg.get("http", []))
-
-
-class HttpJob(BaseModel):
-    id: str
-    url: str
-    method: str = "GET"
-    interval_sec: float = Field(10.0, ge=0.5, le=120.0)
+    return await _delete(request, "dns", job_id)
 
 
 @router.post("/http", response_model=ConfigState)
 async def add_http(request: Request, job: HttpJob) -> ConfigState:
-    cfg = _get_config(request.app)
-    http = cfg.setdefault("http", [])
-    if any(j["id"] == job.id for j in http):
-        raise HTTPException(status_code=409, detail="HTTP job id exists")
-    http.append(job.model_dump())
-    cfg["version"] += 1
-    return ConfigState(version=cfg["version"], tcp=cfg["tcp"], dns=cfg["dns"], http=http)
+    return await _add(request, "http", job, "HTTP job")
 
 
 @router.delete("/http/{job_id}", response_model=ConfigState)
 async def delete_http(request: Request, job_id: str) -> ConfigState:
-    cfg = _get_config(request.app)
-    http = cfg.setdefault("http", [])
-    before = len(http)
-    cfg["http"] = [j for j in http if j["id"] != job_id]
-    if len(cfg["http"]) == before:
-        raise HTTPException(status_code=404, detail="Not found")
-    cfg["version"] += 1
-    return ConfigState(version=cfg["version"], tcp=cfg["tcp"], dns=cfg["dns"], http=cfg["http"])
+    return await _delete(request, "http", job_id)
+
+
+# Bulk endpoints: validate a whole batch, apply it in one transaction and one version bump
 
+MODELS = {"tcp": TcpTarget, "dns": DnsJob, "http": HttpJob}
+_ADAPTERS = {kind: TypeAdapter(List[model]) for kind, model in MODELS.items()}
+
+
+class ConfigDiff(BaseModel):
+    version: int
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    unchanged: int = 0
+
+
+class BulkDelete(BaseModel):
+    ids: List[str]
+
+
+def _kind(kind: str) -> str:
+    if kind not in MODELS:
+        raise HTTPException(status_code=404, detail="Unknown config kind")
+    return kind
+
+
+async def _read_entries(request: Request, kind: str) -> List[Dict[str, Any]]:
+    """Parse a JSON array or NDJSON body (one object per line) into validated entries."""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body or b"[]")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {exc}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array or NDJSON")
+    try:
+        entries = [m.model_dump() for m in _ADAPTERS[kind].validate_python(items)]
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=exc.errors(include_url=False, include_context=False))
+    seen = set()
+    for entry in entries:
+        if entry["id"] in seen:
+            raise HTTPException(status_code=422, detail=f"Duplicate id in batch: {entry['id']}")
+        seen.add(entry["id"])
+    return entries
+
+
+def _plan(registry: Dict[str, Any], kind: str, entries: List[Dict[str, Any]],
+          replace: bool = False) -> Tuple[List[Dict[str, Any]], List[str], Dict[str, int]]:
+    upserts: List[Dict[str, Any]] = []
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+    for entry in entries:
+        current = registry["get"](kind, entry["id"])
+        if current is None:
+            counts["added"] += 1
+        elif current == entry:
+            counts["unchanged"] += 1
+            continue
+        else:
+            counts["updated"] += 1
+        upserts.append(entry)
+    deletes: List[str] = []
+    if replace:
+        keep = {entry["id"] for entry in entries}
+        deletes = [e["id"] for e in registry["entries"](kind) if e["id"] not in keep]
+        counts["removed"] = len(deletes)
+    return upserts, deletes, counts
+
+
+@router.post("/{kind}/bulk", response_model=ConfigDiff)
+async def bulk_upsert(request: Request, kind: str) -> ConfigDiff:
+    kind = _kind(kind)
+    entries = await _read_entries(request, kind)
+    registry = _registry(request.app)
+    upserts, _, counts = _plan(registry, kind, entries)
+    version = await registry["apply"](upserts={kind: upserts})
+    return ConfigDiff(version=version, **counts)
+
+
+@router.post("/{kind}/bulk/delete", response_model=ConfigDiff)
+async def bulk_delete(request: Request, kind: str, payload: BulkDelete) -> ConfigDiff:
+    kind = _kind(kind)
+    registry = _registry(request.app)
+    ids = [i for i in dict.fromkeys(payload.ids) if registry["get"](kind, i) is not None]
+    version = await registry["apply"](deletes={kind: ids})
+    return ConfigDiff(version=version, removed=len(ids))
+
+
+@router.put("/{kind}", response_model=ConfigDiff)
+async def replace_all(request: Request, kind: str) -> ConfigDiff:
+    kind = _kind(kind)
+    entries = await _read_entries(request, kind)
+    registry = _registry(request.app)
+    upserts, deletes, counts = _plan(registry, kind, entries, replace=True)
+    version = await registry["apply"](upserts={kind: upserts}, deletes={kind: deletes})
+    return ConfigDiff(version=version, **counts)
@@ -1,10 +1,19 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+import functools
 import time
 
+import anyio
+
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, Field
 
 try:
+    import dns.asyncquery  # type: ignore
+    import dns.exception  # type: ignore
+    import dns.inet  # type: ignore
+    import dns.message  # type: ignore
+    import dns.rcode  # type: ignore
+    import dns.rdatatype  # type: ignore
     import dns.resolver  # type: ignore
 except Exception as exc:  # pragma: no cover
     dns = None
@@ -36,66 +45,146 @@ class DnsQueryResponse(BaseModel):
     answers: List[DnsAnswer]
 
 
-async def resolve_dns(request: DnsQueryRequest) -> DnsQueryResponse:
-    if dns is None:
-        raise HTTPException(status_code=500, detail="dnspython is not installed")
+@functools.lru_cache(maxsize=1)
+def system_nameservers() -> Tuple[str, ...]:
+    """Nameservers from resolv.conf, parsed once per process instead of per query."""
+    try:
+        return tuple(ns for ns in dns.resolver.Resolver().nameservers if dns.inet.is_address(ns))  # type: ignore[attr-defined]
+    except Exception:
+        return ()
 
-    resolver = dns.resolver.Resolver()  # type: ignore[attr-defined]
-    if request.resolvers:
-        resolver.nameservers = request.resolvers
-    resolver.lifetime = request.timeout_sec
-    resolver.timeout = request.timeout_sec
 
+def _failed(fqdn: str, record_type: str, nameserver: str, rcode: str, elapsed_ms: float) -> DnsQueryResponse:
+    return DnsQueryResponse(
+        fqdn=fqdn,
+        record_type=record_type,
+        resolver=nameserver,
+        latency_ms=elapsed_ms,
+        rcode=rcode,
+        success=False,
+        answers=[],
+    )
+
+
+async def query_nameserver(
+    fqdn: str, record_type: str, nameserver: str, timeout_sec: float, port: int = 53
+) -> DnsQueryResponse:
+    """Send one query to one nameserver on the event loop (UDP, TCP on truncation).
+
+    ``nameserver`` may carry a port as ``ip#port``.
+    """
+    address, _, port_text = nameserver.partition("#")
     start = time.perf_counter()
     try:
-        answer = await _resolve_async(resolver, request.fqdn, request.record_type)
-    except dns.resolver.NXDOMAIN:  # type: ignore[attr-defined]
-        elapsed_ms = (time.perf_counter() - start) * 1000.0
-        return DnsQueryResponse(
-            fqdn=request.fqdn,
-            record_type=request.record_type,
-            resolver=resolver.nameservers[0] if resolver.nameservers else None,
-            latency_ms=elapsed_ms,
-            rcode="NXDOMAIN",
-            success=False,
-            answers=[],
-        )
-    except dns.resolver.Timeout:  # type: ignore[attr-defined]
-        elapsed_ms = (time.perf_counter() - start) * 1000.0
-        return DnsQueryResponse(
-            fqdn=request.fqdn,
-            record_type=request.record_type,
-            resolver=resolver.nameservers[0] if resolver.nameservers else None,
-            latency_ms=elapsed_ms,
-            rcode="TIMEOUT",
-            success=False,
-            answers=[],
-        )
-    except Exception as exc:  # pragma: no cover
-        elapsed_ms = (time.perf_counter() - start) * 1000.0
-        raise HTTPException(status_code=500, detail=f"DNS error: {exc}") from exc
-
+        rdtype = dns.rdatatype.from_text(record_type)  # type: ignore[attr-defined]
+        query = dns.message.make_query(fqdn, rdtype)  # type: ignore[attr-defined]
+        response, _ = await dns.asyncquery.udp_with_fallback(  # type: ignore[attr-defined]
+            query, address, timeout=timeout_sec, port=int(port_text) if port_text else port
+        )  # type: ignore[attr-defined]
+    except dns.exception.Timeout:  # type: ignore[attr-defined]
+        return _failed(fqdn, record_type, nameserver, "TIMEOUT", (time.perf_counter() - start) * 1000.0)
+    except Exception:
+        return _failed(fqdn, record_type, nameserver, "ERROR", (time.perf_counter() - start) * 1000.0)
     elapsed_ms = (time.perf_counter() - start) * 1000.0
-    records = [DnsAnswer(value=str(rdata)) for rdata in answer]
+
+    rcode = dns.rcode.to_text(response.rcode())  # type: ignore[attr-defined]
+    records = [
+        DnsAnswer(value=rdata.to_text())
+        for rrset in response.answer
+        if rrset.rdtype == rdtype
+        for rdata in rrset
+    ]
     return DnsQueryResponse(
-        fqdn=request.fqdn,
-        record_type=request.record_type,
-        resolver=answer.response.nameserver if hasattr(answer.response, "nameserver") else None,  # type: ignore[attr-defined]
+        fqdn=fqdn,
+        record_type=record_type,
+        resolver=nameserver,
         latency_ms=elapsed_ms,
-        rcode="NOERROR",
-        success=True,
+        rcode=rcode,
+        success=rcode == "NOERROR" and bool(records),
         answers=records,
     )
 
 
-async def _resolve_async(resolver: "dns.resolver.Resolver", fqdn: str, record_type: str):  # type: ignore[name-defined]
-    # dnspython is sync; run in thread to avoid blocking event loop
-    import anyio
+async def resolve_dns(request: DnsQueryRequest) -> DnsQueryResponse:
+    if dns is None:
+        raise HTTPException(status_code=500, detail="dnspython is not installed")
+
+    nameservers = list(request.resolvers or system_nameservers())
+    if not nameservers:
+        raise HTTPException(status_code=500, detail="No DNS resolvers configured")
+
+    # Like a stub resolver: try nameservers in order until one answers, within timeout_sec overall
+    deadline = time.monotonic() + request.timeout_sec
+    result: Optional[DnsQueryResponse] = None
+    for nameserver in nameservers:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not dns.inet.is_address(nameserver.partition("#")[0]):  # type: ignore[attr-defined]
+            raise HTTPException(status_code=400, detail=f"Resolver must be an IP address: {nameserver}")
+        attempt = await query_nameserver(request.fqdn, request.record_type, nameserver, remaining)
+        if result is not None:
+            # Report time spent across all attempts, as the old blocking resolver did
+            attempt.latency_ms += result.latency_ms
+        result = attempt
+        if attempt.rcode not in ("TIMEOUT", "ERROR"):
+            break
+    assert result is not None
+    return result
+
+
+# In-flight cap per resolver, so a slow resolver queues only its own queries
+RESOLVER_CONCURRENCY = 64
+FANOUT_SLACK_SEC = 0.5
 
-    def _blocking_query():
-        return resolver.resolve(fqdn, record_type)
 
-    return await anyio.to_thread.run_sync(_blocking_query)
+def _resolver_limiter(limiters: Dict[str, anyio.CapacityLimiter], nameserver: str) -> anyio.CapacityLimiter:
+    limiter = limiters.get(nameserver)
+    if limiter is None:
+        limiter = limiters[nameserver] = anyio.CapacityLimiter(RESOLVER_CONCURRENCY)
+    return limiter
+
+
+async def resolve_dns_fanout(
+    request: DnsQueryRequest, limiters: Optional[Dict[str, anyio.CapacityLimiter]] = None
+) -> List[DnsQueryResponse]:
+    """Query every resolver concurrently and return one response per resolver.
+
+    The batch takes as long as the slowest resolver (bounded by timeout_sec
+    plus a little slack). A resolver that has not answered by then, including
+    one whose in-flight cap stayed exhausted, is reported as a TIMEOUT
+    failure, so an outage shows up in the samples instead of vanishing.
+
+    ``limiters`` holds the per-resolver caps. A limiter belongs to the event
+    loop that created it, so each loop passes its own dict (the
+    ``resolver_limiters`` of its measurement context); without one the caps
+    apply to this call only.
+    """
+    if dns is None:
+        raise HTTPException(status_code=500, detail="dnspython is not installed")
+    nameservers = list(request.resolvers or system_nameservers()[:1])
+    if not nameservers:
+        raise HTTPException(status_code=500, detail="No DNS resolvers configured")
+    results: List[Optional[DnsQueryResponse]] = [None] * len(nameservers)
+    limiters = {} if limiters is None else limiters
+
+    async def _one(index: int, nameserver: str) -> None:
+        start = time.perf_counter()
+        # Slack past the query's own timeout, so query_nameserver reports its TIMEOUT itself
+        with anyio.move_on_after(request.timeout_sec + FANOUT_SLACK_SEC):
+            async with _resolver_limiter(limiters, nameserver):
+                results[index] = await query_nameserver(
+                    request.fqdn, request.record_type, nameserver, request.timeout_sec
+                )
+        if results[index] is None:
+            results[index] = _failed(
+                request.fqdn, request.record_type, nameserver, "TIMEOUT", (time.perf_counter() - start) * 1000.0
+            )
+
+    async with anyio.create_task_group() as tg:
+        for index, nameserver in enumerate(nameservers):
+            tg.start_soon(_one, index, nameserver)
+    return [r for r in results if r is not None]
 
 
 @router.post("/query", response_model=DnsQueryResponse)
@@ -1,18 +1,26 @@
-from typing import Optional
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Optional
+import socket
 import time
 
+import anyio
+import httpcore
 import httpx
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from pydantic import BaseModel, Field
 
 
 router = APIRouter(prefix="/api/http", tags=["http"])
 
+# Per-probe timing sink filled in by the network backend (DNS / TCP connect)
+_probe_timings: ContextVar[Optional[Dict[str, Any]]] = ContextVar("http_probe_timings", default=None)
+
 
 class HttpProbeRequest(BaseModel):
     url: str
     timeout_sec: float = Field(5.0, ge=0.5, le=30.0)
     method: str = Field("GET")
+    mode: str = Field("cold", pattern="^(cold|warm)$", description="cold: new connection per probe; warm: reuse keep-alive")
 
 
 class HttpProbeResponse(BaseModel):
@@ -20,26 +28,237 @@ class HttpProbeResponse(BaseModel):
     method: str
     status_code: Optional[int]
     latency_ms: float
+    dns_ms: Optional[float] = None
+    connect_ms: Optional[float] = None
     tls_ms: Optional[float] = None
+    ttfb_ms: Optional[float] = None
+    transfer_ms: Optional[float] = None
+    reused: Optional[bool] = None
     success: bool
     error: Optional[str] = None
 
 
-async def probe_http(url: str, method: str, timeout_sec: float) -> HttpProbeResponse:
+class _TimedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """Resolves hosts itself so DNS time is reported apart from TCP connect time."""
+
+    def __init__(self, inner: Optional[httpcore.AsyncNetworkBackend] = None) -> None:
+        self._inner = inner or httpcore.AnyIOBackend()
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        timings = _probe_timings.get()
+        started = time.perf_counter()
+        try:
+            with anyio.fail_after(timeout):
+                addrinfos = await anyio.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except TimeoutError as exc:
+            raise httpcore.ConnectTimeout(f"DNS timeout for {host}") from exc
+        except OSError as exc:
+            raise httpcore.ConnectError(str(exc)) from exc
+        resolved = time.perf_counter()
+        if timings is not None:
+            timings["dns_ms"] = (resolved - started) * 1000.0
+        last_exc: Optional[Exception] = None
+        for *_, sockaddr in addrinfos:
+            try:
+                stream = await self._inner.connect_tcp(
+                    sockaddr[0], port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as exc:  # try next addr
+                last_exc = exc
+                continue
+            if timings is not None:
+                timings["connect_ms"] = (time.perf_counter() - resolved) * 1000.0
+            return stream
+        raise last_exc or httpcore.ConnectError(f"No addresses resolved for {host}")
+
+    async def connect_unix_socket(
+        self, path: str, timeout: Optional[float] = None, socket_options: Optional[Iterable[Any]] = None
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._inner.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._inner.sleep(seconds)
+
+
+# httpcore errors as the httpx ones callers expect (most specific class first in the MRO)
+_HTTPX_ERRORS = {
+    httpcore.ConnectTimeout: httpx.ConnectTimeout,
+    httpcore.ReadTimeout: httpx.ReadTimeout,
+    httpcore.WriteTimeout: httpx.WriteTimeout,
+    httpcore.PoolTimeout: httpx.PoolTimeout,
+    httpcore.TimeoutException: httpx.TimeoutException,
+    httpcore.ConnectError: httpx.ConnectError,
+    httpcore.ReadError: httpx.ReadError,
+    httpcore.WriteError: httpx.WriteError,
+    httpcore.NetworkError: httpx.NetworkError,
+    httpcore.ProxyError: httpx.ProxyError,
+    httpcore.UnsupportedProtocol: httpx.UnsupportedProtocol,
+    httpcore.RemoteProtocolError: httpx.RemoteProtocolError,
+    httpcore.LocalProtocolError: httpx.LocalProtocolError,
+    httpcore.ProtocolError: httpx.ProtocolError,
+}
+
+
+def _httpx_error(exc: Exception) -> Exception:
+    for cls in type(exc).__mro__:
+        if cls in _HTTPX_ERRORS:
+            return _HTTPX_ERRORS[cls](str(exc))
+    return exc
+
+
+class _PoolResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream: Any) -> None:
+        self._stream = stream
+
+    async def __aiter__(self):
+        try:
+            async for part in self._stream:
+                yield part
+        except (httpcore.TimeoutException, httpcore.NetworkError, httpcore.ProtocolError) as exc:
+            raise _httpx_error(exc) from exc
+
+    async def aclose(self) -> None:
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+
+class _PoolTransport(httpx.AsyncBaseTransport):
+    """httpx transport over an httpcore pool built here.
+
+    httpx does not take a network backend, so the pool with the timed
+    backend is created directly and requests are handed to it.
+    """
+
+    def __init__(self, pool: httpcore.AsyncConnectionPool) -> None:
+        self._pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        try:
+            response = await self._pool.handle_async_request(core_request)
+        except Exception as exc:
+            error = _httpx_error(exc)
+            if error is exc:
+                raise
+            raise error from exc
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_PoolResponseStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._pool.aclose()
+
+
+def create_http_clients(max_connections: int = 200, max_keepalive_connections: int = 100) -> Dict[str, httpx.AsyncClient]:
+    """Long-lived probe clients sharing one SSL context.
+
+    ``cold`` only ever sends ``Connection: close`` so it never holds idle
+    connections and every probe pays DNS + connect + TLS; ``warm`` keeps
+    bounded keep-alive connections for reuse.
+    """
+    ssl_context = httpx.create_ssl_context()
+    clients: Dict[str, httpx.AsyncClient] = {}
+    for mode, keepalive in (("cold", 0), ("warm", max_keepalive_connections)):
+        pool = httpcore.AsyncConnectionPool(
+            ssl_context=ssl_context,
+            max_connections=max_connections,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=30.0,
+            network_backend=_TimedNetworkBackend(),
+        )
+        clients[mode] = httpx.AsyncClient(transport=_PoolTransport(pool))
+    return clients
+
+
+async def close_http_clients(clients: Dict[str, httpx.AsyncClient]) -> None:
+    for client in clients.values():
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
+
+async def probe_http(
+    url: str,
+    method: str,
+    timeout_sec: float,
+    clients: Optional[Dict[str, httpx.AsyncClient]] = None,
+    mode: str = "cold",
+) -> HttpProbeResponse:
+    if clients is None:
+        # Ad-hoc probe outside the app lifespan; build (and discard) a private pool
+        clients = create_http_clients(max_connections=1, max_keepalive_connections=1)
+        try:
+            return await probe_http(url, method, timeout_sec, clients, mode)
+        finally:
+            await close_http_clients(clients)
+
+    timings: Dict[str, Any] = {}
+    marks: Dict[str, float] = {}
+
+    async def trace(event_name: str, info: Dict[str, Any]) -> None:
+        # e.g. "connection.start_tls.complete" -> "start_tls.complete"
+        marks[event_name.split(".", 1)[1]] = time.perf_counter()
+
+    headers = {"Connection": "close"} if mode == "cold" else None
+    token = _probe_timings.set(timings)
     start = time.perf_counter()
     try:
-        # Avoid requiring the optional 'h2' package; HTTP/1.1 is fine for latency probes
-        async with httpx.AsyncClient(timeout=timeout_sec) as client:
-            resp = await client.request(method, url)
+        resp = await clients[mode].request(
+            method, url, headers=headers, timeout=timeout_sec, extensions={"trace": trace}
+        )
         latency_ms = (time.perf_counter() - start) * 1000.0
         ok = 200 <= resp.status_code < 400
-        return HttpProbeResponse(url=url, method=method, status_code=resp.status_code, latency_ms=latency_ms, success=ok)
+        return HttpProbeResponse(
+            url=url, method=method, status_code=resp.status_code, latency_ms=latency_ms, success=ok,
+            **_phase_timings(start, marks, timings),
+        )
     except Exception as exc:
         latency_ms = (time.perf_counter() - start) * 1000.0
-        return HttpProbeResponse(url=url, method=method, status_code=None, latency_ms=latency_ms, success=False, error=str(exc))
+        return HttpProbeResponse(
+            url=url, method=method, status_code=None, latency_ms=latency_ms, success=False, error=str(exc),
+            **_phase_timings(start, marks, timings),
+        )
+    finally:
+        _probe_timings.reset(token)
 
 
-@router.post("/probe", response_model=HttpProbeResponse)
-async def http_probe(payload: HttpProbeRequest) -> HttpProbeResponse:
-    return await probe_http(payload.url, payload.method, payload.timeout_sec)
+def _phase_timings(start: float, marks: Dict[str, float], timings: Dict[str, Any]) -> Dict[str, Any]:
+    def span(a: Optional[float], b: Optional[float]) -> Optional[float]:
+        return (b - a) * 1000.0 if a is not None and b is not None else None
+
+    return {
+        "dns_ms": timings.get("dns_ms"),
+        "connect_ms": timings.get("connect_ms"),
+        "tls_ms": span(marks.get("start_tls.started"), marks.get("start_tls.complete")),
+        "ttfb_ms": span(start, marks.get("receive_response_headers.complete")),
+        "transfer_ms": span(marks.get("receive_response_headers.complete"), marks.get("receive_response_body.complete")),
+        "reused": "connect_tcp.started" not in marks if marks else None,
+    }
 
+
+@router.post("/probe", response_model=HttpProbeResponse)
+async def http_probe(payload: HttpProbeRequest, request: Request) -> HttpProbeResponse:
+    clients = request.app.state.runtime.get("http_clients")
+    return await probe_http(payload.url, payload.method, payload.timeout_sec, clients, payload.mode)
@@ -0,0 +1,348 @@
+import gzip
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Annotated, Any, AsyncIterator, Dict, List, Literal, Optional, Tuple, Union
+
+import anyio
+import anyio.to_thread
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import BaseModel, Field, StringConstraints, TypeAdapter, ValidationError
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+from typing_extensions import NotRequired, TypedDict
+
+from app.db.repo import insert_sample_rows, sample_buckets, sample_columns
+from app.services.rollups import request_maintenance
+from app.services.scheduler import _publish_and_buffer
+from app.utils.fast_json import loads
+
+
+router = APIRouter(prefix="/api/ingest", tags=["ingest"])
+
+# Batch ids already ingested, so an agent retrying after a lost response does not duplicate samples
+SEEN_BATCHES = 10000
+MAX_ERRORS = 20
+MAX_LINE_BYTES = 1024 * 1024
+
+
+def _sample_adapter(ts_type: Any) -> TypeAdapter:
+    """Validator for a list of samples; records stay plain dicts (no model instances)."""
+    OptFloat = NotRequired[Optional[float]]
+    OptStr = NotRequired[Optional[str]]
+
+    class TcpSample(TypedDict):
+        kind: Literal["tcp"]
+        ts: ts_type
+        latency_ms: float
+        success: bool
+        vantage: NotRequired[Optional[Annotated[str, StringConstraints(max_length=128)]]]
+        loop_lag_ms: OptFloat
+        target_id: OptStr
+        host: str
+        port: Annotated[int, Field(ge=1, le=65535)]
+        resolve_ms: OptFloat
+        connect_ms: OptFloat
+        address: OptStr
+        family: OptStr
+
+    class DnsSample(TypedDict):
+        kind: Literal["dns"]
+        ts: ts_type
+        latency_ms: float
+        success: bool
+        vantage: NotRequired[Optional[Annotated[str, StringConstraints(max_length=128)]]]
+        loop_lag_ms: OptFloat
+        job_id: OptStr
+        fqdn: str
+        record_type: str
+        resolver: OptStr
+        rcode: OptStr
+
+    class HttpSample(TypedDict):
+        kind: Literal["http"]
+        ts: ts_type
+        latency_ms: float
+        success: bool
+        vantage: NotRequired[Optional[Annotated[str, StringConstraints(max_length=128)]]]
+        loop_lag_ms: OptFloat
+        job_id: OptStr
+        url: str
+        method: str
+        status_code: NotRequired[Optional[int]]
+        error: OptStr
+        dns_ms: OptFloat
+        connect_ms: OptFloat
+        tls_ms: OptFloat
+        ttfb_ms: OptFloat
+        transfer_ms: OptFloat
+        reused: NotRequired[Optional[bool]]
+
+    sample = Annotated[Union[TcpSample, DnsSample, HttpSample], Field(discriminator="kind")]
+    return TypeAdapter(List[sample])
+
+
+# Bulk timestamps are converted to UTC by the database; the bounds reject, line by line, the
+# few the conversion would push outside years 1-9999
+_UTC_RANGE = (datetime(1, 1, 2, tzinfo=timezone.utc), datetime(9999, 12, 30, tzinfo=timezone.utc))
+_ADAPTER = _sample_adapter(datetime)
+_BULK_ADAPTER = _sample_adapter(Annotated[datetime, Field(gt=_UTC_RANGE[0], lt=_UTC_RANGE[1])])
+_COLUMNS = {kind: sample_columns(kind) for kind in ("tcp", "dns", "http")}
+
+
+class IngestError(BaseModel):
+    line: int
+    error: str
+
+
+class IngestResult(BaseModel):
+    accepted: int
+    rejected: int
+    duplicate: bool = False
+    errors: List[IngestError] = []
+
+
+class BulkIngestResult(IngestResult):
+    batches: int = 0
+    # Per kind: first and last minute bucket touched and how many distinct buckets
+    ranges: Dict[str, Dict[str, Any]] = {}
+    elapsed_ms: float = 0.0
+    samples_per_sec: float = 0.0
+
+
+def _decode_body(body: bytes, encoding: str) -> bytes:
+    if "gzip" in encoding:
+        try:
+            return gzip.decompress(body)
+        except (OSError, EOFError, zlib.error) as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid gzip body: {exc}")
+    return body
+
+
+def _error_text(err: Dict[str, Any]) -> str:
+    return f"{'.'.join(str(p) for p in err['loc'][2:]) or 'record'}: {err['msg']}"
+
+
+def validate_lines(
+    lines: List[bytes], first_line: int = 1, adapter: TypeAdapter = _ADAPTER
+) -> Tuple[List[Dict[str, Any]], List[IngestError], int]:
+    """Parse and validate NDJSON lines as one batch; returns ``(samples, errors, rejected)``.
+
+    Valid lines are kept when others fail; line numbers in errors are 1-based.
+    """
+    try:
+        # Fast path: the whole chunk parsed and validated in one pass by pydantic-core
+        samples = adapter.validate_json(b"[" + b",".join(lines) + b"]")
+        # A blank line breaks the joined array, so more items than lines means a line held several values
+        if len(samples) == len(lines):
+            return samples, [], 0
+    except ValidationError:
+        pass
+    # Blank lines and lines holding several values land here; blank lines are skipped rather than rejected
+    numbers = [first_line + offset for offset, line in enumerate(lines) if line.strip()]
+    lines = [line for line in lines if line.strip()]
+    errors: List[IngestError] = []
+    items: List[Any] = []
+    kept: List[int] = []
+    for number, line in zip(numbers, lines):
+        try:
+            items.append(loads(line))
+            kept.append(number)
+        except ValueError as exc:
+            errors.append(IngestError(line=number, error=f"Invalid JSON: {exc}"))
+    try:
+        return adapter.validate_python(items), errors, len(errors)
+    except ValidationError as exc:
+        bad: Dict[int, str] = {}
+        for err in exc.errors(include_url=False, include_context=False):
+            bad.setdefault(err["loc"][0], _error_text(err))
+    errors.extend(IngestError(line=kept[i], error=message) for i, message in sorted(bad.items()))
+    errors.sort(key=lambda e: e.line)
+    samples = adapter.validate_python([item for i, item in enumerate(items) if i not in bad])
+    return samples, errors, len(errors)
+
+
+def _to_record(sample: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    kind = sample["kind"]
+    record = {column: sample.get(column) for column in _COLUMNS[kind]}
+    ts = record["ts"]
+    # Stored like the probes' own timestamps: UTC
+    record["ts"] = ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    return kind, record
+
+
+@router.post("/samples", response_model=IngestResult)
+async def ingest_samples(request: Request) -> IngestResult:
+    """Ingest an NDJSON batch of samples (optionally gzip, via ``Content-Encoding``).
+
+    Each line is ``{"kind": "tcp"|"dns"|"http", "ts": ..., <sample columns>}``.
+    Samples go through the write-behind writer and are published on the
+    event bus; an ``X-Batch-Id`` seen before is acknowledged without ingesting.
+    """
+    runtime = request.app.state.runtime
+    writer = runtime.get("sample_writer")
+    if writer is None:
+        raise HTTPException(status_code=503, detail="Sample writer not running")
+    seen: "OrderedDict[str, None]" = runtime.setdefault("ingest_batches", OrderedDict())
+    batch_id = request.headers.get("x-batch-id")
+    if batch_id:
+        if batch_id in seen:
+            return IngestResult(accepted=0, rejected=0, duplicate=True)
+        # Recorded before the first await so a retry racing this request is a
+        # duplicate; dropped again if the batch fails, so it can be resent
+        seen[batch_id] = None
+        while len(seen) > SEEN_BATCHES:
+            seen.popitem(last=False)
+    try:
+        body = _decode_body(await request.body(), request.headers.get("content-encoding", ""))
+        samples, errors, rejected = validate_lines(body.splitlines())
+        for sample in samples:
+            kind, record = _to_record(sample)
+            data = {k: v for k, v in record.items() if k != "ts"}
+            await _publish_and_buffer(request.app, f"{kind}_sample", data, ts=record["ts"].isoformat())
+            await writer["submit"](kind, record)
+    except BaseException:
+        if batch_id:
+            seen.pop(batch_id, None)
+        raise
+    return IngestResult(accepted=len(samples), rejected=rejected, errors=errors[:MAX_ERRORS])
+
+
+# Bulk ingest: backfills and external tooling. Streams the body, validates in
+# chunks and inserts straight into the sample tables, bypassing the event bus
+# and the write-behind writer.
+
+async def _body_lines(request: Request) -> AsyncIterator[List[bytes]]:
+    """Complete lines of the (optionally gzip) request body, as they arrive."""
+    gzipped = "gzip" in request.headers.get("content-encoding", "")
+    # 16 + MAX_WBITS: expect a gzip header
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    carry = b""
+    try:
+        async for chunk in request.stream():
+            while decoder is not None and chunk:
+                data = decoder.decompress(chunk)
+                # Concatenated gzip members (e.g. appended files) start a new decoder
+                chunk = decoder.unused_data if decoder.eof else b""
+                if decoder.eof:
+                    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                carry += data
+            if decoder is None:
+                carry += chunk
+            lines = carry.split(b"\n")
+            carry = lines.pop()
+            if len(carry) > MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Line longer than {MAX_LINE_BYTES} bytes")
+            if lines:
+                yield lines
+    except zlib.error as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid gzip body: {exc}")
+    if carry:
+        yield [carry]
+
+
+def _rows(samples: List[Dict[str, Any]]) -> Dict[str, List[tuple]]:
+    rows: Dict[str, List[tuple]] = {"tcp": [], "dns": [], "http": []}
+    for sample in samples:
+        kind = sample["kind"]
+        rows[kind].append(tuple(map(sample.get, _COLUMNS[kind])))
+    return rows
+
+
+@router.post("/bulk", response_model=BulkIngestResult)
+async def ingest_bulk(
+    request: Request,
+    chunk_size: int = Query(20000, ge=100, le=200000, description="Lines validated and inserted per transaction"),
+) -> BulkIngestResult:
+    """Stream NDJSON samples (same lines as ``/samples``; gzip via ``Content-Encoding``) into the database.
+
+    Parsing, validation and inserts overlap chunk by chunk, so the body is
+    never held in memory. Samples are not published on the live stream. The
+    rollups pick new rows up by id, so every bucket they touch, however old,
+    is folded into the aggregates on the next maintenance pass, which is
+    requested straight away.
+    """
+    engine = request.app.state.runtime.get("db_engine")
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Database not ready")
+    started = time.perf_counter()
+    totals = {"accepted": 0, "rejected": 0, "batches": 0}
+    errors: List[IngestError] = []
+    buckets: Dict[str, set] = {}
+    send, receive = anyio.create_memory_object_stream(max_buffer_size=1)
+    failure: Optional[HTTPException] = None
+
+    async def insert_chunks() -> None:
+        nonlocal failure
+        async with receive:
+            async for rows, first_line, count in receive:
+                try:
+                    inserted = await insert_sample_rows(engine, rows)
+                except (IntegrityError, DataError) as exc:
+                    # Validated rows the database still refused: reject the chunk, keep going
+                    totals["rejected"] += count
+                    if len(errors) < MAX_ERRORS:
+                        errors.append(IngestError(line=first_line, error=f"Chunk of {count} samples not stored: {exc.orig}"))
+                    continue
+                except SQLAlchemyError as exc:
+                    failure = HTTPException(status_code=503, detail=f"Database error: {getattr(exc, 'orig', None) or exc}")
+                    return
+                for kind, (first_id, last_id) in inserted.items():
+                    buckets.setdefault(kind, set()).update(await sample_buckets(engine, kind, first_id, last_id))
+                totals["accepted"] += count
+                totals["batches"] += 1
+
+    def prepare(pending: List[bytes], first_line: int) -> Tuple[Dict[str, List[tuple]], List[IngestError], int, int]:
+        samples, chunk_errors, rejected = validate_lines(pending, first_line, _BULK_ADAPTER)
+        return _rows(samples), chunk_errors, rejected, len(samples)
+
+    async def validate_chunk(pending: List[bytes], first_line: int) -> None:
+        # Off the event loop: live probes keep their timing and the inserter's round trips are not held up
+        rows, chunk_errors, rejected, accepted = await anyio.to_thread.run_sync(prepare, pending, first_line)
+        totals["rejected"] += rejected
+        errors.extend(chunk_errors[:MAX_ERRORS - len(errors)])
+        if accepted:
+            await send.send((rows, first_line, accepted))
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(insert_chunks)
+        async with send:
+            pending: List[bytes] = []
+            first_line = 1
+            try:
+                async for lines in _body_lines(request):
+                    pending.extend(lines)
+                    while len(pending) >= chunk_size:
+                        await validate_chunk(pending[:chunk_size], first_line)
+                        first_line += chunk_size
+                        del pending[:chunk_size]
+                await validate_chunk(pending, first_line)
+            except HTTPException as exc:
+                # Raised once the inserter has finished with the chunks before the bad part of the body
+                failure = exc
+            except anyio.BrokenResourceError:
+                # The inserter stopped on a database error (``failure``)
+                pass
+
+    ranges = {
+        kind: {
+            "first_bucket": datetime.fromtimestamp(min(found), tz=timezone.utc),
+            "last_bucket": datetime.fromtimestamp(max(found), tz=timezone.utc),
+            "buckets": len(found),
+        }
+        for kind, found in buckets.items() if found
+    }
+    if ranges:
+        request_maintenance(request.app)
+    if failure is not None:
+        raise HTTPException(
+            status_code=failure.status_code, detail=f"{failure.detail} ({totals['accepted']} samples before it were stored)"
+        )
+    elapsed = time.perf_counter() - started
+    return BulkIngestResult(
+        **totals,
+        errors=errors,
+        ranges=ranges,
+        elapsed_ms=elapsed * 1000.0,
+        samples_per_sec=totals["accepted"] / elapsed if elapsed > 0 else 0.0,
+    )
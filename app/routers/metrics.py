@@ -1,33 +1,53 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Query, Request
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
-from app.db.repo import fetch_tcp_samples_between, fetch_dns_samples_between
+from app.db.repo import fetch_aggregates_between
+from app.services.rollups import (
+    ROLLUPS, TIERS, TIER_TABLES, aggregate_from_row, aggregate_merge, aggregate_stats, new_aggregate,
+)
+from app.services.rollup_query import query_rollup
 from sqlalchemy import select
 from app.db.tables import aggregates_tcp_1m, aggregates_dns_1m, aggregates_http_1m
 from sqlalchemy.ext.asyncio import AsyncEngine
+from app.utils.fast_json import records_response
 
 
 router = APIRouter(prefix="/api/metrics", tags=["metrics"])
 
+# Our own records skip response_model validation and go straight to bytes;
+# the models below still document the shapes in OpenAPI.
+FORMAT_QUERY = Query("json", pattern="^(json|ndjson)$", description="json, or ndjson for one record per line")
+
 
 class Sample(BaseModel):
     type: str
     data: Dict[str, Any]
     ts: Optional[str] = None
+    seq: Optional[int] = None
 
 
 class SamplesResponse(BaseModel):
     items: List[Sample]
+    cursor: int = 0  # pass back as ``since`` to fetch only newer samples
 
 
 @router.get("/recent", response_model=SamplesResponse)
-async def recent(request: Request, limit: int = Query(500, ge=1, le=5000)) -> SamplesResponse:
+async def recent(
+    request: Request,
+    limit: int = Query(500, ge=1, le=5000),
+    type: Optional[List[str]] = Query(None, description="Sample types, e.g. tcp_sample (repeatable)"),
+    target: Optional[List[str]] = Query(None, description="Host, FQDN or URL (repeatable)"),
+    since: int = Query(0, ge=0, description="Only samples with a seq above this cursor"),
+    format: str = FORMAT_QUERY,
+) -> Response:
     ring = request.app.state.runtime.get("ring_buffer")
-    snapshot = await ring["snapshot"](limit)
-    items: List[Sample] = [Sample(**entry) for entry in snapshot]
-    return SamplesResponse(items=items)
+    snapshot = await ring["query"](types=type, targets=target, since=since, limit=limit)
+    cursor = snapshot[-1]["seq"] if snapshot else since
+    # NDJSON carries the cursor in a header since there is no envelope
+    return records_response({"items": snapshot, "cursor": cursor}, "items", format, {"X-Cursor": str(cursor)})
 
 
 class RollupPoint(BaseModel):
@@ -43,50 +63,29 @@ class RollupResponse(BaseModel):
     points: List[RollupPoint]
 
 
-def _bucketize(ts: datetime, step: int) -> datetime:
-    seconds = int(ts.timestamp())
-    bucket = seconds - (seconds % step)
-    return datetime.fromtimestamp(bucket, tz=timezone.utc)
+MAX_WINDOW_MINUTES = 366 * 1440
+MAX_POINTS = 20000
 
 
-def _quantiles(values: List[float], qs: List[float]) -> List[Optional[float]]:
-    if not values:
-        return [None for _ in qs]
-    data = sorted(values)
-    out: List[Optional[float]] = []
-    for q in qs:
-        idx = max(0, min(len(data) - 1, int(round(q * (len(data) - 1)))))
-        out.append(data[idx])
-    return out
+def _rollup_window(minutes: int, step_sec: int) -> Tuple[datetime, datetime]:
+    if minutes * 60 // step_sec > MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Window would return more than {MAX_POINTS} points; raise step_sec")
+    end = datetime.now(timezone.utc)
+    return end - timedelta(minutes=minutes), end
 
 
 @router.get("/tcp_rollup", response_model=RollupResponse)
 async def tcp_rollup(
     request: Request,
-    minutes: int = Query(60, ge=1, le=1440),
-    step_sec: int = Query(60, ge=15, le=3600),
+    minutes: int = Query(60, ge=1, le=MAX_WINDOW_MINUTES),
+    step_sec: int = Query(60, ge=15, le=86400),
     host: Optional[str] = None,
-) -> RollupResponse:
-    end = datetime.now(timezone.utc)
-    start = end - timedelta(minutes=minutes)
+    format: str = FORMAT_QUERY,
+) -> Response:
+    start, end = _rollup_window(minutes, step_sec)
     engine = request.app.state.runtime.get("db_engine")
-    rows = await fetch_tcp_samples_between(engine, start, end, host=host)
-    buckets: Dict[datetime, Dict[str, Any]] = {}
-    for r in rows:
-        b = _bucketize(r["ts"], step_sec)
-        entry = buckets.setdefault(b, {"lat": [], "ok": 0, "count": 0})
-        entry["count"] += 1
-        entry["ok"] += 1 if r["success"] else 0
-        if r["success"]:
-            entry["lat"].append(float(r["latency_ms"]))
-    points: List[RollupPoint] = []
-    for b in sorted(buckets.keys()):
-        e = buckets[b]
-        p50, p95 = _quantiles(e["lat"], [0.5, 0.95])
-        avg = (sum(e["lat"]) / len(e["lat"])) if e["lat"] else None
-        sr = e["ok"] / e["count"] if e["count"] else 0.0
-        points.append(RollupPoint(bucket=b, count=e["count"], success_rate=sr, p50=p50, p95=p95, avg=avg))
-    return RollupResponse(points=points)
+    points = await query_rollup(engine, "tcp", start, end, step_sec, {"host": [host] if host else []})
+    return records_response({"points": points}, "points", format)
 
 
 @router.get("/summary")
@@ -104,31 +103,115 @@ async def summary(request: Request) -> Dict[str, Any]:
     return {"last_10m_samples": {"tcp": tcp, "dns": dns, "http": http}}
 
 
+@router.get("/writer")
+async def writer_stats(request: Request) -> Dict[str, Any]:
+    writer = request.app.state.runtime.get("sample_writer")
+    if not writer:
+        return {}
+    return writer["stats"]()
+
+
+@router.get("/maintenance")
+async def maintenance_stats(request: Request) -> Dict[str, Any]:
+    return request.app.state.runtime.get("maintenance", {})
+
+
+@router.get("/loops")
+async def loop_stats(request: Request) -> Dict[str, Any]:
+    runtime = request.app.state.runtime
+    monitor = runtime.get("loop_monitor")
+    measurement = runtime.get("measurement")
+    return {
+        "main": monitor["stats"]() if monitor else None,
+        "measurement": measurement["stats"]() if measurement else None,
+    }
+
+
+@router.get("/workers")
+async def worker_stats(request: Request) -> Dict[str, Any]:
+    return request.app.state.runtime.get("probe_workers", {})
+
+
+@router.get("/scheduler")
+async def scheduler_stats(request: Request) -> Dict[str, Any]:
+    dispatcher = request.app.state.runtime.get("dispatcher")
+    if not dispatcher:
+        return {}
+    return dispatcher["stats"]()
+
+
 @router.get("/dns_rollup", response_model=RollupResponse)
 async def dns_rollup(
     request: Request,
-    minutes: int = Query(60, ge=1, le=1440),
-    step_sec: int = Query(60, ge=15, le=3600),
+    minutes: int = Query(60, ge=1, le=MAX_WINDOW_MINUTES),
+    step_sec: int = Query(60, ge=15, le=86400),
     fqdn: Optional[str] = None,
-) -> RollupResponse:
+    format: str = FORMAT_QUERY,
+) -> Response:
+    start, end = _rollup_window(minutes, step_sec)
+    engine = request.app.state.runtime.get("db_engine")
+    points = await query_rollup(engine, "dns", start, end, step_sec, {"fqdn": [fqdn] if fqdn else []})
+    return records_response({"points": points}, "points", format)
+
+
+@router.get("/http_rollup", response_model=RollupResponse)
+async def http_rollup(
+    request: Request,
+    minutes: int = Query(60, ge=1, le=MAX_WINDOW_MINUTES),
+    step_sec: int = Query(60, ge=15, le=86400),
+    url: Optional[str] = None,
+    method: Optional[str] = None,
+    format: str = FORMAT_QUERY,
+) -> Response:
+    start, end = _rollup_window(minutes, step_sec)
+    engine = request.app.state.runtime.get("db_engine")
+    filters = {"url": [url] if url else [], "method": [method.upper()] if method else []}
+    points = await query_rollup(engine, "http", start, end, step_sec, filters)
+    return records_response({"points": points}, "points", format)
+
+
+class PercentilesResponse(BaseModel):
+    kind: str
+    start: datetime
+    end: datetime
+    count: int
+    success_rate: float
+    avg: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    quantiles: Dict[str, Optional[float]]
+
+
+@router.get("/percentiles", response_model=PercentilesResponse)
+async def percentiles(
+    request: Request,
+    kind: str = Query("tcp", pattern="^(tcp|dns|http)$"),
+    minutes: int = Query(60, ge=1, le=MAX_WINDOW_MINUTES),
+    q: List[float] = Query([0.5, 0.95, 0.99, 0.999]),
+    target: Optional[List[str]] = Query(None, description="host, fqdn or url; repeat to merge a group"),
+) -> PercentilesResponse:
+    """Arbitrary percentiles over a window/target group, merged from aggregate sketches."""
     end = datetime.now(timezone.utc)
     start = end - timedelta(minutes=minutes)
     engine = request.app.state.runtime.get("db_engine")
-    rows = await fetch_dns_samples_between(engine, start, end, fqdn=fqdn)
-    buckets: Dict[datetime, Dict[str, Any]] = {}
-    for r in rows:
-        b = _bucketize(r["ts"], step_sec)
-        entry = buckets.setdefault(b, {"lat": [], "ok": 0, "count": 0})
-        entry["count"] += 1
-        entry["ok"] += 1 if r["success"] else 0
-        if r["success"]:
-            entry["lat"].append(float(r["latency_ms"]))
-    points: List[RollupPoint] = []
-    for b in sorted(buckets.keys()):
-        e = buckets[b]
-        p50, p95 = _quantiles(e["lat"], [0.5, 0.95])
-        avg = (sum(e["lat"]) / len(e["lat"])) if e["lat"] else None
-        sr = e["ok"] / e["count"] if e["count"] else 0.0
-        points.append(RollupPoint(bucket=b, count=e["count"], success_rate=sr, p50=p50, p95=p95, avg=avg))
-    return RollupResponse(points=points)
-
+    key_fields = ROLLUPS[kind][2]
+    # Coarsest tier with at least ~60 buckets in the window keeps edge error small
+    name = [tier for tier, size in TIERS if size <= max(60, minutes)][-1]
+    table = TIER_TABLES[kind][name]
+    rows = await fetch_aggregates_between(engine, table, start, end, {key_fields[0]: target or []})
+    merged = new_aggregate()
+    for row in rows:
+        aggregate_merge(merged, aggregate_from_row(row))
+    qs = [min(1.0, max(0.0, v)) for v in q]
+    stats = aggregate_stats(merged, qs)
+    return PercentilesResponse(
+        kind=kind,
+        start=start,
+        end=end,
+        count=stats["count"],
+        success_rate=(stats["success_count"] / stats["count"]) if stats["count"] else 0.0,
+        avg=stats["avg"],
+        min=stats["min"],
+        max=stats["max"],
+        quantiles={str(k): v for k, v in zip(qs, stats["quantiles"])},
+    )
@@ -1,8 +1,9 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 import socket
 import time
 
 import anyio
+import anyio.abc
 from fastapi import APIRouter, Request
 from pydantic import BaseModel, Field
 
@@ -10,54 +11,129 @@ from pydantic import BaseModel, Field
 router = APIRouter(prefix="/api/ping", tags=["ping"])
 
 
+FAMILY_PATTERN = "^(both|v4|v6)$"
+# RFC 8305 "Connection Attempt Delay"
+ATTEMPT_DELAY_SEC = 0.25
+
+
 class TcpPingRequest(BaseModel):
     host: str = Field(..., description="Hostname or IP to connect to")
     port: int = Field(443, ge=1, le=65535)
     timeout_sec: float = Field(2.0, ge=0.1, le=10.0)
+    family: str = Field("both", pattern=FAMILY_PATTERN, description="Address family: both, v4 or v6")
 
 
 class TcpPingResponse(BaseModel):
     host: str
     port: int
-    latency_ms: float
+    latency_ms: float  # handshake time of the winning attempt, so the series tracks the network path
+    resolve_ms: Optional[float] = None
+    connect_ms: Optional[float] = None
+    address: Optional[str] = None
+    family: Optional[str] = None
     success: bool
     error: Optional[str] = None
 
 
-async def tcp_connect_latency(host: str, port: int, timeout_sec: float) -> TcpPingResponse:
+async def tcp_connect_latency(
+    host: str,
+    port: int,
+    timeout_sec: float,
+    address_cache: Optional[Dict[str, Any]] = None,
+    family: str = "both",
+) -> TcpPingResponse:
+    resolve_ms: Optional[float] = None
     start = time.perf_counter()
     try:
         # anyio.wait_for was removed in anyio v4; use fail_after (regular context manager)
         with anyio.fail_after(timeout_sec):
-            await _connect(host, port)
+            addresses = _order_addresses(await _resolve(host, port, address_cache), family)
+            resolve_ms = (time.perf_counter() - start) * 1000.0
+            if not addresses:
+                raise OSError(f"No {family} addresses for {host}")
+            address, connect_ms = await _connect(addresses, port)
     except Exception as exc:
         elapsed_ms = (time.perf_counter() - start) * 1000.0
-        return TcpPingResponse(host=host, port=port, latency_ms=elapsed_ms, success=False, error=str(exc))
+        return TcpPingResponse(
+            host=host, port=port, latency_ms=elapsed_ms - (resolve_ms or 0.0), resolve_ms=resolve_ms,
+            success=False, error=str(exc) or type(exc).__name__,
+        )
+
+    return TcpPingResponse(
+        host=host, port=port, latency_ms=connect_ms, resolve_ms=resolve_ms, connect_ms=connect_ms,
+        address=address, family=_family(address), success=True,
+    )
+
+
+async def _resolve(host: str, port: int, address_cache: Optional[Dict[str, Any]]) -> List[str]:
+    if address_cache is not None:
+        return await address_cache["resolve"](host)
+    addrinfos = await anyio.getaddrinfo(host, port, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in addrinfos))
+
 
-    elapsed_ms = (time.perf_counter() - start) * 1000.0
-    return TcpPingResponse(host=host, port=port, latency_ms=elapsed_ms, success=True)
+def _family(address: str) -> str:
+    return "v6" if ":" in address else "v4"
 
 
-async def _connect(host: str, port: int) -> None:
-    family = socket.AF_UNSPEC
-    addrinfos = await anyio.to_thread.run_sync(socket.getaddrinfo, host, port, family, socket.SOCK_STREAM)
-    last_exc: Optional[BaseException] = None
-    for family, socktype, proto, _, sockaddr in addrinfos:
+def _order_addresses(addresses: List[str], family: str = "both") -> List[str]:
+    """Apply the family pin, then alternate families starting with the resolver's first choice."""
+    if family != "both":
+        return [a for a in addresses if _family(a) == family]
+    v6 = [a for a in addresses if _family(a) == "v6"]
+    v4 = [a for a in addresses if _family(a) == "v4"]
+    first, second = (v6, v4) if addresses and _family(addresses[0]) == "v6" else (v4, v6)
+    ordered: List[str] = []
+    for i in range(max(len(first), len(second))):
+        ordered.extend(group[i] for group in (first, second) if i < len(group))
+    return ordered
+
+
+async def _connect(
+    addresses: List[str], port: int, attempt_delay_sec: float = ATTEMPT_DELAY_SEC
+) -> Tuple[str, float]:
+    """Staggered parallel connects (RFC 8305); returns the winning address and its handshake time.
+
+    The next address is tried when the previous attempt fails or after
+    ``attempt_delay_sec``, whichever comes first; the first success cancels
+    the rest.
+    """
+    winner: List[Tuple[str, float]] = []
+    errors: List[OSError] = []
+
+    async def attempt(address: str, failed: anyio.Event, tg: anyio.abc.TaskGroup) -> None:
+        started = time.perf_counter()
         try:
-            stream = await anyio.connect_tcp(sockaddr[0], sockaddr[1])
-            await stream.aclose()
+            stream = await anyio.connect_tcp(address, port)
+        except OSError as exc:
+            errors.append(exc)
+            failed.set()
             return
-        except BaseException as exc:  # try next addr
-            last_exc = exc
-            continue
-    if last_exc is None:
-        raise RuntimeError("No addresses resolved")
-    raise last_exc
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        await stream.aclose()
+        if not winner:
+            winner.append((address, elapsed_ms))
+            tg.cancel_scope.cancel()
+
+    async with anyio.create_task_group() as tg:
+        for address in addresses:
+            failed = anyio.Event()
+            tg.start_soon(attempt, address, failed, tg)
+            with anyio.move_on_after(attempt_delay_sec):
+                await failed.wait()
+    if winner:
+        return winner[0]
+    if errors:
+        raise errors[-1]
+    raise RuntimeError("No addresses resolved")
 
 
 @router.post("/tcp", response_model=TcpPingResponse)
 async def ping_tcp(payload: TcpPingRequest, request: Request) -> TcpPingResponse:
-    result = await tcp_connect_latency(payload.host, payload.port, payload.timeout_sec)
+    result = await tcp_connect_latency(
+        payload.host, payload.port, payload.timeout_sec, request.app.state.runtime.get("address_cache"),
+        family=payload.family,
+    )
     bus = request.app.state.runtime.get("event_bus")
     publish = bus["publish"]
     ring = request.app.state.runtime.get("ring_buffer")
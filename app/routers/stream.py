@@ -1,24 +1,228 @@
-from typing import AsyncIterator, Callable, Dict, Any
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional
 import json
 
-from fastapi import APIRouter, Request
+import anyio
+from fastapi import APIRouter, Header, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+from app.utils.event_bus import Entry
 
 
 router = APIRouter(prefix="/api/stream", tags=["stream"])
 
 
-async def sse_event_generator(subscribe: Callable[..., AsyncIterator[Dict[str, Any]]]) -> AsyncIterator[bytes]:
-    async for event in subscribe(with_replay=True):
-        payload = json.dumps(event, separators=(",", ":"))
-        line = f"data: {payload}\n\n"
-        yield line.encode("utf-8")
+def build_event_filter(
+    types: Optional[List[str]] = None,
+    fields: Optional[Dict[str, List[str]]] = None,
+    success: Optional[bool] = None,
+) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """Predicate for the event bus; every given filter must match (None when nothing is filtered)."""
+    type_set = set(types or [])
+    field_sets = {name: set(values) for name, values in (fields or {}).items() if values}
+    if not type_set and not field_sets and success is None:
+        return None
+
+    def match(event: Dict[str, Any]) -> bool:
+        if type_set and event.get("type") not in type_set:
+            return False
+        data = event.get("data") or {}
+        for name, values in field_sets.items():
+            if data.get(name) not in values:
+                return False
+        return success is None or data.get("success") is success
+
+    return match
+
+
+async def sse_event_generator(
+    subscribe: Callable[..., AsyncIterator[Entry]],
+    last_event_id: Optional[int] = None,
+    match: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> AsyncIterator[bytes]:
+    # Events arrive already encoded by the bus; every subscriber shares the same bytes
+    async for _, _, wire in subscribe(with_replay=True, last_event_id=last_event_id, match=match):
+        yield wire
 
 
 @router.get("/events")
-async def events(request: Request) -> StreamingResponse:
+async def events(
+    request: Request,
+    type: Optional[List[str]] = Query(None, description="Event types, e.g. tcp_sample (repeatable)"),
+    host: Optional[List[str]] = Query(None),
+    fqdn: Optional[List[str]] = Query(None),
+    url: Optional[List[str]] = Query(None),
+    success: Optional[bool] = Query(None),
+    last_event_id: Optional[int] = Query(None, description="Resume after this id (same as the Last-Event-ID header)"),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+) -> StreamingResponse:
     bus = request.app.state.runtime.get("event_bus")
     subscribe = bus["subscribe"]
-    generator = sse_event_generator(subscribe)
+    # Browsers send the header on automatic reconnects; the query parameter covers the first connect
+    if last_event_id_header and last_event_id_header.strip().isdigit():
+        last_event_id = int(last_event_id_header.strip())
+    match = build_event_filter(type, {"host": host, "fqdn": fqdn, "url": url}, success)
+    generator = sse_event_generator(subscribe, last_event_id, match)
     return StreamingResponse(generator, media_type="text/event-stream")
 
+
+@router.get("/stats")
+async def stream_stats(request: Request) -> Dict[str, Any]:
+    """Event bus counters, including per-subscriber drops when a client falls behind."""
+    return request.app.state.runtime["event_bus"]["stats"]()
+
+
+# WebSocket feed: time-windowed, columnar batches instead of one frame per sample
+
+class LiveSettings(BaseModel):
+    interval_ms: int = Field(250, ge=50, le=10000)
+    max_batch: int = Field(2000, ge=1, le=20000)
+    coalesce: bool = False  # keep only the latest sample per target within a window
+    fields: Optional[List[str]] = None  # restrict the columns sent (ts is always included)
+
+
+def series_key(event: Dict[str, Any]) -> str:
+    data = event.get("data") or {}
+    kind = event.get("type", "")
+    if kind == "tcp_sample":
+        return f"tcp|{data.get('host')}|{data.get('port')}"
+    if kind == "dns_sample":
+        return f"dns|{data.get('fqdn')}|{data.get('record_type')}|{data.get('resolver')}"
+    if kind == "http_sample":
+        return f"http|{data.get('method')}|{data.get('url')}"
+    return f"{kind}|{json.dumps(data, sort_keys=True, default=str)}"
+
+
+def encode_batch(events: List[Dict[str, Any]], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, List[Any]]]:
+    """Group events by type into column lists: ``{type: {"ts": [...], field: [...], ...}}``."""
+    by_type: Dict[str, List[Dict[str, Any]]] = {}
+    for event in events:
+        by_type.setdefault(event.get("type", ""), []).append(event)
+    series: Dict[str, Dict[str, List[Any]]] = {}
+    for kind, items in by_type.items():
+        names: Dict[str, None] = {}
+        for event in items:
+            names.update(dict.fromkeys(event.get("data") or {}))
+        if fields:
+            names = {name: None for name in names if name in fields}
+        columns: Dict[str, List[Any]] = {"ts": [event.get("ts") for event in items]}
+        for name in names:
+            columns[name] = [(event.get("data") or {}).get(name) for event in items]
+        series[kind] = columns
+    return series
+
+
+@router.websocket("/ws")
+async def live_ws(
+    websocket: WebSocket,
+    type: Optional[List[str]] = Query(None),
+    host: Optional[List[str]] = Query(None),
+    fqdn: Optional[List[str]] = Query(None),
+    url: Optional[List[str]] = Query(None),
+    success: Optional[bool] = Query(None),
+    interval_ms: int = Query(250),
+    max_batch: int = Query(2000),
+    coalesce: bool = Query(False),
+    fields: Optional[List[str]] = Query(None),
+) -> None:
+    await websocket.accept()
+    try:
+        settings = LiveSettings(interval_ms=interval_ms, max_batch=max_batch, coalesce=coalesce, fields=fields)
+    except ValidationError as exc:
+        await websocket.send_text(json.dumps({"type": "error", "detail": exc.errors(include_url=False)}, default=str))
+        await websocket.close(code=1008)
+        return
+    bus = websocket.app.state.runtime["event_bus"]
+    stream = bus["subscribe"](with_replay=False, match=build_event_filter(
+        type, {"host": host, "fqdn": fqdn, "url": url}, success))
+    pending: List[Dict[str, Any]] = []
+    latest: Dict[str, Dict[str, Any]] = {}
+    counters = {"last_id": 0, "dropped": 0, "coalesced": 0}
+    wake = {"event": anyio.Event()}
+
+    async def send(message: Dict[str, Any]) -> None:
+        await websocket.send_text(json.dumps(message, separators=(",", ":"), default=str))
+
+    async def hello() -> None:
+        await send({"type": "hello", **settings.model_dump()})
+
+    async def collect() -> None:
+        async for event_id, event, _ in stream:
+            counters["last_id"] = event_id
+            if settings.coalesce:
+                key = series_key(event)
+                if key in latest:
+                    counters["coalesced"] += 1
+                    del latest[key]  # re-insert so the dict stays in arrival order
+                latest[key] = event
+                size = len(latest)
+            elif len(pending) >= settings.max_batch * 4:
+                # Client cannot keep up; shed new samples rather than grow without bound
+                counters["dropped"] += 1
+                continue
+            else:
+                pending.append(event)
+                size = len(pending)
+            if size >= settings.max_batch:
+                wake["event"].set()
+
+    def take() -> List[Dict[str, Any]]:
+        limit = settings.max_batch
+        if latest:
+            keys = list(latest)[:limit]
+            batch = [latest.pop(key) for key in keys]
+        else:
+            batch = []
+        room = limit - len(batch)
+        if pending and room > 0:
+            batch.extend(pending[:room])
+            del pending[:room]
+        return batch
+
+    async def flush_loop() -> None:
+        while True:
+            with anyio.move_on_after(settings.interval_ms / 1000.0):
+                await wake["event"].wait()
+            wake["event"] = anyio.Event()
+            batch = take()
+            if batch:
+                await send({
+                    "type": "batch",
+                    "last_id": counters["last_id"],
+                    "count": len(batch),
+                    "coalesced": counters["coalesced"],
+                    "dropped": counters["dropped"],
+                    "series": encode_batch(batch, settings.fields),
+                })
+
+    async def receive(tg) -> None:
+        # Clients renegotiate by sending a JSON object with any LiveSettings fields
+        nonlocal settings
+        try:
+            while True:
+                message = await websocket.receive_text()
+                try:
+                    settings = LiveSettings(**{**settings.model_dump(), **json.loads(message)})
+                except (ValueError, TypeError, ValidationError) as exc:
+                    await send({"type": "error", "detail": str(exc)})
+                    continue
+                await hello()
+        except WebSocketDisconnect:
+            pass
+        tg.cancel_scope.cancel()
+
+    async def guarded(func) -> None:
+        try:
+            await func()
+        except Exception:
+            # Send failed: the client went away
+            tg.cancel_scope.cancel()
+
+    try:
+        await hello()
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(collect)
+            tg.start_soon(guarded, flush_loop)
+            await receive(tg)
+    finally:
+        await stream.aclose()
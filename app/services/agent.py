@@ -0,0 +1,244 @@
+import gzip
+import os
+import signal
+import socket
+import sys
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import anyio
+import anyio.to_thread
+import httpx
+
+from app.services.probe_workers import CONFIG_KINDS, create_probe_runtime
+from app.services.scheduler import notify_config_changed, start_scheduler
+from app.utils.fast_json import dumps_lines
+
+
+# Agent mode: a headless process that runs only the scheduler and probes and
+# ships its samples, labelled with a vantage point, to a central instance's
+# /api/ingest/samples. Batches are spooled to disk first (gzip NDJSON, one
+# file per batch) and deleted once the central instance accepts them, so an
+# unreachable central instance only delays delivery.
+
+SPOOL_SUFFIX = ".ndjson.gz"
+# Responses that will never succeed on retry; the batch is dropped
+REJECTED_STATUSES = (400, 413, 415, 422)
+
+
+def create_spool(directory: str, max_bytes: int = 256 * 1024 * 1024) -> Dict[str, Any]:
+    """On-disk batch queue; oldest files are dropped once it holds more than ``max_bytes``.
+
+    Functions are blocking (file I/O); call them from a worker thread.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".tmp"):
+            # Partial write from a crash
+            os.remove(os.path.join(directory, name))
+    counters = {"batches": 0, "samples": 0, "dropped_batches": 0}
+
+    def files() -> List[str]:
+        return sorted(name for name in os.listdir(directory) if name.endswith(SPOOL_SUFFIX))
+
+    def _size() -> int:
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in files())
+
+    def write(lines: List[Dict[str, Any]]) -> str:
+        # Names sort in write order; rename makes the file appear complete or not at all
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{SPOOL_SUFFIX}"
+        path = os.path.join(directory, name)
+        with gzip.open(path + ".tmp", "wb", compresslevel=6) as fh:
+            fh.write(dumps_lines(lines))
+        os.replace(path + ".tmp", path)
+        counters["batches"] += 1
+        counters["samples"] += len(lines)
+        names = files()
+        total = _size()
+        while total > max_bytes and len(names) > 1:
+            oldest = os.path.join(directory, names.pop(0))
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+            counters["dropped_batches"] += 1
+        return name
+
+    def read(name: str) -> bytes:
+        with open(os.path.join(directory, name), "rb") as fh:
+            return fh.read()
+
+    def remove(name: str) -> None:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+    def stats() -> Dict[str, Any]:
+        names = files()
+        return {**counters, "pending_batches": len(names), "bytes": _size()}
+
+    return {
+        "files": files,
+        "write": write,
+        "read": read,
+        "remove": remove,
+        "stats": stats,
+    }
+
+
+async def push_spool(
+    spool: Dict[str, Any],
+    client: httpx.AsyncClient,
+    url: str,
+    vantage: str,
+    wake: Dict[str, Optional[anyio.Event]],
+    poll_sec: float = 5.0,
+    max_backoff_sec: float = 60.0,
+) -> None:
+    """Send spooled batches oldest first; a batch is deleted only once it was accepted.
+
+    ``X-Batch-Id`` lets the central instance ignore a batch it already
+    ingested when the response to an earlier attempt was lost.
+    """
+    stats: Dict[str, Any] = spool.setdefault("push_stats", {"pushed": 0, "rejected": 0, "failures": 0, "last_error": None})
+    backoff = 1.0
+    while True:
+        wake["event"] = anyio.Event()
+        names = await anyio.to_thread.run_sync(spool["files"])
+        failed = False
+        for name in names:
+            body = await anyio.to_thread.run_sync(spool["read"], name)
+            try:
+                response = await client.post(url, content=body, headers={
+                    "Content-Type": "application/x-ndjson",
+                    "Content-Encoding": "gzip",
+                    "X-Batch-Id": f"{vantage}/{name}",
+                })
+            except httpx.HTTPError as exc:
+                stats["last_error"] = str(exc) or type(exc).__name__
+                failed = True
+                break
+            if response.status_code < 300:
+                stats["pushed"] += 1
+            elif response.status_code in REJECTED_STATUSES:
+                stats["rejected"] += 1
+                stats["last_error"] = f"HTTP {response.status_code}: {response.text[:200]}"
+            else:
+                stats["last_error"] = f"HTTP {response.status_code}"
+                failed = True
+                break
+            await anyio.to_thread.run_sync(spool["remove"], name)
+        if failed:
+            stats["failures"] += 1
+            await anyio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff_sec)
+            continue
+        backoff = 1.0
+        with anyio.move_on_after(poll_sec):
+            await wake["event"].wait()
+
+
+async def pull_config(app, client: httpx.AsyncClient, url: str, interval_sec: float = 30.0) -> None:
+    """Probe what the central instance is configured to probe; changes apply on the next poll."""
+    runtime = app.state.runtime
+    current: Optional[Dict[str, Any]] = None
+    while True:
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+            state = response.json()
+            cfg = {kind: {entry["id"]: entry for entry in state.get(kind, [])} for kind in CONFIG_KINDS}
+            if cfg != current:
+                current = cfg
+                runtime["config"] = {"version": (runtime["config"].get("version") or 0) + 1, **cfg}
+                notify_config_changed(app)
+        except Exception:
+            # Keep probing the last known config
+            pass
+        await anyio.sleep(interval_sec)
+
+
+async def run_agent(
+    central_url: str,
+    vantage: str,
+    spool_dir: str,
+    flush_interval_sec: float = 1.0,
+    batch_size: int = 5000,
+    config_interval_sec: float = 30.0,
+    auth: Optional[Tuple[str, str]] = None,
+) -> None:
+    central_url = central_url.rstrip("/")
+    spool = create_spool(spool_dir)
+    pending: List[Dict[str, Any]] = []
+    wake: Dict[str, Optional[anyio.Event]] = {"event": None}
+    batch_full = {"event": anyio.Event()}
+
+    async def submit(kind: str, record: Dict[str, Any]) -> None:
+        pending.append({"kind": kind, **record, "vantage": vantage})
+        if len(pending) >= batch_size:
+            batch_full["event"].set()
+
+    async def flush() -> None:
+        if not pending:
+            return
+        lines = pending[:]
+        pending.clear()
+        await anyio.to_thread.run_sync(spool["write"], lines)
+        if wake["event"] is not None:
+            wake["event"].set()
+
+    async def flush_loop() -> None:
+        while True:
+            with anyio.move_on_after(flush_interval_sec):
+                await batch_full["event"].wait()
+            batch_full["event"] = anyio.Event()
+            await flush()
+
+    runtime = create_probe_runtime(submit)
+    app = SimpleNamespace(state=SimpleNamespace(runtime=runtime))
+    runtime["spool"] = spool
+    async with httpx.AsyncClient(auth=auth, timeout=30.0) as client:
+        try:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(runtime["loop_monitor"]["run"])
+                tg.start_soon(pull_config, app, client, f"{central_url}/api/config/state", config_interval_sec)
+                tg.start_soon(start_scheduler, app, tg)
+                tg.start_soon(flush_loop)
+                tg.start_soon(push_spool, spool, client, f"{central_url}/api/ingest/samples", vantage, wake)
+        finally:
+            # Samples still in memory go to the spool and are sent on the next start
+            with anyio.CancelScope(shield=True):
+                await flush()
+
+
+async def _serve(**kwargs: Any) -> None:
+    # SIGINT/SIGTERM cancel the agent so the in-memory batch is spooled before exit
+    async with anyio.create_task_group() as tg:
+        async def agent() -> None:
+            await run_agent(**kwargs)
+            tg.cancel_scope.cancel()
+
+        tg.start_soon(agent)
+        with anyio.open_signal_receiver(signal.SIGINT, signal.SIGTERM) as signals:
+            async for _ in signals:
+                tg.cancel_scope.cancel()
+                return
+
+
+def main() -> None:  # pragma: no cover - process entry point
+    central_url = os.environ.get("CENTRAL_URL")
+    if not central_url:
+        sys.exit("CENTRAL_URL is required in agent mode")
+    password = os.environ.get("CENTRAL_PASSWORD")
+    anyio.run(lambda: _serve(
+        central_url=central_url,
+        vantage=os.environ.get("VANTAGE") or socket.gethostname(),
+        spool_dir=os.environ.get("AGENT_SPOOL_DIR", os.path.join("data", "spool")),
+        flush_interval_sec=float(os.environ.get("AGENT_FLUSH_SEC", "1.0")),
+        auth=(os.environ.get("CENTRAL_USER", "admin"), password) if password else None,
+    ))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
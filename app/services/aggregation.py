@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.utils.sketch import LOG_GAMMA, MIN_VALUE
+
+
+# Columnar aggregation engine shared by the rollup maintenance and the query
+# planner. Samples arrive as parallel columns (epoch seconds, latency,
+# success, series id); bucketing is integer arithmetic and every per-group
+# statistic is a NumPy group-by over one np.unique pass. The output is the
+# same mergeable aggregate state the rollups store (see rollups.new_aggregate).
+
+
+def aggregate_columns(
+    ts_sec: Sequence[int],
+    latency_ms: Sequence[float],
+    success: Sequence[bool],
+    series: Sequence[int],
+    step_sec: int,
+) -> Dict[Tuple[int, int], Dict[str, Any]]:
+    """Group samples by (bucket start in epoch seconds, series id) into aggregates."""
+    ts = np.asarray(ts_sec, dtype=np.int64)
+    if ts.size == 0:
+        return {}
+    latency = np.asarray(latency_ms, dtype=np.float64)
+    ok_mask = np.asarray(success, dtype=bool) & np.isfinite(latency)
+    series_ids = np.asarray(series, dtype=np.int64)
+
+    buckets = ts - ts % step_sec
+    first = int(buckets.min())
+    n_series = int(series_ids.max()) + 1
+    group_keys, inverse = np.unique((buckets - first) // step_sec * n_series + series_ids, return_inverse=True)
+    n_groups = group_keys.size
+
+    count = np.bincount(inverse, minlength=n_groups)
+    ok_groups = inverse[ok_mask]
+    ok_latency = latency[ok_mask]
+    ok = np.bincount(ok_groups, minlength=n_groups)
+    sums = np.bincount(ok_groups, weights=ok_latency, minlength=n_groups)
+    mins = np.full(n_groups, np.inf)
+    maxs = np.full(n_groups, -np.inf)
+    np.minimum.at(mins, ok_groups, ok_latency)
+    np.maximum.at(maxs, ok_groups, ok_latency)
+
+    # Sketch bins: same ceil(log_gamma(v)) indexing as app.utils.sketch
+    zero_mask = ok_latency <= MIN_VALUE
+    zeros = np.bincount(ok_groups[zero_mask], minlength=n_groups)
+    positive = ~zero_mask
+    bins = np.ceil(np.log(ok_latency[positive]) / LOG_GAMMA).astype(np.int64)
+    bin_groups = ok_groups[positive]
+    bin_lists: List[Dict[int, int]] = [{} for _ in range(n_groups)]
+    if bins.size:
+        low = int(bins.min())
+        span = int(bins.max()) - low + 1
+        pairs, pair_counts = np.unique(bin_groups * span + (bins - low), return_counts=True)
+        # pairs are sorted group-major, so each group's bins are one contiguous slice
+        bounds = np.searchsorted(pairs // span, np.arange(n_groups + 1)).tolist()
+        pair_bins = (pairs % span + low).tolist()
+        pair_counts = pair_counts.tolist()
+        bin_lists = [
+            dict(zip(pair_bins[lo:hi], pair_counts[lo:hi])) for lo, hi in zip(bounds[:-1], bounds[1:])
+        ]
+
+    result: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    bucket_of = (group_keys // n_series * step_sec + first).tolist()
+    series_of = (group_keys % n_series).tolist()
+    for g, (n, n_ok, total, lo, hi, zero) in enumerate(zip(
+        count.tolist(), ok.tolist(), sums.tolist(), mins.tolist(), maxs.tolist(), zeros.tolist()
+    )):
+        result[(bucket_of[g], series_of[g])] = {
+            "count": n,
+            "ok": n_ok,
+            "sum": total,
+            "min": lo if n_ok else None,
+            "max": hi if n_ok else None,
+            "sketch": {"bins": bin_lists[g], "zero": zero, "count": n_ok},
+        }
+    return result
+
+
+def group_samples(
+    ts_sec: Sequence[int],
+    latency_ms: Sequence[float],
+    success: Sequence[bool],
+    keys: Sequence[tuple],
+    step_sec: int,
+) -> Dict[tuple, Dict[str, Any]]:
+    """Aggregates keyed by ``(bucket datetime, *key)``; ``keys`` holds one key tuple per sample."""
+    index: Dict[tuple, int] = {}
+    series = [index.setdefault(key, len(index)) for key in keys]
+    names = list(index)
+    grouped = aggregate_columns(ts_sec, latency_ms, success, series, step_sec)
+    return {
+        (datetime.fromtimestamp(bucket, tz=timezone.utc),) + names[sid]: agg
+        for (bucket, sid), agg in grouped.items()
+    }
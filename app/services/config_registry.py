@@ -0,0 +1,100 @@
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db.repo import CONFIG_TABLES, apply_config_rows, fetch_config_rows, fetch_setting
+from app.services.scheduler import default_config
+
+
+CONFIG_KINDS = tuple(CONFIG_TABLES)
+# Set once the defaults were written (or a database already had config), so deleting every entry sticks
+SEEDED_SETTING = "config_seeded"
+
+
+def _to_row(kind: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    table = CONFIG_TABLES[kind]
+    row = {c.name: entry.get(c.name) for c in table.columns if c.name in entry}
+    if kind == "dns":
+        # Stored comma-separated; NULL means "use the system resolvers"
+        resolvers = entry.get("resolvers")
+        row["resolvers"] = ",".join(resolvers) if resolvers is not None else None
+    return row
+
+
+def _from_row(kind: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    entry = dict(row)
+    if kind == "dns":
+        raw = entry.get("resolvers")
+        entry["resolvers"] = [r for r in raw.split(",") if r] if raw is not None else None
+    if kind == "http" and not entry.get("mode"):
+        entry["mode"] = "cold"
+    if kind == "tcp" and not entry.get("family"):
+        entry["family"] = "both"
+    return entry
+
+
+def create_config_registry(engine: AsyncEngine, on_change: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """Id-indexed probe config backed by the targets/jobs tables.
+
+    Reads are served from memory; writes are committed first and only then
+    applied to the in-memory state, bumping ``version`` once per write.
+    """
+    state: Dict[str, Any] = {"version": 1, **{kind: {} for kind in CONFIG_KINDS}}
+    lock = anyio.Lock()
+
+    async def load() -> Dict[str, int]:
+        rows = await fetch_config_rows(engine)
+        if await fetch_setting(engine, SEEDED_SETTING) is None:
+            if not any(rows.values()):
+                # Fresh database: persist the defaults so they can be edited like any other entry
+                seed = default_config()
+                rows = {kind: [_to_row(kind, e) for e in seed[kind].values()] for kind in CONFIG_KINDS}
+                await apply_config_rows(engine, rows, {}, settings={SEEDED_SETTING: "1"})
+            else:
+                await apply_config_rows(engine, {}, {}, settings={SEEDED_SETTING: "1"})
+        for kind in CONFIG_KINDS:
+            state[kind] = {row["id"]: _from_row(kind, row) for row in rows[kind]}
+        return {kind: len(state[kind]) for kind in CONFIG_KINDS}
+
+    def get(kind: str, entry_id: str) -> Optional[Dict[str, Any]]:
+        return state[kind].get(entry_id)
+
+    def entries(kind: str) -> List[Dict[str, Any]]:
+        return list(state[kind].values())
+
+    def snapshot() -> Dict[str, Any]:
+        return state
+
+    async def apply(
+        upserts: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+        deletes: Optional[Dict[str, List[str]]] = None,
+    ) -> int:
+        upserts = {k: v for k, v in (upserts or {}).items() if v}
+        deletes = {k: v for k, v in (deletes or {}).items() if v}
+        async with lock:
+            if not upserts and not deletes:
+                return state["version"]
+            await apply_config_rows(
+                engine,
+                {kind: [_to_row(kind, e) for e in items] for kind, items in upserts.items()},
+                deletes,
+            )
+            for kind, ids in deletes.items():
+                for entry_id in ids:
+                    state[kind].pop(entry_id, None)
+            for kind, items in upserts.items():
+                for entry in items:
+                    state[kind][entry["id"]] = dict(entry)
+            state["version"] += 1
+        if on_change is not None:
+            on_change()
+        return state["version"]
+
+    return {
+        "load": load,
+        "get": get,
+        "entries": entries,
+        "snapshot": snapshot,
+        "apply": apply,
+    }
@@ -0,0 +1,159 @@
+import heapq
+import math
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import anyio
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
+
+
+# Probes in flight per probe type (worker pool size)
+DEFAULT_CONCURRENCY: Dict[str, int] = {"tcp": 256, "dns": 128, "http": 64}
+
+
+def _phase(key: str, interval_sec: float) -> float:
+    # Stable per-job offset so targets are spread evenly across their interval
+    return (zlib.crc32(key.encode("utf-8")) % 10000) / 10000.0 * interval_sec
+
+
+def create_dispatcher(concurrency: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Single timer heap that dispatches due probes into bounded worker pools.
+
+    Jobs are keyed by id and run on a fixed grid ``phase + n * interval``
+    (no drift accumulation). When a job is due it is handed to its probe
+    type's worker pool; if the previous run is still going or the pool's
+    queue is full the tick is counted as missed instead of piling up.
+    """
+    concurrency = dict(concurrency or DEFAULT_CONCURRENCY)
+    jobs: Dict[str, Dict[str, Any]] = {}
+    # Keys with a run in progress; survives the job being replaced mid-run
+    active: Set[str] = set()
+    heap: List[Tuple[float, int, str, int]] = []  # (due, seq, key, generation)
+    counter = {"seq": 0}
+    wake: Dict[str, Optional[anyio.Event]] = {"event": None}
+    senders: Dict[str, MemoryObjectSendStream] = {}
+    stats: Dict[str, Dict[str, Any]] = {
+        kind: {
+            "dispatched": 0, "completed": 0, "errors": 0, "missed": 0, "in_flight": 0,
+            "last_lag_ms": None, "avg_lag_ms": None, "max_lag_ms": 0.0,
+        }
+        for kind in concurrency
+    }
+
+    def _push(due: float, job: Dict[str, Any]) -> None:
+        counter["seq"] += 1
+        heapq.heappush(heap, (due, counter["seq"], job["key"], job["generation"]))
+
+    def _wake() -> None:
+        event = wake["event"]
+        if event is not None:
+            event.set()
+
+    def add(key: str, kind: str, interval_sec: float, run: Callable[[], Awaitable[None]],
+            first_due: Optional[float] = None, spec: Any = None) -> None:
+        if kind not in concurrency:
+            raise ValueError(f"Unknown probe kind: {kind}")
+        previous = jobs.get(key)
+        job = {
+            "key": key,
+            "kind": kind,
+            "interval": float(interval_sec),
+            "run": run,
+            "spec": spec,
+            "generation": (previous["generation"] + 1) if previous else 0,
+        }
+        jobs[key] = job
+        if first_due is None:
+            first_due = time.monotonic() + _phase(key, job["interval"])
+        job["next_due"] = first_due
+        _push(first_due, job)
+        _wake()
+
+    def remove(key: str) -> bool:
+        # Heap entries of removed jobs are discarded lazily when they surface
+        return jobs.pop(key, None) is not None
+
+    def clear() -> None:
+        jobs.clear()
+        heap.clear()
+
+    def get(key: str) -> Optional[Dict[str, Any]]:
+        return jobs.get(key)
+
+    def keys() -> List[str]:
+        return list(jobs)
+
+    def _record_lag(kind: str, lag_ms: float) -> None:
+        s = stats[kind]
+        s["last_lag_ms"] = lag_ms
+        s["max_lag_ms"] = max(s["max_lag_ms"], lag_ms)
+        s["avg_lag_ms"] = lag_ms if s["avg_lag_ms"] is None else (0.9 * s["avg_lag_ms"] + 0.1 * lag_ms)
+
+    async def _worker(kind: str, receive: MemoryObjectReceiveStream) -> None:
+        async for job, due in receive:
+            s = stats[kind]
+            _record_lag(kind, max(0.0, time.monotonic() - due) * 1000.0)
+            s["in_flight"] += 1
+            try:
+                await job["run"]()
+                s["completed"] += 1
+            except Exception:
+                s["errors"] += 1
+            finally:
+                s["in_flight"] -= 1
+                active.discard(job["key"])
+
+    def _dispatch_due(now: float) -> None:
+        while heap and heap[0][0] <= now:
+            due, _, key, generation = heapq.heappop(heap)
+            job = jobs.get(key)
+            if job is None or job["generation"] != generation:
+                continue
+            s = stats[job["kind"]]
+            interval = job["interval"]
+            # Next slot on the job's grid; ticks that already passed are missed, not replayed
+            behind = int(math.floor((now - due) / interval))
+            if behind > 0:
+                s["missed"] += behind
+            job["next_due"] = due + (behind + 1) * interval
+            _push(job["next_due"], job)
+            if key in active:
+                s["missed"] += 1
+                continue
+            try:
+                senders[job["kind"]].send_nowait((job, due))
+            except anyio.WouldBlock:
+                s["missed"] += 1
+                continue
+            active.add(key)
+            s["dispatched"] += 1
+
+    async def run() -> None:
+        async with anyio.create_task_group() as tg:
+            for kind, size in concurrency.items():
+                send, receive = anyio.create_memory_object_stream(max_buffer_size=size * 4)
+                senders[kind] = send
+                for _ in range(size):
+                    tg.start_soon(_worker, kind, receive.clone())
+                receive.close()
+            while True:
+                wake["event"] = anyio.Event()
+                _dispatch_due(time.monotonic())
+                timeout = (heap[0][0] - time.monotonic()) if heap else math.inf
+                with anyio.move_on_after(max(0.0, timeout)):
+                    await wake["event"].wait()
+
+    def snapshot_stats() -> Dict[str, Any]:
+        per_kind = {kind: dict(s, concurrency=concurrency[kind]) for kind, s in stats.items()}
+        return {"jobs": len(jobs), "heap": len(heap), "kinds": per_kind}
+
+    return {
+        "add": add,
+        "remove": remove,
+        "clear": clear,
+        "get": get,
+        "keys": keys,
+        "run": run,
+        "stats": snapshot_stats,
+    }
@@ -0,0 +1,161 @@
+import asyncio
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from contextlib import ExitStack
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import anyio
+import anyio.to_thread
+from anyio.from_thread import start_blocking_portal
+
+from app.routers.http_probe import close_http_clients, create_http_clients
+from app.utils.address_cache import create_address_cache
+from app.utils.loop_monitor import create_loop_monitor
+
+
+# A measurement: ``fn(ctx, *args)`` where ctx carries the loop's address_cache,
+# resolver_limiters, http_clients and loop_monitor (the app runtime has the same keys)
+Measure = Callable[..., Awaitable[Any]]
+
+
+async def measure(ctx: Dict[str, Any], fn: Measure, *args: Any) -> Tuple[Any, Optional[float]]:
+    """Run one measurement; returns ``(result, loop_lag_ms)`` for the loop it ran on."""
+    monitor = ctx.get("loop_monitor")
+    started = time.perf_counter()
+    result = await fn(ctx, *args)
+    lag_ms = monitor["lag_between"](started, time.perf_counter()) if monitor else None
+    return result, lag_ms
+
+
+async def _open_context(tick_sec: float) -> Dict[str, Any]:
+    # Clients, caches, DNS resolver limiters and the lag monitor are bound to the loop that uses them
+    return {
+        "address_cache": create_address_cache(),
+        "resolver_limiters": {},
+        "http_clients": create_http_clients(),
+        "loop_monitor": create_loop_monitor(tick_sec),
+    }
+
+
+def create_measurement_engine(loops: int = 1, tick_sec: float = 0.01) -> Dict[str, Any]:
+    """Probes on dedicated event loops, each in its own thread, that do nothing but measure.
+
+    Timestamps taken there are not delayed by the main loop's request
+    handling, fan-out or DB awaits. A job is pinned to one loop by key so its
+    keep-alive connections and cached addresses stay warm. Results come back
+    through a deque (append/popleft are atomic) drained by one
+    ``call_soon_threadsafe`` wake-up per burst, not one per result.
+    """
+    workers: List[Dict[str, Any]] = []
+    results: Deque[Tuple[int, Any, Optional[BaseException]]] = deque()
+    waiters: Dict[int, asyncio.Future] = {}
+    state: Dict[str, Any] = {"main_loop": None, "wake_pending": False, "seq": 0, "stack": None}
+    counters = {"submitted": 0, "completed": 0, "errors": 0, "wakeups": 0}
+
+    def _drain() -> None:
+        # Main loop. Clear the flag before draining so a result appended
+        # meanwhile either gets drained here or schedules a new wake-up
+        state["wake_pending"] = False
+        counters["wakeups"] += 1
+        while results:
+            token, outcome, error = results.popleft()
+            future = waiters.pop(token, None)
+            if future is None or future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(outcome)
+
+    def _deliver(token: int, outcome: Any, error: Optional[BaseException]) -> None:
+        # Measurement thread
+        results.append((token, outcome, error))
+        if not state["wake_pending"]:
+            state["wake_pending"] = True
+            state["main_loop"].call_soon_threadsafe(_drain)
+
+    async def _job(ctx: Dict[str, Any], token: int, fn: Measure, args: tuple) -> None:
+        try:
+            outcome = await measure(ctx, fn, *args)
+        except Exception as exc:
+            _deliver(token, None, exc)
+            return
+        _deliver(token, outcome, None)
+
+    def _start_sync() -> None:
+        stack = ExitStack()
+        state["stack"] = stack
+        for i in range(loops):
+            portal = stack.enter_context(start_blocking_portal(name=f"measurement-{i}"))
+            ctx = portal.call(_open_context, tick_sec)
+            tasks: Set[Future] = set()
+            _track(tasks, portal.start_task_soon(ctx["loop_monitor"]["run"]))
+            workers.append({"portal": portal, "context": ctx, "tasks": tasks})
+
+    def _track(tasks: Set[Future], task: Future) -> None:
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def _stop_sync() -> None:
+        # Cancel the monitors and in-flight probes so each portal can stop
+        # cleanly when the stack closes it
+        try:
+            for worker in workers:
+                for task in list(worker["tasks"]):
+                    task.cancel()
+                worker["portal"].call(close_http_clients, worker["context"]["http_clients"])
+        finally:
+            workers.clear()
+            stack, state["stack"] = state["stack"], None
+            if stack is not None:
+                stack.close()
+
+    async def start() -> None:
+        state["main_loop"] = asyncio.get_running_loop()
+        await anyio.to_thread.run_sync(_start_sync)
+
+    async def stop() -> None:
+        await anyio.to_thread.run_sync(_stop_sync)
+        for future in waiters.values():
+            if not future.done():
+                future.cancel()
+        waiters.clear()
+
+    async def run(key: str, fn: Measure, *args: Any) -> Tuple[Any, Optional[float]]:
+        """Run ``fn(ctx, *args)`` on the loop owning ``key``; returns ``(result, loop_lag_ms)``.
+
+        If the caller is cancelled the probe still finishes on its loop and
+        the result is discarded.
+        """
+        worker = workers[zlib.crc32(key.encode("utf-8")) % len(workers)]
+        state["seq"] += 1
+        token = state["seq"]
+        future = state["main_loop"].create_future()
+        waiters[token] = future
+        counters["submitted"] += 1
+        _track(worker["tasks"], worker["portal"].start_task_soon(_job, worker["context"], token, fn, args))
+        try:
+            outcome = await future
+        except Exception:
+            counters["errors"] += 1
+            raise
+        finally:
+            waiters.pop(token, None)
+        counters["completed"] += 1
+        return outcome
+
+    def stats() -> Dict[str, Any]:
+        return {
+            **counters,
+            "loops": [worker["context"]["loop_monitor"]["stats"]() for worker in workers],
+            "pending": len(waiters),
+        }
+
+    return {
+        "start": start,
+        "stop": stop,
+        "run": run,
+        "stats": stats,
+    }
@@ -0,0 +1,251 @@
+import bisect
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import anyio
+from anyio.abc import SocketStream
+from anyio.streams.buffered import BufferedByteReceiveStream
+
+from app.routers.http_probe import close_http_clients, create_http_clients
+from app.services.scheduler import _publish_and_buffer, notify_config_changed, start_scheduler
+from app.utils.address_cache import create_address_cache
+from app.utils.event_bus import utc_now_iso
+from app.utils.fast_json import dumps, loads
+from app.utils.loop_monitor import create_loop_monitor
+
+
+# Worker-pool mode: N probe processes, each owning a consistent-hash shard of
+# the config. They talk NDJSON over a Unix socket: the main process sends each
+# worker its shard of the config, workers send back batches of bus events and
+# sample records. The event bus, ring buffer and sample writer stay in the
+# main process.
+
+CONFIG_KINDS = ("tcp", "dns", "http")
+MAX_LINE_BYTES = 64 * 1024 * 1024
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def create_hash_ring(shards: int, replicas: int = 64) -> Dict[str, Any]:
+    """Consistent hashing: going from N to N+1 shards moves ~1/(N+1) of the keys."""
+    points = sorted(
+        (zlib.crc32(f"shard-{shard}-{replica}".encode("utf-8")), shard)
+        for shard in range(shards)
+        for replica in range(replicas)
+    )
+    hashes = [point for point, _ in points]
+
+    def shard_of(key: str) -> int:
+        index = bisect.bisect(hashes, zlib.crc32(key.encode("utf-8"))) % len(points)
+        return points[index][1]
+
+    return {"shard_of": shard_of}
+
+
+def shard_config(cfg: Dict[str, Any], shards: int) -> List[Dict[str, Any]]:
+    """Split an id-indexed config snapshot into one snapshot per shard."""
+    shard_of = create_hash_ring(shards)["shard_of"]
+    parts: List[Dict[str, Any]] = [
+        {"version": cfg.get("version", 1), **{kind: {} for kind in CONFIG_KINDS}} for _ in range(shards)
+    ]
+    for kind in CONFIG_KINDS:
+        for key, entry in cfg.get(kind, {}).items():
+            parts[shard_of(f"{kind}:{key}")][kind][key] = entry
+    return parts
+
+
+async def _send(stream: SocketStream, message: Dict[str, Any]) -> None:
+    await stream.send(dumps(message) + b"\n")
+
+
+async def _messages(stream: SocketStream):
+    reader = BufferedByteReceiveStream(stream)
+    while True:
+        try:
+            line = await reader.receive_until(b"\n", MAX_LINE_BYTES)
+        except (anyio.EndOfStream, anyio.IncompleteRead, anyio.BrokenResourceError, anyio.ClosedResourceError):
+            return
+        if line:
+            yield loads(line)
+
+
+# --- main process -----------------------------------------------------------
+
+async def _ingest_batch(app, message: Dict[str, Any]) -> None:
+    for event_type, data, ts in message.get("events", ()):
+        await _publish_and_buffer(app, event_type, data, ts=ts)
+    writer = app.state.runtime.get("sample_writer")
+    if writer:
+        for kind, record in message.get("records", ()):
+            record["ts"] = datetime.fromisoformat(record["ts"])
+            await writer["submit"](kind, record)
+
+
+async def run_probe_workers(app, workers: int, flush_interval_sec: float = 0.05) -> None:
+    """Run probes in ``workers`` child processes instead of on this loop.
+
+    Each child is restarted if it exits. Config changes are re-sharded and
+    pushed to every connected worker.
+    """
+    socket_dir = tempfile.mkdtemp(prefix="fireping-")
+    socket_path = os.path.join(socket_dir, "probes.sock")
+    conns: Dict[int, Tuple[SocketStream, anyio.Lock]] = {}
+    pool: Dict[str, Any] = {
+        "workers": workers,
+        "shards": [
+            {"shard": i, "connected": False, "restarts": 0, "batches": 0, "samples": 0, "entries": 0, "scheduler": None}
+            for i in range(workers)
+        ],
+    }
+    app.state.runtime["probe_workers"] = pool
+    sent: Dict[str, Any] = {"version": None}
+
+    async def push_config(shard: int, part: Dict[str, Any]) -> None:
+        conn = conns.get(shard)
+        if conn is None:
+            return
+        stream, lock = conn
+        try:
+            async with lock:
+                await _send(stream, {"type": "config", "config": part})
+            pool["shards"][shard]["entries"] = sum(len(part[kind]) for kind in CONFIG_KINDS)
+        except Exception:
+            pass
+
+    async def handle(stream: SocketStream) -> None:
+        shard: Optional[int] = None
+        async with stream:
+            async for message in _messages(stream):
+                kind = message.get("type")
+                if kind == "hello":
+                    shard = int(message["shard"])
+                    conns[shard] = (stream, anyio.Lock())
+                    pool["shards"][shard]["connected"] = True
+                    await push_config(shard, shard_config(app.state.runtime["config"], workers)[shard])
+                elif kind == "batch" and shard is not None:
+                    await _ingest_batch(app, message)
+                    stats = pool["shards"][shard]
+                    stats["batches"] += 1
+                    stats["samples"] += len(message.get("records", ()))
+                elif kind == "stats" and shard is not None:
+                    pool["shards"][shard]["scheduler"] = message.get("scheduler")
+        if shard is not None and conns.get(shard, (None,))[0] is stream:
+            del conns[shard]
+            pool["shards"][shard]["connected"] = False
+
+    async def supervise(shard: int) -> None:
+        command = [
+            sys.executable, "-m", "app.services.probe_workers", socket_path, str(shard), str(flush_interval_sec),
+        ]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get("PYTHONPATH")])))
+        while True:
+            process = await anyio.open_process(command, stdin=None, stdout=None, stderr=None, env=env)
+            try:
+                await process.wait()
+            finally:
+                if process.returncode is None:
+                    with anyio.CancelScope(shield=True):
+                        process.kill()
+                        await process.wait()
+            pool["shards"][shard]["restarts"] += 1
+            await anyio.sleep(1.0)
+
+    try:
+        listener = await anyio.create_unix_listener(socket_path)
+        async with listener, anyio.create_task_group() as tg:
+            tg.start_soon(listener.serve, handle)
+            for shard in range(workers):
+                tg.start_soon(supervise, shard)
+            while True:
+                # Same wake-up as the in-process scheduler (see notify_config_changed)
+                changed = anyio.Event()
+                app.state.runtime["config_event"] = changed
+                cfg = app.state.runtime["config"]
+                if cfg["version"] != sent["version"]:
+                    sent["version"] = cfg["version"]
+                    parts = shard_config(cfg, workers)
+                    for shard in list(conns):
+                        await push_config(shard, parts[shard])
+                await changed.wait()
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+# --- worker process ---------------------------------------------------------
+
+def create_probe_runtime(
+    submit: Callable[[str, Dict[str, Any]], Awaitable[None]],
+    publish: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+) -> Dict[str, Any]:
+    """Runtime for a process that only probes: samples go to ``submit``, events to ``publish``.
+
+    There is no ring buffer; whoever receives the samples buffers them.
+    """
+    async def discard(item: Dict[str, Any]) -> None:
+        return None
+
+    return {
+        "config": {"version": None, **{kind: {} for kind in CONFIG_KINDS}},
+        "event_bus": {"publish": publish or discard},
+        "ring_buffer": {"append": discard},
+        "sample_writer": {"submit": submit},
+        "address_cache": create_address_cache(),
+        "resolver_limiters": {},
+        "http_clients": create_http_clients(),
+        "loop_monitor": create_loop_monitor(),
+    }
+
+
+async def _worker_main(socket_path: str, shard: int, flush_interval_sec: float) -> None:
+    stream = await anyio.connect_unix(socket_path)
+    events: List[list] = []
+    records: List[list] = []
+
+    async def publish(event: Dict[str, Any]) -> None:
+        # Stamped here, when the probe finished, not when the main process receives the batch
+        events.append([event["type"], event["data"], event.get("ts") or utc_now_iso()])
+
+    async def submit(kind: str, record: Dict[str, Any]) -> None:
+        records.append([kind, record])
+
+    runtime = create_probe_runtime(submit, publish)
+    app = SimpleNamespace(state=SimpleNamespace(runtime=runtime))
+
+    async def flush() -> None:
+        last_stats = 0.0
+        while True:
+            await anyio.sleep(flush_interval_sec)
+            if events or records:
+                batch = {"type": "batch", "events": events[:], "records": records[:]}
+                events.clear()
+                records.clear()
+                await _send(stream, batch)
+            dispatcher = runtime.get("dispatcher")
+            if dispatcher is not None and time.monotonic() - last_stats >= 2.0:
+                last_stats = time.monotonic()
+                await _send(stream, {"type": "stats", "scheduler": dispatcher["stats"]()})
+
+    try:
+        async with stream, anyio.create_task_group() as tg:
+            await _send(stream, {"type": "hello", "shard": shard, "pid": os.getpid()})
+            tg.start_soon(runtime["loop_monitor"]["run"])
+            tg.start_soon(start_scheduler, app, tg)
+            tg.start_soon(flush)
+            async for message in _messages(stream):
+                if message.get("type") == "config":
+                    runtime["config"] = message["config"]
+                    notify_config_changed(app)
+            # Main process went away
+            tg.cancel_scope.cancel()
+    finally:
+        await close_http_clients(runtime["http_clients"])
+
+
+if __name__ == "__main__":  # pragma: no cover - entry point of a worker process
+    anyio.run(_worker_main, sys.argv[1], int(sys.argv[2]), float(sys.argv[3]) if len(sys.argv) > 3 else 0.05)
@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db.repo import fetch_aggregates_between, fetch_samples_after, fetch_watermark
+from app.services.aggregation import group_samples
+from app.services.rollups import (
+    ROLLUPS, TIER_TABLES, bucketize, pick_tier,
+    aggregate_from_row, aggregate_merge, aggregate_stats, new_aggregate,
+)
+
+
+async def query_rollup(
+    engine: AsyncEngine,
+    kind: str,
+    start: datetime,
+    end: datetime,
+    step_sec: int,
+    filters: Optional[Dict[str, List[Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """Plan and answer a rollup query as a list of per-``step_sec`` points.
+
+    Everything up to the rollup watermark is served from the coarsest
+    aggregate tier that tiles ``step_sec`` and still retains ``start`` (see
+    ``pick_tier``) and merged into ``step_sec`` buckets; only samples above
+    the watermark (the still-open tail) are read raw. Steps that do not align
+    to whole minutes fall back to raw samples for the full window.
+    """
+    src = ROLLUPS[kind][0]
+    watermark = await fetch_watermark(engine, src.name)
+    tier = pick_tier(step_sec, start, datetime.now(timezone.utc))
+    use_aggregates = watermark is not None and tier is not None
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+
+    if use_aggregates:
+        name, size = tier
+        table = TIER_TABLES[kind][name]
+        for row in await fetch_aggregates_between(engine, table, bucketize(start, size), end, filters):
+            b = bucketize(row["bucket"], step_sec)
+            agg = buckets.get(b)
+            if agg is None:
+                agg = buckets[b] = new_aggregate()
+            aggregate_merge(agg, aggregate_from_row(row))
+
+    after_id = watermark if use_aggregates else 0
+    rows = await fetch_samples_after(engine, src, after_id, start, end, filters)
+    if rows:
+        ts_sec, latency_ms, success = zip(*rows)
+        for (b,), agg in group_samples(ts_sec, latency_ms, success, [()] * len(rows), step_sec).items():
+            if b in buckets:
+                aggregate_merge(buckets[b], agg)
+            else:
+                buckets[b] = agg
+
+    points: List[Dict[str, Any]] = []
+    for b in sorted(buckets.keys()):
+        stats = aggregate_stats(buckets[b], [0.5, 0.95])
+        p50, p95 = stats["quantiles"]
+        count = stats["count"]
+        points.append({
+            "bucket": b,
+            "count": count,
+            "success_rate": (stats["success_count"] / count) if count else 0.0,
+            "p50": p50,
+            "p95": p95,
+            "avg": stats["avg"],
+        })
+    return points
@@ -1,86 +1,419 @@
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import anyio
-from sqlalchemy import select, insert
+import anyio.to_process
+from sqlalchemy import select, insert, delete, func, or_, and_
 from sqlalchemy.ext.asyncio import AsyncEngine
 
-from app.db.tables import samples_tcp, samples_dns, samples_http, aggregates_tcp_1m, aggregates_dns_1m, aggregates_http_1m
+from app.db.engine import create_engine_and_init
+from app.db.repo import epoch_seconds, prune_retention
+from app.db.tables import (
+    samples_tcp, samples_dns, samples_http,
+    aggregates_tcp_1m, aggregates_dns_1m, aggregates_http_1m,
+    aggregates_tcp_5m, aggregates_dns_5m, aggregates_http_5m,
+    aggregates_tcp_1h, aggregates_dns_1h, aggregates_http_1h,
+    aggregates_tcp_1d, aggregates_dns_1d, aggregates_http_1d,
+    rollup_watermarks, rollup_dirty, app_settings,
+)
+from app.services.aggregation import group_samples
+from app.utils.sketch import new_sketch, sketch_add, sketch_merge, sketch_quantiles, encode_sketch, decode_sketch
 
 
-def _bucketize(ts: datetime, step: int) -> datetime:
+BUCKET_SEC = 60
+
+
+def bucketize(ts: datetime, step: int) -> datetime:
+    if ts.tzinfo is None:
+        # SQLite hands back naive datetimes; they are stored as UTC
+        ts = ts.replace(tzinfo=timezone.utc)
     seconds = int(ts.timestamp())
     bucket = seconds - (seconds % step)
     return datetime.fromtimestamp(bucket, tz=timezone.utc)
 
 
-def _quantiles(values: List[float], qs: List[float]) -> List[Optional[float]]:
-    if not values:
-        return [None for _ in qs]
-    data = sorted(values)
-    out: List[Optional[float]] = []
-    for q in qs:
-        idx = max(0, min(len(data) - 1, int(round(q * (len(data) - 1)))))
-        out.append(data[idx])
-    return out
+ROLLUPS: Dict[str, Tuple[Any, Any, List[str]]] = {
+    "tcp": (samples_tcp, aggregates_tcp_1m, ["host", "port"]),
+    "dns": (samples_dns, aggregates_dns_1m, ["fqdn", "resolver"]),
+    "http": (samples_http, aggregates_http_1m, ["url", "method"]),
+}
 
 
-async def _rollup_table(engine: AsyncEngine, src, key_fields: List[str], dest, since: datetime) -> None:
-    async with engine.begin() as conn:
-        rows = (await conn.execute(select(src).where(src.c.ts >= since))).mappings().all()
-    buckets: Dict[tuple, Dict[str, Any]] = {}
-    for r in rows:
-        bucket = _bucketize(r["ts"], 60)
-        key = tuple([bucket] + [r[k] for k in key_fields])
-        entry = buckets.setdefault(key, {"lat": [], "ok": 0, "count": 0})
-        entry["count"] += 1
-        entry["ok"] += 1 if r["success"] else 0
-        if r["success"]:
-            entry["lat"].append(float(r["latency_ms"]))
-    values = []
-    for key, e in buckets.items():
-        p50, p95 = _quantiles(e["lat"], [0.5, 0.95])
-        avg = (sum(e["lat"]) / len(e["lat"])) if e["lat"] else None
-        record = {
-            "bucket": key[0],
-            key_fields[0]: key[1],
-        }
-        if len(key_fields) > 1:
-            record[key_fields[1]] = key[2]
-        if len(key_fields) > 2:
-            record[key_fields[2]] = key[3]
-        record.update({
-            "count": e["count"],
-            "success_count": e["ok"],
-            "p50": p50,
-            "p95": p95,
-            "avg": avg,
-            "min": min(e["lat"]) if e["lat"] else None,
-            "max": max(e["lat"]) if e["lat"] else None,
-        })
-        values.append(record)
-    if values:
+# Downsampling tiers, finest first. "1m" is built from raw samples, every other
+# tier from the one before it.
+TIERS: List[Tuple[str, int]] = [("1m", 60), ("5m", 300), ("1h", 3600), ("1d", 86400)]
+
+TIER_TABLES: Dict[str, Dict[str, Any]] = {
+    "tcp": {"1m": aggregates_tcp_1m, "5m": aggregates_tcp_5m, "1h": aggregates_tcp_1h, "1d": aggregates_tcp_1d},
+    "dns": {"1m": aggregates_dns_1m, "5m": aggregates_dns_5m, "1h": aggregates_dns_1h, "1d": aggregates_dns_1d},
+    "http": {"1m": aggregates_http_1m, "5m": aggregates_http_5m, "1h": aggregates_http_1h, "1d": aggregates_http_1d},
+}
+
+# Days of history kept per tier; "raw" is the samples_* tables
+RETENTION_DAYS: Dict[str, int] = {"raw": 14, "1m": 30, "5m": 90, "1h": 400, "1d": 1830}
+
+
+def pick_tier(step_sec: int, start: datetime, now: datetime) -> Optional[Tuple[str, int]]:
+    """Coarsest tier that tiles ``step_sec`` and still holds ``start``, or None for raw samples.
+
+    When no tiling tier retains ``start``, falls back to the finest coarser tier
+    that does, so old buckets come back at that tier's resolution instead of empty.
+    Steps that no tier tiles are answered from raw samples.
+    """
+    def retains(name: str) -> bool:
+        return now - timedelta(days=RETENTION_DAYS[name]) <= start
+
+    tiling = [(name, size) for name, size in TIERS if size <= step_sec and step_sec % size == 0]
+    if not tiling:
+        return None
+    for name, size in reversed(tiling):
+        if retains(name):
+            return name, size
+    for name, size in TIERS:
+        if size > tiling[-1][1] and retains(name):
+            return name, size
+    return TIERS[-1]
+
+
+def _key_value(value: Any) -> Any:
+    # Aggregate key columns are part of the primary key and cannot be NULL
+    return "" if value is None else value
+
+
+# Mergeable per-bucket state. Latency statistics only cover successful samples,
+# so ``sketch["count"]`` doubles as the divisor for ``sum``.
+def new_aggregate() -> Dict[str, Any]:
+    return {"count": 0, "ok": 0, "sum": 0.0, "min": None, "max": None, "sketch": new_sketch()}
+
+
+def aggregate_add(agg: Dict[str, Any], latency_ms: float, success: bool) -> None:
+    agg["count"] += 1
+    if not success:
+        return
+    agg["ok"] += 1
+    agg["sum"] += latency_ms
+    agg["min"] = latency_ms if agg["min"] is None else min(agg["min"], latency_ms)
+    agg["max"] = latency_ms if agg["max"] is None else max(agg["max"], latency_ms)
+    sketch_add(agg["sketch"], latency_ms)
+
+
+def aggregate_merge(into: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    into["count"] += other["count"]
+    into["ok"] += other["ok"]
+    into["sum"] += other["sum"]
+    for field, pick in (("min", min), ("max", max)):
+        if other[field] is not None:
+            into[field] = other[field] if into[field] is None else pick(into[field], other[field])
+    sketch_merge(into["sketch"], other["sketch"])
+    return into
+
+
+def aggregate_from_row(row: Any) -> Dict[str, Any]:
+    sketch = decode_sketch(row["sketch"])
+    avg = row["avg"]
+    return {
+        "count": row["count"],
+        "ok": row["success_count"],
+        "sum": (avg * sketch["count"]) if avg is not None else 0.0,
+        "min": row["min"],
+        "max": row["max"],
+        "sketch": sketch,
+    }
+
+
+def aggregate_stats(agg: Dict[str, Any], qs: List[float]) -> Dict[str, Any]:
+    n = agg["sketch"]["count"]
+    return {
+        "count": agg["count"],
+        "success_count": agg["ok"],
+        "avg": (agg["sum"] / n) if n else None,
+        "min": agg["min"],
+        "max": agg["max"],
+        "quantiles": sketch_quantiles(agg["sketch"], qs),
+    }
+
+
+def _aggregate_record(key: tuple, key_fields: List[str], agg: Dict[str, Any]) -> Dict[str, Any]:
+    stats = aggregate_stats(agg, [0.5, 0.95])
+    p50, p95 = stats["quantiles"]
+    record: Dict[str, Any] = {"bucket": key[0]}
+    for i, field in enumerate(key_fields):
+        record[field] = key[i + 1]
+    record.update({
+        "count": stats["count"],
+        "success_count": stats["success_count"],
+        "p50": p50,
+        "p95": p95,
+        "avg": stats["avg"],
+        "min": stats["min"],
+        "max": stats["max"],
+        "sketch": encode_sketch(agg["sketch"]),
+    })
+    return record
+
+
+async def _load_watermark(conn, src, since: datetime) -> int:
+    row = (await conn.execute(
+        select(rollup_watermarks.c.last_id).where(rollup_watermarks.c.name == src.name)
+    )).first()
+    if row is not None:
+        return int(row[0])
+    # First run for this table: start at the bootstrap window instead of all history
+    first_id = (await conn.execute(select(func.min(src.c.id)).where(src.c.ts >= since))).scalar()
+    if first_id is not None:
+        return int(first_id) - 1
+    last_id = (await conn.execute(select(func.max(src.c.id)))).scalar()
+    return int(last_id or 0)
+
+
+def _group_rows(rows, key_fields: List[str]) -> Dict[tuple, Dict[str, Any]]:
+    """Rows of ``(id, ts_sec, latency_ms, success, *keys)`` grouped into 1-minute aggregates."""
+    if not rows:
+        return {}
+    columns = list(zip(*rows))
+    keys = [tuple(_key_value(v) for v in key) for key in zip(*columns[4:4 + len(key_fields)])]
+    if not key_fields:
+        keys = [()] * len(rows)
+    return group_samples(columns[1], columns[2], columns[3], keys, BUCKET_SEC)
+
+
+async def _mark_dirty(conn, tier_index: int, kind: str, buckets) -> None:
+    if tier_index >= len(TIERS):
+        return
+    name, size = TIERS[tier_index]
+    parents = {bucketize(b, size) for b in buckets}
+    await conn.execute(
+        insert(rollup_dirty).prefix_with("OR IGNORE"),
+        [{"tier": name, "kind": kind, "bucket": b} for b in sorted(parents)],
+    )
+
+
+async def _rollup_table(
+    engine: AsyncEngine,
+    src,
+    key_fields: List[str],
+    dest,
+    since: datetime,
+    batch_rows: int = 50000,
+    kind: Optional[str] = None,
+) -> int:
+    """Fold samples newer than the table's watermark into 1-minute aggregates.
+
+    New rows are summarised per bucket and merged into the stored aggregate
+    (counts, min/max, sum and latency sketch), so existing samples are never
+    re-read. The watermark advances in the same transaction as the upsert.
+    ``since`` is used only to bootstrap a table that has no watermark yet.
+    With ``kind`` set, the touched 5-minute buckets are marked for rebuild.
+    Returns the number of new rows processed.
+    """
+    processed = 0
+    cols = [src.c.id, epoch_seconds(src.c.ts), src.c.latency_ms, src.c.success] + [src.c[k] for k in key_fields]
+    while True:
+        async with engine.begin() as conn:
+            last_id = await _load_watermark(conn, src, since)
+            new_rows = (await conn.execute(
+                select(*cols).where(src.c.id > last_id).order_by(src.c.id).limit(batch_rows)
+            )).all()
+            if not new_rows:
+                return processed
+            new_last_id = int(new_rows[-1][0])
+            groups = _group_rows(new_rows, key_fields)
+            buckets = sorted({key[0] for key in groups})
+            existing = (await conn.execute(select(dest).where(dest.c.bucket.in_(buckets)))).mappings().all()
+            legacy: Set[tuple] = set()
+            for row in existing:
+                key = tuple([bucketize(row["bucket"], BUCKET_SEC)] + [row[k] for k in key_fields])
+                if key not in groups:
+                    continue
+                if row["sketch"] is None and row["count"]:
+                    # Written before sketches existed; rebuild from its raw rows below
+                    legacy.add(key)
+                    continue
+                aggregate_merge(groups[key], aggregate_from_row(row))
+            if legacy:
+                step = timedelta(seconds=BUCKET_SEC)
+                lo, hi = min(k[0] for k in legacy), max(k[0] for k in legacy) + step
+                old_rows = (await conn.execute(
+                    select(*cols).where(src.c.ts >= lo, src.c.ts < hi, src.c.id <= last_id)
+                )).all()
+                for key, agg in _group_rows(old_rows, key_fields).items():
+                    if key in legacy:
+                        aggregate_merge(groups[key], agg)
+            values = [_aggregate_record(key, key_fields, agg) for key, agg in groups.items()]
+            await conn.execute(insert(dest).prefix_with("OR REPLACE"), values)
+            if kind is not None:
+                await _mark_dirty(conn, 1, kind, buckets)
+            await conn.execute(
+                insert(rollup_watermarks).prefix_with("OR REPLACE").values(
+                    name=src.name, last_id=new_last_id, updated_at=datetime.now(timezone.utc)
+                )
+            )
+        processed += len(new_rows)
+        if len(new_rows) < batch_rows:
+            return processed
+
+
+def _within(table, buckets: List[datetime], size: int):
+    span = timedelta(seconds=size)
+    return or_(*[and_(table.c.bucket >= b, table.c.bucket < b + span) for b in buckets])
+
+
+async def _rollup_tier(engine: AsyncEngine, kind: str, tier_index: int, batch_buckets: int = 200) -> int:
+    """Rebuild dirty buckets of one tier from the tier below and mark the next tier.
+
+    Each dirty bucket is recomputed from all of its source rows, so late data
+    in the finer tier is picked up. Buckets the source tier has already pruned
+    (a backfill older than its retention) only have the new rows left there:
+    those are merged into the stored bucket and then dropped from the source,
+    so they are not merged twice. Returns the number of buckets rebuilt.
+    """
+    name, size = TIERS[tier_index]
+    src_name = TIERS[tier_index - 1][0]
+    src = TIER_TABLES[kind][src_name]
+    dest = TIER_TABLES[kind][name]
+    key_fields = ROLLUPS[kind][2]
+    rebuilt = 0
+    while True:
         async with engine.begin() as conn:
-            await conn.execute(insert(dest).prefix_with("OR REPLACE").values(values))
+            dirty = (await conn.execute(
+                select(rollup_dirty.c.bucket)
+                .where(rollup_dirty.c.tier == name, rollup_dirty.c.kind == kind)
+                .order_by(rollup_dirty.c.bucket)
+                .limit(batch_buckets)
+            )).scalars().all()
+            if not dirty:
+                return rebuilt
+            buckets = [bucketize(b, size) for b in dirty]
+            rows = (await conn.execute(select(src).where(_within(src, buckets, size)))).mappings().all()
+            groups: Dict[tuple, Dict[str, Any]] = {}
+            for row in rows:
+                key = tuple([bucketize(row["bucket"], size)] + [row[k] for k in key_fields])
+                agg = groups.get(key)
+                if agg is None:
+                    agg = groups[key] = new_aggregate()
+                aggregate_merge(agg, aggregate_from_row(row))
+            horizon = await _pruned_before(conn, src_name)
+            pruned = [b for b in buckets if horizon is not None and b < horizon]
+            if pruned:
+                for row in (await conn.execute(select(dest).where(dest.c.bucket.in_(pruned)))).mappings().all():
+                    key = tuple([bucketize(row["bucket"], size)] + [row[k] for k in key_fields])
+                    if key in groups:
+                        aggregate_merge(groups[key], aggregate_from_row(row))
+                await conn.execute(delete(src).where(_within(src, pruned, size)))
+            if groups:
+                values = [_aggregate_record(key, key_fields, agg) for key, agg in groups.items()]
+                await conn.execute(insert(dest).prefix_with("OR REPLACE"), values)
+            await conn.execute(delete(rollup_dirty).where(
+                rollup_dirty.c.tier == name, rollup_dirty.c.kind == kind, rollup_dirty.c.bucket.in_(dirty)
+            ))
+            await _mark_dirty(conn, tier_index + 1, kind, buckets)
+        rebuilt += len(dirty)
+        if len(dirty) < batch_buckets:
+            return rebuilt
+
 
+def _pruned_key(name: str) -> str:
+    return f"tier_pruned_before_{name}"
 
-async def run_maintenance(app, interval_sec: float = 60.0, retention_days: int = 14) -> None:
+
+async def _pruned_before(conn, name: str) -> Optional[datetime]:
+    """Start of the range still held by tier ``name``; older buckets were pruned."""
+    value = (await conn.execute(
+        select(app_settings.c.value).where(app_settings.c.key == _pruned_key(name))
+    )).scalar()
+    return datetime.fromisoformat(value) if value else None
+
+
+async def _prune_tiers(engine: AsyncEngine, now: datetime) -> None:
+    async with engine.begin() as conn:
+        for index, (name, _) in enumerate(TIERS):
+            cutoff = now - timedelta(days=RETENTION_DAYS[name])
+            if index + 1 < len(TIERS):
+                # Whole buckets of the next tier, so a pruned range never splits
+                # one of its buckets; _rollup_tier reads the recorded cutoff
+                cutoff = bucketize(cutoff, TIERS[index + 1][1])
+                await conn.execute(
+                    insert(app_settings).prefix_with("OR REPLACE"),
+                    {"key": _pruned_key(name), "value": cutoff.isoformat()},
+                )
+            for tables in TIER_TABLES.values():
+                table = tables[name]
+                await conn.execute(delete(table).where(table.c.bucket < cutoff))
+
+
+async def maintenance_pass(
+    engine: AsyncEngine, now: datetime, retention_days: int = RETENTION_DAYS["raw"]
+) -> Dict[str, int]:
+    """One round of rollups, tier rebuilds and retention pruning."""
+    result = {"rows": 0, "buckets": 0}
+    # Incremental rollups; the 2 hour window only bootstraps a fresh database
+    window = now - timedelta(hours=2)
+    for kind, (src, dest, key_fields) in ROLLUPS.items():
+        result["rows"] += await _rollup_table(engine, src, key_fields, dest, window, kind=kind)
+        for tier_index in range(1, len(TIERS)):
+            result["buckets"] += await _rollup_tier(engine, kind, tier_index)
+    # Retention pruning, per tier
+    await prune_retention(engine, older_than=now - timedelta(days=retention_days))
+    await _prune_tiers(engine, now)
+    return result
+
+
+def _maintenance_worker(database_url: str, retention_days: int) -> Dict[str, int]:
+    """Runs in a worker process: its own event loop and its own engine."""
+    async def main() -> Dict[str, int]:
+        engine = await create_engine_and_init(database_url)
+        try:
+            return await maintenance_pass(engine, datetime.now(timezone.utc), retention_days)
+        finally:
+            await engine.dispose()
+
+    return anyio.run(main)
+
+
+async def run_maintenance(
+    app,
+    interval_sec: float = 60.0,
+    retention_days: int = RETENTION_DAYS["raw"],
+    offload: bool = True,
+) -> None:
+    """Periodic maintenance; with ``offload`` each pass runs in a worker process.
+
+    Rollups are CPU-bound and would otherwise stall the probes sharing this
+    event loop (and inflate their measured latency). SQLite in WAL mode lets
+    the worker write alongside the sample writer.
+    """
     engine: AsyncEngine = app.state.runtime.get("db_engine")
     if not engine:
         return
+    database_url = engine.url.render_as_string(hide_password=False)
+    if engine.url.database in (None, "", ":memory:"):
+        # An in-memory database is private to this process
+        offload = False
+    status: Dict[str, Any] = app.state.runtime.setdefault("maintenance", {"offload": offload, "runs": 0})
     while True:
+        started = time.perf_counter()
         try:
-            now = datetime.now(timezone.utc)
-            # Rollups (compute for last 2 hours)
-            window = now - timedelta(hours=2)
-            await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, window)
-            await _rollup_table(engine, samples_dns, ["fqdn", "resolver"], aggregates_dns_1m, window)
-            await _rollup_table(engine, samples_http, ["url", "method"], aggregates_http_1m, window)
-            # Retention pruning
-            from app.db.repo import prune_retention
-            await prune_retention(engine, older_than=now - timedelta(days=retention_days))
-        except Exception:
+            if offload:
+                result = await anyio.to_process.run_sync(
+                    _maintenance_worker, database_url, retention_days, cancellable=True
+                )
+            else:
+                result = await maintenance_pass(engine, datetime.now(timezone.utc), retention_days)
+            status.update(last_result=result, last_error=None)
+        except Exception as exc:
             # Best-effort maintenance
-            pass
-        await anyio.sleep(interval_sec)
+            status["last_error"] = str(exc) or type(exc).__name__
+        status["runs"] += 1
+        status["last_run"] = datetime.now(timezone.utc).isoformat()
+        status["last_duration_ms"] = (time.perf_counter() - started) * 1000.0
+        wake = app.state.runtime["maintenance_wake"] = anyio.Event()
+        with anyio.move_on_after(interval_sec):
+            await wake.wait()
+
 
+def request_maintenance(app) -> None:
+    """Start the next maintenance pass now instead of at the end of the interval (e.g. after a bulk load)."""
+    event = app.state.runtime.get("maintenance_wake")
+    if event is not None:
+        event.set()
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+import anyio
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.db.repo import insert_samples_batch
+
+
+def create_sample_writer(
+    engine: AsyncEngine,
+    max_queue: int = 10000,
+    batch_size: int = 500,
+    flush_interval_sec: float = 1.0,
+) -> Dict[str, Any]:
+    """Write-behind buffer that group-commits probe samples.
+
+    Probe loops ``submit`` records onto a bounded queue (blocking when it is
+    full) and a single ``run`` task flushes them as one transaction holding a
+    multi-row insert per table, whenever ``batch_size`` records are pending or
+    ``flush_interval_sec`` has passed since the first pending record.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+    # Records taken off the queue but not yet committed; flushed again on close
+    pending: List[Tuple[str, Dict[str, Any]]] = []
+    stats: Dict[str, Any] = {
+        "submitted": 0,
+        "written": 0,
+        "failed": 0,
+        "flushes": 0,
+        "backpressure_waits": 0,
+        "last_batch_size": 0,
+        "last_flush_ms": None,
+        "max_flush_ms": 0.0,
+        "total_flush_ms": 0.0,
+    }
+
+    async def submit(kind: str, record: Dict[str, Any]) -> None:
+        if queue.full():
+            stats["backpressure_waits"] += 1
+        await queue.put((kind, record))
+        stats["submitted"] += 1
+
+    async def _flush() -> None:
+        if not pending:
+            return
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for kind, record in pending:
+            grouped.setdefault(kind, []).append(record)
+        count = len(pending)
+        started = time.perf_counter()
+        try:
+            await insert_samples_batch(engine, grouped)
+            stats["written"] += count
+        except Exception:
+            # Best-effort: a failed batch is dropped rather than retried forever
+            stats["failed"] += count
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        pending.clear()
+        stats["flushes"] += 1
+        stats["last_batch_size"] = count
+        stats["last_flush_ms"] = elapsed_ms
+        stats["total_flush_ms"] += elapsed_ms
+        stats["max_flush_ms"] = max(stats["max_flush_ms"], elapsed_ms)
+
+    async def run() -> None:
+        while True:
+            pending.append(await queue.get())
+            deadline = time.monotonic() + flush_interval_sec
+            while len(pending) < batch_size:
+                try:
+                    pending.append(queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                with anyio.move_on_after(remaining):
+                    pending.append(await queue.get())
+            # Never cancel a commit halfway; shutdown waits for it instead
+            with anyio.CancelScope(shield=True):
+                await _flush()
+
+    async def close() -> None:
+        # Drain whatever is left once producers have stopped
+        with anyio.CancelScope(shield=True):
+            while True:
+                while len(pending) < batch_size:
+                    try:
+                        pending.append(queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+                if not pending:
+                    break
+                await _flush()
+
+    def snapshot_stats() -> Dict[str, Any]:
+        flushes = stats["flushes"]
+        out = dict(stats)
+        out["queue_depth"] = queue.qsize()
+        out["queue_capacity"] = max_queue
+        out["pending"] = len(pending)
+        out["avg_flush_ms"] = (stats["total_flush_ms"] / flushes) if flushes else None
+        return out
+
+    return {
+        "submit": submit,
+        "run": run,
+        "close": close,
+        "stats": snapshot_stats,
+    }
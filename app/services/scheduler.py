@@ -1,20 +1,16 @@
-import random
+import functools
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from datetime import datetime, timezone
 
 import anyio
 from fastapi import HTTPException
 
 from app.routers.ping import tcp_connect_latency, TcpPingResponse
-from app.routers.dns import resolve_dns, DnsQueryRequest, DnsQueryResponse
+from app.routers.dns import resolve_dns_fanout, DnsQueryRequest, DnsQueryResponse
 from app.routers.http_probe import probe_http, HttpProbeResponse
-from app.db.repo import insert_tcp_sample, insert_dns_sample, insert_http_sample
-
-
-def _jitter_seconds(base: float, pct: float = 0.15) -> float:
-    delta = base * pct
-    return base + random.uniform(-delta, +delta)
+from app.services.dispatcher import create_dispatcher
+from app.services.measurement import Measure, measure
 
 
 def default_ping_targets() -> List[Dict[str, Any]]:
@@ -39,146 +35,219 @@ def default_http_jobs() -> List[Dict[str, Any]]:
     ]
 
 
-async def _publish_and_buffer(app, event_type: str, data: Dict[str, Any]) -> None:
+async def _publish_and_buffer(app, event_type: str, data: Dict[str, Any], ts: Optional[str] = None) -> None:
     bus = app.state.runtime.get("event_bus")
     ring = app.state.runtime.get("ring_buffer")
-    await bus["publish"]({"type": event_type, "data": data})
-    await ring["append"]({"type": event_type, "data": data})
-
-
-async def _run_ping_loop(app, host: str, port: int, interval_sec: float) -> None:
-    while True:
-        started = time.perf_counter()
-        result: TcpPingResponse = await tcp_connect_latency(host, port, timeout_sec=min(2.0, interval_sec))
-        data = result.model_dump()
-        await _publish_and_buffer(app, "tcp_sample", data)
-        engine = app.state.runtime.get("db_engine")
-        if engine:
-            record = {
-                "ts": datetime.now(timezone.utc),
-                "target_id": None,
-                "host": data["host"],
-                "port": data["port"],
-                "latency_ms": data["latency_ms"],
-                "success": data["success"],
-            }
-            await insert_tcp_sample(engine, record)
-        elapsed = time.perf_counter() - started
-        sleep_s = max(0.05, _jitter_seconds(interval_sec) - elapsed)
-        await anyio.sleep(sleep_s)
-
-
-async def _run_dns_loop(app, fqdn: str, record_type: str, resolvers: List[str], interval_sec: float) -> None:
-    while True:
-        started = time.perf_counter()
-        try:
-            req = DnsQueryRequest(fqdn=fqdn, record_type=record_type, resolvers=resolvers)
-            result: DnsQueryResponse = await resolve_dns(req)
-        except HTTPException as exc:
-            # Map to a standard error response
-            result = DnsQueryResponse(
-                fqdn=fqdn,
-                record_type=record_type,
-                resolver=resolvers[0] if resolvers else None,
-                latency_ms=0.0,
-                rcode="ERROR",
-                success=False,
-                answers=[],
-            )
-        data = result.model_dump()
+    # ``ts`` is passed when the sample was taken elsewhere (e.g. a probe worker process)
+    event = {"type": event_type, "data": data, "ts": ts} if ts else {"type": event_type, "data": data}
+    await bus["publish"](event)
+    await ring["append"](event)
+
+
+async def _store_sample(app, kind: str, record: Dict[str, Any]) -> None:
+    # Hand off to the write-behind writer; blocks only when its queue is full
+    writer = app.state.runtime.get("sample_writer")
+    if writer:
+        await writer["submit"](kind, record)
+
+
+async def _measure(app, key: Optional[str], fn: Measure, *args: Any) -> Tuple[Any, Optional[float]]:
+    # On a dedicated measurement loop when one is running, else on this loop
+    engine = app.state.runtime.get("measurement")
+    if engine is not None:
+        return await engine["run"](key or "", fn, *args)
+    return await measure(app.state.runtime, fn, *args)
+
+
+async def _measure_tcp(ctx: Dict[str, Any], host: str, port: int, interval_sec: float, family: str) -> Dict[str, Any]:
+    result: TcpPingResponse = await tcp_connect_latency(
+        host, port, timeout_sec=min(2.0, interval_sec), address_cache=ctx.get("address_cache"), family=family,
+    )
+    return result.model_dump()
+
+
+async def _measure_dns(ctx: Dict[str, Any], fqdn: str, record_type: str, resolvers: List[str]) -> List[Dict[str, Any]]:
+    try:
+        req = DnsQueryRequest(fqdn=fqdn, record_type=record_type, resolvers=resolvers)
+        # One sample per resolver, all queried concurrently
+        results: List[DnsQueryResponse] = await resolve_dns_fanout(req, ctx.get("resolver_limiters"))
+    except HTTPException:
+        # Map to a standard error response
+        results = [DnsQueryResponse(
+            fqdn=fqdn,
+            record_type=record_type,
+            resolver=resolvers[0] if resolvers else None,
+            latency_ms=0.0,
+            rcode="ERROR",
+            success=False,
+            answers=[],
+        )]
+    return [result.model_dump() for result in results]
+
+
+async def _measure_http(ctx: Dict[str, Any], url: str, method: str, interval_sec: float, mode: str) -> Dict[str, Any]:
+    result: HttpProbeResponse = await probe_http(url, method, min(5.0, interval_sec), ctx.get("http_clients"), mode)
+    return result.model_dump()
+
+
+async def _probe_tcp(app, target_id: Optional[str], host: str, port: int, interval_sec: float,
+                     family: str = "both") -> None:
+    data, loop_lag_ms = await _measure(app, target_id, _measure_tcp, host, port, interval_sec, family)
+    data["loop_lag_ms"] = loop_lag_ms
+    await _publish_and_buffer(app, "tcp_sample", data)
+    record = {
+        "ts": datetime.now(timezone.utc),
+        "target_id": target_id,
+        "host": data["host"],
+        "port": data["port"],
+        "latency_ms": data["latency_ms"],
+        "resolve_ms": data["resolve_ms"],
+        "connect_ms": data["connect_ms"],
+        "address": data["address"],
+        "family": data["family"],
+        "success": data["success"],
+        "loop_lag_ms": loop_lag_ms,
+    }
+    await _store_sample(app, "tcp", record)
+
+
+async def _probe_dns(app, job_id: Optional[str], fqdn: str, record_type: str, resolvers: List[str]) -> None:
+    results, loop_lag_ms = await _measure(app, job_id, _measure_dns, fqdn, record_type, resolvers)
+    for data in results:
+        data["loop_lag_ms"] = loop_lag_ms
         await _publish_and_buffer(app, "dns_sample", data)
-        engine = app.state.runtime.get("db_engine")
-        if engine:
-            record = {
-                "ts": datetime.now(timezone.utc),
-                "job_id": None,
-                "fqdn": data["fqdn"],
-                "record_type": data["record_type"],
-                "resolver": data.get("resolver"),
-                "latency_ms": data["latency_ms"],
-                "rcode": data.get("rcode"),
-                "success": data["success"],
-            }
-            await insert_dns_sample(engine, record)
-        elapsed = time.perf_counter() - started
-        sleep_s = max(0.05, _jitter_seconds(interval_sec) - elapsed)
-        await anyio.sleep(sleep_s)
-
-
-async def _run_http_loop(app, url: str, method: str, interval_sec: float) -> None:
-    while True:
-        started = time.perf_counter()
-        result: HttpProbeResponse = await probe_http(url, method, timeout_sec=min(5.0, interval_sec))
-        data = result.model_dump()
-        await _publish_and_buffer(app, "http_sample", data)
-        engine = app.state.runtime.get("db_engine")
-        if engine:
-            record = {
-                "ts": datetime.now(timezone.utc),
-                "job_id": None,
-                "url": data["url"],
-                "method": data["method"],
-                "status_code": data.get("status_code"),
-                "latency_ms": data["latency_ms"],
-                "success": data["success"],
-                "error": data.get("error"),
-            }
-            await insert_http_sample(engine, record)
-        elapsed = time.perf_counter() - started
-        sleep_s = max(0.05, _jitter_seconds(interval_sec) - elapsed)
-        await anyio.sleep(sleep_s)
+        record = {
+            "ts": datetime.now(timezone.utc),
+            "job_id": job_id,
+            "fqdn": data["fqdn"],
+            "record_type": data["record_type"],
+            "resolver": data.get("resolver"),
+            "latency_ms": data["latency_ms"],
+            "rcode": data.get("rcode"),
+            "success": data["success"],
+            "loop_lag_ms": loop_lag_ms,
+        }
+        await _store_sample(app, "dns", record)
+
+
+async def _probe_http(app, job_id: Optional[str], url: str, method: str, interval_sec: float, mode: str) -> None:
+    data, loop_lag_ms = await _measure(app, job_id, _measure_http, url, method, interval_sec, mode)
+    data["loop_lag_ms"] = loop_lag_ms
+    await _publish_and_buffer(app, "http_sample", data)
+    record = {
+        "ts": datetime.now(timezone.utc),
+        "job_id": job_id,
+        "url": data["url"],
+        "method": data["method"],
+        "status_code": data.get("status_code"),
+        "latency_ms": data["latency_ms"],
+        "success": data["success"],
+        "error": data.get("error"),
+        "dns_ms": data.get("dns_ms"),
+        "connect_ms": data.get("connect_ms"),
+        "tls_ms": data.get("tls_ms"),
+        "ttfb_ms": data.get("ttfb_ms"),
+        "transfer_ms": data.get("transfer_ms"),
+        "reused": data.get("reused"),
+        "loop_lag_ms": loop_lag_ms,
+    }
+    await _store_sample(app, "http", record)
+
+
+# key -> (kind, interval_sec, run, spec); spec is what a change is detected on
+ConfigJobs = Dict[str, Tuple[str, float, Callable[[], Awaitable[None]], tuple]]
+
+
+def default_config() -> Dict[str, Any]:
+    """Default probes as an id-indexed registry snapshot (used to seed a new database)."""
+    tcp = {f"tcp-{t['host']}-{t['port']}-{i}": dict(t, family="both") for i, t in enumerate(default_ping_targets())}
+    dns = {f"dns-{j['fqdn']}-{i}": j for i, j in enumerate(default_dns_jobs())}
+    http = {f"http-{j['method']}-{i}": dict(j, mode="cold") for i, j in enumerate(default_http_jobs())}
+    cfg: Dict[str, Any] = {"version": 1}
+    for kind, entries in (("tcp", tcp), ("dns", dns), ("http", http)):
+        cfg[kind] = {key: dict(entry, id=key) for key, entry in entries.items()}
+    return cfg
+
+
+def _config_jobs(app, cfg: Dict[str, Any]) -> ConfigJobs:
+    """Flatten the config registry ({kind: {id: entry}}) into scheduler jobs."""
+    jobs: ConfigJobs = {}
+    for key, target in cfg.get("tcp", {}).items():
+        interval = float(target["interval_sec"])
+        family = target.get("family") or "both"
+        run = functools.partial(_probe_tcp, app, key, target["host"], target["port"], interval, family)
+        jobs[f"tcp:{key}"] = ("tcp", interval, run, (target["host"], target["port"], interval, family))
+    for key, job in cfg.get("dns", {}).items():
+        interval = float(job["interval_sec"])
+        record_type = job.get("record_type", "A")
+        resolvers = list(job.get("resolvers") or [])
+        run = functools.partial(_probe_dns, app, key, job["fqdn"], record_type, resolvers)
+        jobs[f"dns:{key}"] = ("dns", interval, run, (job["fqdn"], record_type, tuple(resolvers), interval))
+    for key, job in cfg.get("http", {}).items():
+        interval = float(job["interval_sec"])
+        method, mode = job.get("method", "GET"), job.get("mode") or "cold"
+        run = functools.partial(_probe_http, app, key, job["url"], method, interval, mode)
+        jobs[f"http:{key}"] = ("http", interval, run, (job["url"], method, interval, mode))
+    return jobs
+
+
+def reconcile_jobs(dispatcher: Dict[str, Any], desired: ConfigJobs) -> Dict[str, int]:
+    """Apply the difference between the dispatcher's jobs and ``desired``.
+
+    Unchanged jobs are left alone (schedule phase and in-flight probe intact);
+    changed jobs keep their next due time unless the new interval is shorter
+    than the wait; only added jobs get a fresh phase.
+    """
+    summary = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+    for key in dispatcher["keys"]():
+        if key not in desired:
+            dispatcher["remove"](key)
+            summary["removed"] += 1
+    now = time.monotonic()
+    for key, (kind, interval, run, spec) in desired.items():
+        current = dispatcher["get"](key)
+        if current is None:
+            dispatcher["add"](key, kind, interval, run, spec=spec)
+            summary["added"] += 1
+        elif current["spec"] != spec:
+            first_due = min(current["next_due"], now + interval)
+            dispatcher["add"](key, kind, interval, run, first_due=first_due, spec=spec)
+            summary["updated"] += 1
+        else:
+            summary["unchanged"] += 1
+    return summary
+
+
+def notify_config_changed(app) -> None:
+    """Wake the scheduler after a config mutation (replaces version polling)."""
+    event = app.state.runtime.get("config_event")
+    if event is not None:
+        event.set()
 
 
 async def start_scheduler(app, task_group: anyio.abc.TaskGroup) -> None:
-    # Watch in-memory config version and restart workers on change
+    # All probes run from one timer heap; config changes are diffed into it by id
+    dispatcher = create_dispatcher()
+    app.state.runtime["dispatcher"] = dispatcher
+    task_group.start_soon(dispatcher["run"])
     last_version: Optional[int] = None
     while True:
-        cfg = app.state.runtime.setdefault("config", {
-            "version": 1,
-            "tcp": default_ping_targets(),
-            "dns": default_dns_jobs(),
-            "http": default_http_jobs(),
-        })
+        # Armed before reading the config so a change made mid-reconcile is not lost
+        changed = anyio.Event()
+        app.state.runtime["config_event"] = changed
+        # Normally the config registry's live state, loaded from the database at startup
+        cfg = app.state.runtime.setdefault("config", default_config())
         if cfg["version"] != last_version:
             last_version = cfg["version"]
-            # Cancel previous child tasks by restarting our child group
-            async with anyio.create_task_group() as child:
-                for target in cfg.get("tcp", []):
-                    child.start_soon(_run_ping_loop, app, target["host"], target["port"], float(target["interval_sec"]))
-                for job in cfg.get("dns", []):
-                    child.start_soon(
-                        _run_dns_loop,
-                        app,
-                        job["fqdn"],
-                        job.get("record_type", "A"),
-                        list(job.get("resolvers", [])),
-                        float(job["interval_sec"]),
-                    )
-                for job in cfg.get("http", []):
-                    child.start_soon(
-                        _run_http_loop,
-                        app,
-                        job["url"],
-                        job.get("method", "GET"),
-                        float(job["interval_sec"]),
-                    )
-                # Sleep until config changes
-                while True:
-                    await anyio.sleep(1.0)
-                    current = app.state.runtime.get("config", cfg)
-                    if current.get("version") != last_version:
-                        child.cancel_scope.cancel()
-                        break
-
+            app.state.runtime["reconcile_last"] = reconcile_jobs(dispatcher, _config_jobs(app, cfg))
+        await changed.wait()
 
 
 async def run_scheduler(app) -> None:
     """Compatibility wrapper used by app.main to start the scheduler.
 
-    The scheduler manages its own child task group lifecycle, so we just
-    delegate to start_scheduler and let it run indefinitely.
+    The dispatcher's worker pools live in this task group alongside the
+    config watcher, so cancelling it stops every probe.
     """
-    # The second parameter is not used internally; pass a dummy TaskGroup context
     async with anyio.create_task_group() as tg:  # pragma: no cover
         await start_scheduler(app, tg)
-
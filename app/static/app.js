@@ -72,7 +72,7 @@ function upsertCard(key, payload) {
   val.className = `text-2xl font-semibold ${ok ? 'text-green-600' : 'text-red-600'}`;
 }
 
-function pushPoint(seriesIndex, label, value) {
+function pushPoint(seriesIndex, label, value, redraw = true) {
   // Add a new label and pad all datasets with null to keep lengths aligned
   state.labels.push(label);
   chart.data.labels = state.labels;
@@ -93,28 +93,75 @@ function pushPoint(seriesIndex, label, value) {
   const allValues = chart.data.datasets.flatMap(d => d.data).filter(v => Number.isFinite(v));
   const curMax = allValues.length ? Math.max(...allValues) : 1000;
   chart.options.scales.y.suggestedMax = Math.max(100, Math.ceil(curMax * 1.2));
-  chart.update('none');
+  if (redraw) chart.update('none');
 }
 
-function handleEvent(evt) {
-  let obj;
-  try {
-    obj = JSON.parse(evt.data);
-  } catch { return; }
-  const { type, data, ts } = obj;
+function applySample(type, data, ts, redraw = true) {
   const label = formatTimeEastern(ts || new Date().toISOString());
   if (type === 'tcp_sample') {
     upsertCard(`tcp-${data.host}:${data.port}`, data);
-    pushPoint(0, label, data.latency_ms);
+    pushPoint(0, label, data.latency_ms, redraw);
   } else if (type === 'dns_sample') {
     upsertCard(`dns-${data.fqdn}`, data);
-    pushPoint(1, label, data.latency_ms);
+    pushPoint(1, label, data.latency_ms, redraw);
   } else if (type === 'http_sample') {
     upsertCard(`http-${data.method} ${data.url}`, data);
-    pushPoint(2, label, data.latency_ms);
+    pushPoint(2, label, data.latency_ms, redraw);
   }
 }
 
+function handleEvent(evt) {
+  let obj;
+  try {
+    obj = JSON.parse(evt.data);
+  } catch { return; }
+  applySample(obj.type, obj.data, obj.ts);
+}
+
+function handleBatch(frame) {
+  // Columnar batch from /api/stream/ws: { series: { type: { ts: [...], field: [...] } } }
+  for (const [type, columns] of Object.entries(frame.series || {})) {
+    const names = Object.keys(columns);
+    for (let i = 0; i < columns.ts.length; i++) {
+      const data = {};
+      for (const name of names) data[name] = columns[name][i];
+      applySample(type, data, columns.ts[i], false);
+    }
+  }
+  chart.update('none');
+}
+
+function connectSse() {
+  const es = new EventSource('/api/stream/events');
+  es.onmessage = handleEvent;
+  es.onerror = () => {
+    // Auto-reconnect handled by EventSource; we can log if needed
+  };
+}
+
+function connectLive() {
+  // Batched WebSocket feed; falls back to SSE when WebSockets are unavailable
+  const proto = location.protocol === 'https:' ? 'wss' : 'ws';
+  let opened = false;
+  let ws;
+  try {
+    ws = new WebSocket(`${proto}://${location.host}/api/stream/ws?interval_ms=250`);
+  } catch {
+    connectSse();
+    return;
+  }
+  ws.onopen = () => { opened = true; };
+  ws.onmessage = (evt) => {
+    let frame;
+    try { frame = JSON.parse(evt.data); } catch { return; }
+    if (frame.type === 'batch') handleBatch(frame);
+  };
+  ws.onclose = () => {
+    if (opened) setTimeout(connectLive, 2000);
+    else connectSse();
+  };
+}
+
 async function bootstrap() {
   // Warm with recent samples
   try {
@@ -127,11 +174,7 @@ async function bootstrap() {
     }
   } catch {}
 
-  const es = new EventSource('/api/stream/events');
-  es.onmessage = handleEvent;
-  es.onerror = () => {
-    // Auto-reconnect handled by EventSource; we can log if needed
-  };
+  connectLive();
 
   await refreshSummary();
   // Summary every 30s
@@ -150,6 +193,7 @@ function updateFilterVisibility() {
   const kind = document.getElementById('hist-kind').value;
   document.getElementById('hist-filter-host').classList.toggle('hidden', kind !== 'tcp');
   document.getElementById('hist-filter-fqdn').classList.toggle('hidden', kind !== 'dns');
+  document.getElementById('hist-filter-url').classList.toggle('hidden', kind !== 'http');
 }
 
 async function runHistory() {
@@ -158,10 +202,12 @@ async function runHistory() {
   const step = parseInt(document.getElementById('hist-step').value, 10);
   const host = document.getElementById('hist-host').value.trim();
   const fqdn = document.getElementById('hist-fqdn').value.trim();
+  const target = document.getElementById('hist-url').value.trim();
   const params = new URLSearchParams({ minutes: String(minutes), step_sec: String(step) });
   if (kind === 'tcp' && host) params.set('host', host);
   if (kind === 'dns' && fqdn) params.set('fqdn', fqdn);
-  const url = kind === 'tcp' ? `/api/metrics/tcp_rollup?${params}` : `/api/metrics/dns_rollup?${params}`;
+  if (kind === 'http' && target) params.set('url', target);
+  const url = `/api/metrics/${kind}_rollup?${params}`;
   try {
     const res = await apiFetch(url);
     if (!res.ok) return;
@@ -509,10 +555,9 @@ document.body.addEventListener('click', async (e) => {
     let item = (kind === 'tcp' ? cfg.tcp : kind === 'dns' ? cfg.dns : cfg.http).find(x => x.id === id);
     const updated = openEditDialog(kind, item);
     if (!updated) return;
-    // For simplicity: delete then re-add with same id
+    // Upsert in place so the job keeps its schedule and history
     const path = kind === 'tcp' ? 'tcp' : kind === 'dns' ? 'dns' : 'http';
-    await apiFetch(`/api/config/${path}/${encodeURIComponent(id)}`, { method: 'DELETE' });
-    await apiFetch(`/api/config/${path}`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(updated) });
+    await apiFetch(`/api/config/${path}/bulk`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify([updated]) });
     await renderManageLists();
   }
 });
@@ -0,0 +1,148 @@
+import ipaddress
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import anyio
+
+try:
+    import dns.asyncresolver  # type: ignore
+    import dns.exception  # type: ignore
+except Exception:  # pragma: no cover
+    dns = None
+
+
+# (addresses, ttl_sec); raises on failure
+Lookup = Callable[[str], Awaitable[Tuple[List[str], float]]]
+
+_resolver = None
+
+
+def _get_resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver = dns.asyncresolver.Resolver()
+    return _resolver
+
+
+async def _getaddrinfo_lookup(host: str, ttl_sec: float = 60.0) -> Tuple[List[str], float]:
+    infos = await anyio.getaddrinfo(host, None, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in infos)), ttl_sec
+
+
+async def dns_lookup(host: str, timeout_sec: float = 2.0, default_ttl_sec: float = 60.0) -> Tuple[List[str], float]:
+    """Addresses from the system resolver, TTL from the DNS.
+
+    ``getaddrinfo`` decides the addresses, so /etc/hosts, nsswitch and search
+    domains apply as before. A and AAAA are queried through dnspython in
+    parallel only to learn how long the answer may be cached: the smaller TTL
+    of the answers that agree with the system resolver, ``default_ttl_sec``
+    when none does (e.g. a hosts file entry).
+    """
+    if dns is None:  # pragma: no cover
+        return await _getaddrinfo_lookup(host, default_ttl_sec)
+    answers: Dict[str, Any] = {}
+
+    async def query(rdtype: str) -> None:
+        try:
+            answers[rdtype] = await _get_resolver().resolve(host, rdtype, lifetime=timeout_sec)
+        except dns.exception.DNSException as exc:
+            answers[rdtype] = exc
+
+    async def system() -> None:
+        try:
+            answers["system"] = await _getaddrinfo_lookup(host, default_ttl_sec)
+        except OSError as exc:
+            answers["system"] = exc
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(system)
+        tg.start_soon(query, "AAAA")
+        tg.start_soon(query, "A")
+    if isinstance(answers["system"], Exception):
+        raise answers["system"]
+    addresses, ttl = answers["system"]
+    known = set(addresses)
+    ttls: List[float] = []
+    for rdtype in ("AAAA", "A"):
+        answer = answers[rdtype]
+        if isinstance(answer, Exception) or answer.rrset is None:
+            continue
+        if known.intersection(r.address for r in answer.rrset):
+            ttls.append(float(answer.rrset.ttl))
+    return addresses, min(ttls) if ttls else ttl
+
+
+def create_address_cache(
+    lookup: Optional[Lookup] = None,
+    min_ttl_sec: float = 1.0,
+    max_ttl_sec: float = 300.0,
+    negative_ttl_sec: float = 30.0,
+) -> Dict[str, Any]:
+    """Shared host -> addresses cache honouring record TTLs.
+
+    Failures are cached for ``negative_ttl_sec``; concurrent misses for the
+    same name share a single lookup.
+    """
+    lookup = lookup or dns_lookup
+    entries: Dict[str, Tuple[float, Optional[List[str]], Optional[str]]] = {}
+    inflight: Dict[str, anyio.Event] = {}
+    counters = {"hits": 0, "misses": 0, "negative_hits": 0, "lookups": 0, "coalesced": 0}
+
+    def _fresh(host: str) -> Optional[Tuple[float, Optional[List[str]], Optional[str]]]:
+        entry = entries.get(host)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry
+        return None
+
+    async def _refresh(host: str) -> None:
+        counters["lookups"] += 1
+        try:
+            addresses, ttl = await lookup(host)
+            if not addresses:
+                raise OSError(f"No addresses for {host}")
+            ttl = min(max(ttl, min_ttl_sec), max_ttl_sec)
+            entries[host] = (time.monotonic() + ttl, addresses, None)
+        except Exception as exc:
+            entries[host] = (time.monotonic() + negative_ttl_sec, None, str(exc) or type(exc).__name__)
+
+    async def resolve(host: str) -> List[str]:
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        entry = _fresh(host)
+        if entry is None:
+            event = inflight.get(host)
+            if event is not None:
+                counters["coalesced"] += 1
+                await event.wait()
+            else:
+                counters["misses"] += 1
+                event = inflight[host] = anyio.Event()
+                try:
+                    await _refresh(host)
+                finally:
+                    del inflight[host]
+                    event.set()
+            entry = entries.get(host)
+        elif entry[1] is None:
+            counters["negative_hits"] += 1
+        else:
+            counters["hits"] += 1
+        if entry is None or entry[1] is None:
+            raise OSError(entry[2] if entry else f"Lookup for {host} failed")
+        return entry[1]
+
+    def stats() -> Dict[str, Any]:
+        return {**counters, "entries": len(entries), "inflight": len(inflight)}
+
+    def clear() -> None:
+        entries.clear()
+
+    return {
+        "resolve": resolve,
+        "stats": stats,
+        "clear": clear,
+    }
@@ -1,52 +1,106 @@
 import asyncio
+import json
 from collections import deque
 from datetime import datetime, timezone
-from typing import Any, AsyncIterator, Deque, Dict, List, MutableSet, Tuple
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+
+# (event id, event, SSE wire bytes) - encoded once at publish time and shared by every subscriber
+Entry = Tuple[int, Dict[str, Any], bytes]
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def create_event_bus(max_recent_events: int = 500) -> Dict[str, Any]:
-    subscribers: MutableSet[asyncio.Queue] = set()
-    recent_events: Deque[Dict[str, Any]] = deque(maxlen=max_recent_events)
-    lock = asyncio.Lock()
+def encode_sse(event_id: int, event: Dict[str, Any]) -> bytes:
+    payload = json.dumps(event, separators=(",", ":"), default=str)
+    return f"id: {event_id}\ndata: {payload}\n\n".encode("utf-8")
+
+
+def create_event_bus(max_recent_events: int = 500, queue_size: int = 1000) -> Dict[str, Any]:
+    # Copy-on-write: subscribe/unsubscribe swap in a new tuple, so publish
+    # iterates a stable snapshot without taking a lock
+    state: Dict[str, Any] = {"subscribers": ()}
+    recent_events: Deque[Entry] = deque(maxlen=max_recent_events)
+    counters = {"published": 0, "dropped": 0, "filtered": 0}
 
     async def publish(event: Dict[str, Any]) -> None:
         # Attach server timestamp if not present
         if "ts" not in event:
             event["ts"] = utc_now_iso()
-        async with lock:
-            recent_events.append(event)
-            queues: List[asyncio.Queue] = list(subscribers)
-        for queue in queues:
+        # Ids are consecutive, which lets resume find its place in recent_events by offset
+        counters["published"] += 1
+        event_id = counters["published"]
+        entry: Entry = (event_id, event, encode_sse(event_id, event))
+        recent_events.append(entry)
+        for subscriber in state["subscribers"]:
+            match = subscriber["match"]
+            if match is not None and not match(event):
+                counters["filtered"] += 1
+                continue
             try:
-                queue.put_nowait(event)
+                subscriber["queue"].put_nowait(entry)
             except asyncio.QueueFull:
-                # Drop if consumer is too slow
-                pass
-
-    async def subscribe(with_replay: bool = True) -> AsyncIterator[Dict[str, Any]]:
-        queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
-        async with lock:
-            subscribers.add(queue)
-            snapshot: List[Dict[str, Any]] = list(recent_events) if with_replay else []
-        for event in snapshot:
+                # Consumer is too slow; count it so it shows up in stats
+                subscriber["dropped"] += 1
+                counters["dropped"] += 1
+
+    def _missed(last_event_id: Optional[int]) -> List[Entry]:
+        if last_event_id is None or not recent_events:
+            return list(recent_events)
+        first_id, newest_id = recent_events[0][0], recent_events[-1][0]
+        if last_event_id > newest_id:
+            # Id from before a restart: the client has nothing of ours yet
+            return list(recent_events)
+        return list(islice(recent_events, max(0, last_event_id - first_id + 1), None))
+
+    async def subscribe(
+        with_replay: bool = True,
+        last_event_id: Optional[int] = None,
+        match: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    ) -> AsyncIterator[Entry]:
+        """Yield ``(id, event, wire_bytes)`` entries; the bytes are shared, do not mutate the event.
+
+        ``last_event_id`` limits the replay to events published after it;
+        ``match`` filters events before they are queued to this subscriber.
+        """
+        subscriber = {
+            "queue": asyncio.Queue(maxsize=queue_size), "match": match, "dropped": 0, "delivered": 0,
+        }
+        snapshot: List[Entry] = _missed(last_event_id) if with_replay else []
+        if match is not None:
+            snapshot = [entry for entry in snapshot if match(entry[1])]
+        state["subscribers"] = state["subscribers"] + (subscriber,)
+        queue: asyncio.Queue = subscriber["queue"]
+        for entry in snapshot:
             try:
-                queue.put_nowait(event)
+                queue.put_nowait(entry)
             except asyncio.QueueFull:
                 break
         try:
             while True:
-                item = await queue.get()
-                yield item
+                entry = await queue.get()
+                subscriber["delivered"] += 1
+                yield entry
         finally:
-            async with lock:
-                subscribers.discard(queue)
+            state["subscribers"] = tuple(s for s in state["subscribers"] if s is not subscriber)
+
+    def stats() -> Dict[str, Any]:
+        subscribers = state["subscribers"]
+        return {
+            **counters,
+            "subscribers": [
+                {"queued": s["queue"].qsize(), "delivered": s["delivered"], "dropped": s["dropped"]}
+                for s in subscribers
+            ],
+            "recent": len(recent_events),
+            "last_id": counters["published"],
+        }
 
     return {
         "publish": publish,
         "subscribe": subscribe,
+        "stats": stats,
     }
-
@@ -0,0 +1,51 @@
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Optional
+
+from starlette.responses import Response
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value: Any) -> bytes:
+    """Compact JSON bytes; uses orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_lines(items: Iterable[Any]) -> bytes:
+    return b"".join(dumps(item) + b"\n" for item in items)
+
+
+class FastJSONResponse(Response):
+    """JSON response for records we built ourselves: no response_model revalidation."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def records_response(
+    body: Dict[str, Any], items_key: str, fmt: str = "json", headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """``body`` as JSON, or just ``body[items_key]`` as NDJSON (one record per line)."""
+    if fmt == "ndjson":
+        return Response(dumps_lines(body[items_key]), media_type="application/x-ndjson", headers=headers)
+    return FastJSONResponse(body, headers=headers)
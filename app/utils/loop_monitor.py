@@ -0,0 +1,54 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import anyio
+
+
+def create_loop_monitor(tick_sec: float = 0.01, history: int = 2000) -> Dict[str, Any]:
+    """Event-loop lag probe: a task that sleeps ``tick_sec`` and records how late it woke.
+
+    ``lag_between(start, end)`` is the worst lag seen in a window (including
+    the tick that is overdue right now). A probe whose timestamps span that
+    window may have been inflated by up to that much while its coroutine
+    waited to be resumed.
+    """
+    ticks: Deque[Tuple[float, float]] = deque(maxlen=history)  # (woke_at, lag_ms)
+    state: Dict[str, Any] = {"expected": None, "last_ms": None, "avg_ms": None, "max_ms": 0.0, "ticks": 0}
+
+    async def run() -> None:
+        while True:
+            expected = time.perf_counter() + tick_sec
+            state["expected"] = expected
+            await anyio.sleep(tick_sec)
+            woke = time.perf_counter()
+            lag_ms = max(0.0, woke - expected) * 1000.0
+            ticks.append((woke, lag_ms))
+            state["ticks"] += 1
+            state["last_ms"] = lag_ms
+            state["max_ms"] = max(state["max_ms"], lag_ms)
+            state["avg_ms"] = lag_ms if state["avg_ms"] is None else (0.99 * state["avg_ms"] + 0.01 * lag_ms)
+
+    def lag_between(start: float, end: float) -> Optional[float]:
+        """Worst lag (ms) in ``[start, end]`` on the ``time.perf_counter`` clock; None if not running."""
+        expected = state["expected"]
+        if expected is None:
+            return None
+        worst = 0.0
+        for woke, lag_ms in reversed(ticks):
+            if woke < start:
+                break
+            worst = max(worst, lag_ms)
+        if end > expected:
+            # The current tick is already late; that delay is part of the window too
+            worst = max(worst, (end - expected) * 1000.0)
+        return worst
+
+    def stats() -> Dict[str, Any]:
+        return {key: value for key, value in state.items() if key != "expected"}
+
+    return {
+        "run": run,
+        "lag_between": lag_between,
+        "stats": stats,
+    }
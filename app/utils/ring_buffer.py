@@ -1,30 +1,167 @@
-import asyncio
-from collections import deque
-from typing import Any, Deque, Dict, List, Optional
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from heapq import merge
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
 
 
-def create_ring_buffer(maxlen: int = 2000) -> Dict[str, Any]:
-    buffer: Deque[Dict[str, Any]] = deque(maxlen=maxlen)
-    lock = asyncio.Lock()
+# Field of ``data`` that identifies the target of each sample type
+TARGET_FIELDS = {"tcp_sample": "host", "dns_sample": "fqdn", "http_sample": "url"}
+# Fields that tell apart series sharing a target, e.g. two ports on one host;
+# the first one present wins
+INSTANCE_FIELDS = ("target_id", "job_id", "port")
+
+SeriesKey = Tuple[str, str, str]
+
+
+def series_of(item: Dict[str, Any]) -> SeriesKey:
+    """(type, target, instance) of a sample; queries select series by type and target."""
+    kind = item.get("type", "")
+    field = TARGET_FIELDS.get(kind)
+    data = item.get("data") or {}
+    target = str(data.get(field, "")) if field else ""
+    instance = next((str(data[f]) for f in INSTANCE_FIELDS if data.get(f) is not None), "")
+    return kind, target, instance
+
+
+def _new_ring(capacity: int) -> Dict[str, Any]:
+    return {"buf": [None] * capacity, "start": 0, "size": 0}
+
+
+def _ring_push(ring: Dict[str, Any], item: Dict[str, Any]) -> bool:
+    """Append, overwriting the oldest slot when full; True if an item was overwritten."""
+    buf = ring["buf"]
+    capacity = len(buf)
+    if ring["size"] < capacity:
+        buf[(ring["start"] + ring["size"]) % capacity] = item
+        ring["size"] += 1
+        return False
+    buf[ring["start"]] = item
+    ring["start"] = (ring["start"] + 1) % capacity
+    return True
+
+
+def _ring_pop_oldest(ring: Dict[str, Any]) -> None:
+    buf = ring["buf"]
+    buf[ring["start"]] = None
+    ring["start"] = (ring["start"] + 1) % len(buf)
+    ring["size"] -= 1
+
+
+def _ring_newest(ring: Dict[str, Any], since: int, limit: int) -> List[Dict[str, Any]]:
+    """Up to ``limit`` newest items with seq > since, oldest first; stops at the cursor."""
+    buf = ring["buf"]
+    capacity = len(buf)
+    out: List[Dict[str, Any]] = []
+    for i in range(ring["size"] - 1, -1, -1):
+        item = buf[(ring["start"] + i) % capacity]
+        if item["seq"] <= since or len(out) >= limit:
+            break
+        out.append(item)
+    out.reverse()
+    return out
+
+
+def _deque_newest(items: Deque[Dict[str, Any]], since: int, limit: int) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for item in reversed(items):
+        if item["seq"] <= since or len(out) >= limit:
+            break
+        out.append(item)
+    out.reverse()
+    return out
+
+
+def create_ring_buffer(
+    maxlen: int = 5000, per_series: int = 256, max_total: int = 200_000
+) -> Dict[str, Any]:
+    """Recent samples indexed by series (type + target + instance) with a global budget.
+
+    Each series keeps a fixed-capacity ring of its latest ``per_series``
+    samples. When the total exceeds ``max_total``, the least recently
+    updated series give up their oldest samples first. ``maxlen`` bounds
+    the all-series and per-type indexes used by unfiltered queries.
+    """
+    series: "OrderedDict[SeriesKey, Dict[str, Any]]" = OrderedDict()
+    # (type, target) -> keys of its series, for target queries
+    by_target: Dict[Tuple[str, str], Set[SeriesKey]] = {}
+    latest: Deque[Dict[str, Any]] = deque(maxlen=maxlen)
+    by_type: Dict[str, Deque[Dict[str, Any]]] = {}
+    counters = {"seq": 0, "total": 0, "evicted": 0}
 
     async def append(item: Dict[str, Any]) -> None:
-        async with lock:
-            buffer.append(item)
+        counters["seq"] += 1
+        item = {**item, "seq": counters["seq"]}
+        if not item.get("ts"):
+            item["ts"] = datetime.now(timezone.utc).isoformat()
+        key = series_of(item)
+        ring = series.get(key)
+        if ring is None:
+            ring = series[key] = _new_ring(per_series)
+            by_target.setdefault(key[:2], set()).add(key)
+        else:
+            series.move_to_end(key)
+        if not _ring_push(ring, item):
+            counters["total"] += 1
+        latest.append(item)
+        by_type.setdefault(key[0], deque(maxlen=maxlen)).append(item)
+        while counters["total"] > max_total:
+            stale_key, stale = next(iter(series.items()))
+            _ring_pop_oldest(stale)
+            counters["total"] -= 1
+            counters["evicted"] += 1
+            if stale["size"] == 0:
+                del series[stale_key]
+                keys = by_target[stale_key[:2]]
+                keys.discard(stale_key)
+                if not keys:
+                    del by_target[stale_key[:2]]
+
+    async def query(
+        types: Optional[Iterable[str]] = None,
+        targets: Optional[Iterable[str]] = None,
+        since: int = 0,
+        limit: int = 500,
+    ) -> List[Dict[str, Any]]:
+        """Newest ``limit`` samples after the ``since`` cursor (a ``seq``), oldest first."""
+        type_list = list(types or [])
+        target_list = list(targets or [])
+        if target_list:
+            kinds = type_list or list(TARGET_FIELDS)
+            rings = [series[key] for k in kinds for t in target_list for key in by_target.get((k, t), ())]
+            parts = [_ring_newest(ring, since, limit) for ring in rings]
+        elif type_list:
+            parts = [_deque_newest(by_type[k], since, limit) for k in type_list if k in by_type]
+        else:
+            parts = [_deque_newest(latest, since, limit)]
+        if len(parts) == 1:
+            return parts[0]
+        items = list(merge(*parts, key=lambda entry: entry["seq"]))
+        return items[-limit:]
 
     async def snapshot(limit: Optional[int] = None) -> List[Dict[str, Any]]:
-        async with lock:
-            data = list(buffer)
-        if limit is not None:
-            return data[-limit:]
-        return data
+        return await query(limit=limit if limit is not None else maxlen)
 
     async def clear() -> None:
-        async with lock:
-            buffer.clear()
+        series.clear()
+        by_target.clear()
+        latest.clear()
+        by_type.clear()
+        counters["total"] = 0
+
+    def stats() -> Dict[str, Any]:
+        return {
+            "series": len(series),
+            "samples": counters["total"],
+            "evicted": counters["evicted"],
+            "last_seq": counters["seq"],
+            "per_series": per_series,
+            "max_total": max_total,
+        }
 
     return {
         "append": append,
+        "query": query,
         "snapshot": snapshot,
         "clear": clear,
+        "stats": stats,
     }
-
@@ -0,0 +1,128 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Log-bucketed quantile sketch (DDSketch style). Every value v > MIN_VALUE lands
+# in bin ceil(log_gamma(v)), so any quantile is within RELATIVE_ACCURACY of the
+# true value, and two sketches merge exactly by adding their bin counts.
+RELATIVE_ACCURACY = 0.01
+MIN_VALUE = 1e-3
+_GAMMA = (1.0 + RELATIVE_ACCURACY) / (1.0 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(_GAMMA)
+_FORMAT_VERSION = 1
+
+
+def new_sketch() -> Dict[str, Any]:
+    return {"bins": {}, "zero": 0, "count": 0}
+
+
+def bin_index(value: float) -> int:
+    return int(math.ceil(math.log(value) / LOG_GAMMA))
+
+
+def bin_value(index: int) -> float:
+    # Midpoint estimate for (gamma^(i-1), gamma^i] with relative error <= alpha
+    return 2.0 * (_GAMMA ** index) / (_GAMMA + 1.0)
+
+
+def sketch_add(sketch: Dict[str, Any], value: float, count: int = 1) -> None:
+    if value <= MIN_VALUE:
+        sketch["zero"] += count
+    else:
+        bins = sketch["bins"]
+        idx = bin_index(value)
+        bins[idx] = bins.get(idx, 0) + count
+    sketch["count"] += count
+
+
+def sketch_merge(into: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    bins = into["bins"]
+    for idx, count in other["bins"].items():
+        bins[idx] = bins.get(idx, 0) + count
+    into["zero"] += other["zero"]
+    into["count"] += other["count"]
+    return into
+
+
+def sketch_quantiles(sketch: Dict[str, Any], qs: List[float]) -> List[Optional[float]]:
+    total = sketch["count"]
+    if not total:
+        return [None for _ in qs]
+    ordered = sorted(sketch["bins"].items())
+    out: List[Optional[float]] = []
+    for q in qs:
+        rank = max(0.0, min(1.0, q)) * (total - 1)
+        cumulative = sketch["zero"]
+        if rank < cumulative:
+            out.append(0.0)
+            continue
+        value = bin_value(ordered[-1][0]) if ordered else 0.0
+        for idx, count in ordered:
+            cumulative += count
+            if rank < cumulative:
+                value = bin_value(idx)
+                break
+        out.append(value)
+    return out
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_sketch(sketch: Dict[str, Any]) -> bytes:
+    """Serialize as: version, zero count, bin count, then (zigzag index delta, count) pairs."""
+    out = bytearray([_FORMAT_VERSION])
+    _write_varint(out, sketch["zero"])
+    ordered = sorted(sketch["bins"].items())
+    _write_varint(out, len(ordered))
+    prev = 0
+    for idx, count in ordered:
+        delta = idx - prev
+        prev = idx
+        _write_varint(out, (delta << 1) ^ (delta >> 63))
+        _write_varint(out, count)
+    return bytes(out)
+
+
+def decode_sketch(blob: Optional[bytes]) -> Dict[str, Any]:
+    sketch = new_sketch()
+    if not blob:
+        return sketch
+    if blob[0] != _FORMAT_VERSION:
+        raise ValueError(f"Unsupported sketch format version {blob[0]}")
+    pos = 1
+    zero, pos = _read_varint(blob, pos)
+    nbins, pos = _read_varint(blob, pos)
+    bins = sketch["bins"]
+    prev = 0
+    total = zero
+    for _ in range(nbins):
+        raw, pos = _read_varint(blob, pos)
+        count, pos = _read_varint(blob, pos)
+        prev += (raw >> 1) ^ -(raw & 1)
+        bins[prev] = count
+        total += count
+    sketch["zero"] = zero
+    sketch["count"] = total
+    return sketch
+
@@ -0,0 +1,67 @@
+"""Compare row-by-row aggregation with the columnar NumPy engine.
+
+Usage: python benchmarks/bench_aggregation.py [rows] [series]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, ".")
+
+import numpy as np  # noqa: E402
+
+from app.services.aggregation import group_samples  # noqa: E402
+from app.services.rollups import BUCKET_SEC, aggregate_add, bucketize, new_aggregate  # noqa: E402
+
+
+def make_rows(n_rows: int, n_series: int):
+    rng = random.Random(42)
+    start = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+    hosts = [f"10.0.{i // 256}.{i % 256}" for i in range(n_series)]
+    return [
+        (start + i * 86400 // n_rows, rng.lognormvariate(3.0, 0.8), rng.random() > 0.02, (hosts[i % n_series], 443))
+        for i in range(n_rows)
+    ]
+
+
+def row_by_row(rows):
+    # The pre-engine path: a datetime per row, then a dict lookup and a scalar update
+    groups = {}
+    for ts, latency, ok, key in rows:
+        bucket = bucketize(datetime.fromtimestamp(ts, tz=timezone.utc), BUCKET_SEC)
+        agg = groups.get((bucket,) + key)
+        if agg is None:
+            agg = groups[(bucket,) + key] = new_aggregate()
+        aggregate_add(agg, latency, ok)
+    return groups
+
+
+def columnar(columns):
+    ts_sec, latency, ok, keys = columns
+    return group_samples(ts_sec, latency, ok, keys, BUCKET_SEC)
+
+
+def main() -> None:
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_series = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rows = make_rows(n_rows, n_series)
+    # The engine is fed columns, as the rollups fetch them
+    ts_sec, latency, ok, keys = zip(*rows)
+    columns = (np.array(ts_sec, dtype=np.int64), np.array(latency), np.array(ok), keys)
+    timings = {}
+    results = {}
+    for name, func, data in (("row_by_row", row_by_row, rows), ("columnar", columnar, columns)):
+        started = time.perf_counter()
+        groups = results[name] = func(data)
+        timings[name] = time.perf_counter() - started
+        print(f"{name:>10}: {timings[name]:7.3f} s  ({len(groups)} groups, {n_rows / timings[name]:,.0f} rows/s)")
+    # Both paths must bucket by UTC and count the same rows for the comparison to hold
+    expected, got = results["row_by_row"], results["columnar"]
+    if expected.keys() != got.keys() or any(expected[k]["count"] != got[k]["count"] for k in expected):
+        sys.exit("row_by_row and columnar disagree")
+    print(f"   speedup: {timings['row_by_row'] / timings['columnar']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Throughput of the streaming bulk-ingest endpoint against a uvicorn server on a fresh SQLite file.
+
+Usage: python benchmarks/bench_ingest.py [samples] [series] [--gzip]
+"""
+import gzip
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+
+def make_body(n_samples: int, n_series: int) -> bytes:
+    # A backfill: time-ordered TCP samples from many targets, one every 5 s per target
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    step = timedelta(seconds=5) / n_series
+    lines = []
+    for i in range(n_samples):
+        lines.append(json.dumps({
+            "kind": "tcp",
+            "ts": (start + step * i).isoformat().replace("+00:00", "Z"),
+            "host": f"10.0.{(i % n_series) // 256}.{i % 256}",
+            "port": 443,
+            "latency_ms": round(5.0 + (i * 7919) % 400 / 10.0, 3),
+            "success": i % 50 != 0,
+        }))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def chunks(body: bytes, size: int = 256 * 1024):
+    for offset in range(0, len(body), size):
+        yield body[offset:offset + size]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    n_samples = int(args[0]) if args else 500_000
+    n_series = int(args[1]) if len(args) > 1 else 100
+    body = make_body(n_samples, n_series)
+    headers = {"Content-Type": "application/x-ndjson"}
+    if "--gzip" in sys.argv:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+
+    port = free_port()
+    env = dict(os.environ, DATABASE_FILE=os.path.join(tempfile.mkdtemp(), "bench.db"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"], env=env
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{base}/healthz")
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        started = time.perf_counter()
+        response = httpx.post(f"{base}/api/ingest/bulk", content=chunks(body), headers=headers, timeout=600)
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+    result = response.json()
+    print(f"samples:      {n_samples:,} ({len(body) / 1e6:.1f} MB{' gzip' if '--gzip' in sys.argv else ''})")
+    print(f"accepted:     {result['accepted']:,}  rejected: {result['rejected']}")
+    print(f"server:       {result['elapsed_ms']:8.1f} ms  {result['samples_per_sec']:,.0f} samples/s")
+    print(f"client total: {elapsed * 1000:8.1f} ms  {n_samples / elapsed:,.0f} samples/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -47,12 +47,202 @@ def test_config_state_and_add_delete_tcp():
         assert all(t["id"] != tid for t in final["tcp"])
 
 
+
+def test_config_bulk_upsert_delete_and_replace():
+    import json
+
+    with TestClient(app) as client:
+        original = client.get("/api/config/state").json()
+        targets = [{"id": f"bulk-{i}", "host": "127.0.0.1", "port": 9, "interval_sec": 60.0} for i in range(50)]
+        r = client.post("/api/config/tcp/bulk", json=targets)
+        assert r.status_code == 200
+        diff = r.json()
+        assert diff["added"] == 50 and diff["version"] == original["version"] + 1
+        # NDJSON: one edit, one unchanged, one new
+        lines = [dict(targets[0], port=10), targets[1], {"id": "bulk-new", "host": "127.0.0.1", "port": 9}]
+        r = client.post("/api/config/tcp/bulk", content="\n".join(json.dumps(x) for x in lines),
+                        headers={"Content-Type": "application/x-ndjson"})
+        assert r.json()["added"] == 1 and r.json()["updated"] == 1 and r.json()["unchanged"] == 1
+        bad = client.post("/api/config/tcp/bulk", json=[targets[0], targets[0]])
+        assert bad.status_code == 422
+        invalid = client.post("/api/config/tcp/bulk", json=[{"id": "x", "host": "h", "interval_sec": 0}])
+        assert invalid.status_code == 422
+        r = client.post("/api/config/tcp/bulk/delete", json={"ids": [t["id"] for t in targets] + ["missing"]})
+        assert r.json()["removed"] == 50
+        r = client.put("/api/config/tcp", json=original["tcp"])
+        assert r.json()["removed"] == 1 and r.json()["unchanged"] == len(original["tcp"])
+        final = client.get("/api/config/state").json()
+        assert final["tcp"] == original["tcp"]
+        assert final["version"] == original["version"] + 4
+
 def test_metrics_recent():
     with TestClient(app) as client:
         # Seed one HTTP probe
         client.post("/api/http/probe", json={"url": "https://example.com", "method": "HEAD", "timeout_sec": 5})
         r = client.get("/api/metrics/recent?limit=10")
+        client.post("/api/ping/tcp", json={"host": "127.0.0.1", "port": 9, "timeout_sec": 0.2})
+        filtered = client.get("/api/metrics/recent", params={"type": "tcp_sample", "target": "127.0.0.1"})
     assert r.status_code == 200
     items = r.json()["items"]
     assert isinstance(items, list)
+    body = filtered.json()
+    assert [i["data"]["host"] for i in body["items"]] == ["127.0.0.1"]
+    assert body["cursor"] == body["items"][-1]["seq"]
+
+
+
+def test_metrics_writer_stats():
+    with TestClient(app) as client:
+        r = client.get("/api/metrics/writer")
+    assert r.status_code == 200
+    body = r.json()
+    assert "queue_depth" in body
+    assert "last_flush_ms" in body
+
+
+def test_metrics_percentiles_from_sketches():
+    with TestClient(app) as client:
+        r = client.get("/api/metrics/percentiles?kind=dns&minutes=60&q=0.99&q=0.999")
+    assert r.status_code == 200
+    body = r.json()
+    assert set(body["quantiles"]) == {"0.99", "0.999"}
+    assert body["count"] >= 0
+
+
+def test_http_rollup():
+    with TestClient(app) as client:
+        r = client.get("/api/metrics/http_rollup?minutes=60&step_sec=60")
+    assert r.status_code == 200
+    assert isinstance(r.json()["points"], list)
+
+
+def test_rollup_long_window_uses_coarse_tier():
+    with TestClient(app) as client:
+        ok = client.get("/api/metrics/tcp_rollup?minutes=129600&step_sec=86400")
+        too_many = client.get("/api/metrics/tcp_rollup?minutes=129600&step_sec=60")
+    assert ok.status_code == 200
+    assert too_many.status_code == 400
+
+
+def test_metrics_scheduler_stats():
+    with TestClient(app) as client:
+        r = client.get("/api/metrics/scheduler")
+    assert r.status_code == 200
+    body = r.json()
+    assert body["jobs"] >= 1
+    assert set(body["kinds"]) == {"tcp", "dns", "http"}
+
+
+def test_stream_ws_batches_columnar_and_coalesces():
+    with TestClient(app) as client:
+        bus = client.app.state.runtime["event_bus"]
+        with client.websocket_connect("/api/stream/ws?type=tcp_sample&host=h0&host=h1&interval_ms=100&coalesce=true") as ws:
+            hello = ws.receive_json()
+            assert hello["type"] == "hello" and hello["coalesce"] is True
+            for i in range(10):
+                event = {"type": "tcp_sample", "data": {"host": f"h{i % 2}", "port": 443, "latency_ms": float(i)}}
+                client.portal.call(bus["publish"], event)
+            client.portal.call(bus["publish"], {"type": "dns_sample", "data": {"host": "h0"}})
+            frame = ws.receive_json()
+            assert frame["type"] == "batch" and frame["count"] == 2 and frame["coalesced"] == 8
+            columns = frame["series"]["tcp_sample"]
+            assert columns["host"] == ["h0", "h1"] and columns["latency_ms"] == [8.0, 9.0]
+            assert list(frame["series"]) == ["tcp_sample"]
+
+            ws.send_json({"coalesce": False, "fields": ["latency_ms"]})
+            assert ws.receive_json()["coalesce"] is False
+            for i in range(3):
+                client.portal.call(bus["publish"], {"type": "tcp_sample", "data": {"host": "h0", "latency_ms": float(i)}})
+            frame = ws.receive_json()
+            assert frame["count"] == 3
+            assert set(frame["series"]["tcp_sample"]) == {"ts", "latency_ms"}
+
+
+def test_metrics_fast_path_ndjson_and_openapi():
+    import json
+
+    with TestClient(app) as client:
+        client.post("/api/ping/tcp", json={"host": "127.0.0.1", "port": 9, "timeout_sec": 0.2})
+        r = client.get("/api/metrics/recent", params={"type": "tcp_sample", "format": "ndjson"})
+        rollup = client.get("/api/metrics/tcp_rollup?minutes=60&step_sec=60")
+        schema = client.get("/openapi.json").json()
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines and lines[-1]["type"] == "tcp_sample" and int(r.headers["x-cursor"]) == lines[-1]["seq"]
+    assert set(rollup.json()) == {"points"}
+    ok = schema["paths"]["/api/metrics/recent"]["get"]["responses"]["200"]["content"]["application/json"]
+    assert ok["schema"]["$ref"].endswith("/SamplesResponse")
+
+
+def test_ingest_samples_gzip_ndjson_with_rejects_and_retries():
+    import gzip
+    import json
+    import uuid
+
+    vantage = f"agent-{uuid.uuid4().hex[:6]}"
+    lines = [
+        {"kind": "tcp", "ts": "2030-01-01T00:00:00Z", "host": "10.0.0.1", "port": 443,
+         "latency_ms": 12.5, "success": True, "vantage": vantage},
+        {"kind": "dns", "ts": "2030-01-01T00:00:01Z", "fqdn": "example.com", "record_type": "A",
+         "latency_ms": 3.0, "success": True, "vantage": vantage},
+        {"kind": "tcp", "ts": "2030-01-01T00:00:02Z", "host": "10.0.0.1", "port": 0, "latency_ms": 1.0, "success": True},
+    ]
+    body = gzip.compress(("\n".join(json.dumps(l) for l in lines) + "\n{not json\n").encode())
+    headers = {"Content-Encoding": "gzip", "Content-Type": "application/x-ndjson", "X-Batch-Id": vantage}
+    with TestClient(app) as client:
+        r = client.post("/api/ingest/samples", content=body, headers=headers)
+        again = client.post("/api/ingest/samples", content=body, headers=headers)
+        recent = client.get("/api/metrics/recent", params={"type": "tcp_sample", "target": "10.0.0.1"})
+    assert r.status_code == 200
+    result = r.json()
+    assert (result["accepted"], result["rejected"]) == (2, 2)
+    assert [e["line"] for e in result["errors"]] == [3, 4]
+    assert again.json()["duplicate"] is True and again.json()["accepted"] == 0
+    item = recent.json()["items"][-1]
+    assert item["data"]["vantage"] == vantage and item["ts"].startswith("2030-01-01T00:00:00")
+
+
+def test_ingest_batch_id_is_claimed_while_in_flight_and_released_on_failure():
+    import json
+    import threading
+    import uuid
+
+    import anyio
+
+    batch_id = f"agent-{uuid.uuid4().hex[:6]}"
+    line = {"kind": "tcp", "ts": "2030-01-01T00:00:00Z", "host": "10.0.0.2", "port": 443,
+            "latency_ms": 1.0, "success": True}
+    body = (json.dumps(line) + "\n").encode()
+    headers = {"Content-Type": "application/x-ndjson", "X-Batch-Id": batch_id}
+    with TestClient(app) as client:
+        runtime = client.app.state.runtime
+        writer = runtime["sample_writer"]
+        release = anyio.Event()
+        entered = threading.Event()
+
+        async def failing_submit(kind, record):
+            entered.set()
+            with anyio.move_on_after(5):
+                await release.wait()
+            raise RuntimeError("writer gone")
+
+        runtime["sample_writer"] = {**writer, "submit": failing_submit}
+        first = {}
+
+        def post_first():
+            try:
+                client.post("/api/ingest/samples", content=body, headers=headers)
+            except RuntimeError as exc:
+                first["error"] = exc
 
+        thread = threading.Thread(target=post_first)
+        thread.start()
+        assert entered.wait(5)
+        racing = client.post("/api/ingest/samples", content=body, headers=headers)
+        client.portal.call(release.set)
+        thread.join(5)
+        runtime["sample_writer"] = writer
+        retried = client.post("/api/ingest/samples", content=body, headers=headers)
+    assert racing.json()["duplicate"] is True
+    assert isinstance(first.get("error"), RuntimeError)
+    assert retried.json()["duplicate"] is False and retried.json()["accepted"] == 1
@@ -0,0 +1,1127 @@
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import anyio
+import dns.message
+import dns.rrset
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.db.repo import init_schema, sample_columns
+from app.db.tables import aggregates_tcp_1m, rollup_dirty, samples_tcp
+from app.routers.dns import DnsQueryRequest, query_nameserver, resolve_dns_fanout
+from app.routers.http_probe import close_http_clients, create_http_clients, probe_http
+from app.routers.ping import _connect, _order_addresses, tcp_connect_latency
+from app.routers.stream import build_event_filter
+from app.services.agent import create_spool, push_spool
+from app.services.aggregation import group_samples
+from app.services.config_registry import create_config_registry
+from app.services.dispatcher import create_dispatcher
+from app.services.measurement import create_measurement_engine, measure
+from app.services.probe_workers import create_hash_ring, run_probe_workers, shard_config
+from app.services.rollup_query import query_rollup
+from app.services.rollups import (
+    TIER_TABLES, TIERS, _rollup_table, _rollup_tier, aggregate_add, bucketize, new_aggregate, pick_tier,
+    maintenance_pass, run_maintenance,
+)
+from app.services.sample_writer import create_sample_writer
+from app.services.scheduler import _config_jobs, reconcile_jobs
+from app.utils.address_cache import create_address_cache
+from app.utils.event_bus import create_event_bus
+from app.utils.loop_monitor import create_loop_monitor
+from app.utils.ring_buffer import create_ring_buffer
+from app.utils.sketch import (
+    RELATIVE_ACCURACY, decode_sketch, encode_sketch, new_sketch, sketch_add, sketch_merge, sketch_quantiles,
+)
+
+
+class _OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _tcp_record(i: int) -> dict:
+    return {
+        "ts": datetime.now(timezone.utc),
+        "target_id": None,
+        "host": "127.0.0.1",
+        "port": 1000 + i,
+        "latency_ms": float(i),
+        "success": True,
+    }
+
+
+def test_sample_writer_batches_and_flushes_on_close(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'w.db'}")
+        await init_schema(engine)
+        writer = create_sample_writer(engine, max_queue=50, batch_size=20, flush_interval_sec=0.05)
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(writer["run"])
+            for i in range(45):
+                await writer["submit"]("tcp", _tcp_record(i))
+            await anyio.sleep(0.2)
+            for i in range(5):
+                await writer["submit"]("tcp", _tcp_record(100 + i))
+            tg.cancel_scope.cancel()
+        await writer["close"]()
+        async with engine.begin() as conn:
+            count = (await conn.execute(select(func.count()).select_from(samples_tcp))).scalar()
+        await engine.dispose()
+        return count, writer["stats"]()
+
+    count, stats = anyio.run(main)
+    assert count == 50
+    assert stats["written"] == 50
+    assert stats["queue_depth"] == 0
+    # 45 records with batch_size=20 need at least three commits, not 45
+    assert 3 <= stats["flushes"] < 45
+
+
+def test_sample_writer_mixes_local_and_ingested_records(tmp_path):
+    # Local probes omit ``vantage``; ingested records carry every column
+    def ingested(i: int) -> dict:
+        record = {column: None for column in sample_columns("tcp")}
+        record.update(_tcp_record(i), vantage="agent-1")
+        return record
+
+    async def main(name, records):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / name}")
+        await init_schema(engine)
+        writer = create_sample_writer(engine, batch_size=10, flush_interval_sec=0.05)
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(writer["run"])
+            for kind, record in records:
+                await writer["submit"](kind, record)
+            tg.cancel_scope.cancel()
+        await writer["close"]()
+        async with engine.begin() as conn:
+            rows = (await conn.execute(select(samples_tcp.c.port, samples_tcp.c.vantage))).all()
+        await engine.dispose()
+        return sorted(rows)
+
+    local_first = anyio.run(main, "a.db", [("tcp", _tcp_record(1)), ("tcp", ingested(2))])
+    ingested_first = anyio.run(main, "b.db", [("tcp", ingested(2)), ("tcp", _tcp_record(1))])
+    assert local_first == ingested_first == [(1001, None), (1002, "agent-1")]
+
+
+def test_incremental_rollup_only_processes_new_rows(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'r.db'}")
+        await init_schema(engine)
+        bucket = datetime(2030, 1, 1, 12, 0, tzinfo=timezone.utc)
+        since = bucket - timedelta(hours=2)
+
+        async def add(n: int, latency: float) -> None:
+            async with engine.begin() as conn:
+                await conn.execute(insert(samples_tcp), [
+                    {"ts": bucket + timedelta(seconds=i), "host": "h", "port": 1, "latency_ms": latency, "success": True}
+                    for i in range(n)
+                ])
+
+        async def agg_count() -> int:
+            async with engine.begin() as conn:
+                row = (await conn.execute(select(aggregates_tcp_1m))).mappings().one()
+            assert decode_sketch(row["sketch"])["count"] == row["success_count"]
+            return row["count"]
+
+        await add(10, 5.0)
+        first = await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, since)
+        count_1 = await agg_count()
+        idle = await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, since)
+        await add(5, 7.0)
+        second = await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, since)
+        count_2 = await agg_count()
+        await engine.dispose()
+        return first, count_1, idle, second, count_2
+
+    first, count_1, idle, second, count_2 = anyio.run(main)
+    assert (first, count_1) == (10, 10)
+    assert idle == 0
+    assert (second, count_2) == (5, 15)
+
+
+def test_maintenance_runs_in_worker_process_without_blocking_loop(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'm.db'}")
+        await init_schema(engine)
+        start = datetime.now(timezone.utc) - timedelta(minutes=10)
+        async with engine.begin() as conn:
+            await conn.execute(insert(samples_tcp), [
+                {"ts": start + timedelta(seconds=i % 300), "host": f"h{i % 50}", "port": 1,
+                 "latency_ms": 1.0 + i % 97, "success": True}
+                for i in range(50_000)
+            ])
+        app = SimpleNamespace(state=SimpleNamespace(runtime={"db_engine": engine}))
+        gaps = []
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(run_maintenance, app, 3600.0)
+            last = time.perf_counter()
+            while app.state.runtime.get("maintenance", {}).get("runs", 0) < 1:
+                await anyio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+            tg.cancel_scope.cancel()
+        async with engine.begin() as conn:
+            aggregated = (await conn.execute(select(func.sum(aggregates_tcp_1m.c.count)))).scalar()
+        await engine.dispose()
+        return app.state.runtime["maintenance"], aggregated, max(gaps)
+
+    status, aggregated, worst_gap = anyio.run(main)
+    assert status["offload"] is True and status["last_error"] is None
+    assert status["last_result"]["rows"] == 50_000
+    assert aggregated == 50_000
+    # The loop kept ticking while the worker aggregated
+    assert worst_gap < 0.25
+
+
+def test_sketch_roundtrip_merge_and_accuracy():
+    def sketch_of(values):
+        sketch = new_sketch()
+        for v in values:
+            sketch_add(sketch, v)
+        return sketch
+
+    values = [0.5 + (i % 997) * 0.37 for i in range(20000)]
+    left = sketch_of(values[:7000])
+    right = sketch_of(values[7000:])
+    merged = sketch_merge(decode_sketch(encode_sketch(left)), decode_sketch(encode_sketch(right)))
+    assert merged == sketch_of(values)
+    ordered = sorted(values)
+    for q in (0.5, 0.95, 0.99, 0.999):
+        exact = ordered[int(round(q * (len(ordered) - 1)))]
+        (approx,) = sketch_quantiles(merged, [q])
+        assert abs(approx - exact) <= RELATIVE_ACCURACY * exact + 1e-9
+
+
+def test_rollup_query_merges_aggregates_with_raw_tail(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'q.db'}")
+        await init_schema(engine)
+        base = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=10)
+
+        async def add(offsets) -> None:
+            async with engine.begin() as conn:
+                await conn.execute(insert(samples_tcp), [
+                    {"ts": base + timedelta(seconds=o), "host": "h", "port": 1,
+                     "latency_ms": 1.0 + o % 50, "success": o % 7 != 0}
+                    for o in offsets
+                ])
+
+        await add(range(0, 480, 4))
+        await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, base - timedelta(hours=1))
+        # Not rolled up yet: must come from the raw tail, including a minute already aggregated
+        await add(range(1, 600, 10))
+        start, end = base, base + timedelta(minutes=10)
+        planned = await query_rollup(engine, "tcp", start, end, 120, {"host": ["h"]})
+        raw = await query_rollup(engine, "tcp", start, end, 30, {"host": ["h"]})
+        await engine.dispose()
+        return planned, raw
+
+    planned, raw = anyio.run(main)
+    assert sum(p["count"] for p in planned) == 120 + 60
+    assert sum(p["count"] for p in raw) == 120 + 60
+    assert all(p["bucket"].timestamp() % 120 == 0 for p in planned)
+
+
+def test_downsampling_tiers_build_from_tier_below(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 't.db'}")
+        await init_schema(engine)
+        base = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        async with engine.begin() as conn:
+            await conn.execute(insert(samples_tcp), [
+                {"ts": base + timedelta(seconds=30 * i), "host": "h", "port": 1, "latency_ms": 2.0, "success": True}
+                for i in range(240)
+            ])
+        await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, base, kind="tcp")
+        for tier_index in range(1, len(TIERS)):
+            await _rollup_tier(engine, "tcp", tier_index)
+        totals = {}
+        async with engine.begin() as conn:
+            for name, table in TIER_TABLES["tcp"].items():
+                totals[name] = (await conn.execute(select(func.sum(table.c.count), func.count()))).one()
+            dirty = (await conn.execute(select(func.count()).select_from(rollup_dirty))).scalar()
+        await engine.dispose()
+        return totals, dirty
+
+    totals, dirty = anyio.run(main)
+    assert totals["1m"] == (240, 120)
+    assert totals["5m"] == (240, 24)
+    assert totals["1h"] == (240, 2)
+    assert totals["1d"] == (240, 1)
+    assert dirty == 0
+
+
+def test_old_backfill_merges_into_tiers_whose_source_was_pruned(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'b.db'}")
+        await init_schema(engine)
+        now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        # Past the 1m tier's retention (30 days), and past the 5m tier's (90 days)
+        old = [now - timedelta(days=40, minutes=-2), now - timedelta(days=100, minutes=-2)]
+
+        async def backfill(offsets) -> None:
+            # Live probes keep writing next to the backfill
+            stamps = [ts + timedelta(seconds=o) for ts in old for o in offsets] + [now - timedelta(minutes=1)]
+            async with engine.begin() as conn:
+                await conn.execute(insert(samples_tcp), [
+                    {"ts": ts, "host": "h", "port": 1, "latency_ms": 2.0, "success": True} for ts in stamps
+                ])
+            await maintenance_pass(engine, now)
+
+        # Sets the watermark and records what each tier has pruned
+        await backfill([])
+        await backfill(range(10))
+        await backfill(range(10, 15))
+        totals = {}
+        async with engine.begin() as conn:
+            for name, table in TIER_TABLES["tcp"].items():
+                totals[name] = [
+                    (await conn.execute(select(func.sum(table.c.count)).where(
+                        table.c.bucket >= bucketize(ts, 86400), table.c.bucket < bucketize(ts, 86400) + timedelta(days=1)
+                    ))).scalar()
+                    for ts in old
+                ]
+        await engine.dispose()
+        return totals
+
+    totals = anyio.run(main)
+    # Both backfills count in every tier that still keeps the bucket
+    assert totals["1m"] == [None, None]
+    assert totals["5m"] == [15, None]
+    assert totals["1h"] == [15, 15]
+    assert totals["1d"] == [15, 15]
+
+
+def test_pick_tier_respects_retention():
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    assert pick_tier(3600, now - timedelta(days=1), now) == ("1h", 3600)
+    assert pick_tier(600, now - timedelta(days=1), now) == ("5m", 300)
+    assert pick_tier(60, now - timedelta(days=1), now) == ("1m", 60)
+    # 138 days at 10 min steps: no tiling tier keeps that much, so hourly buckets
+    assert pick_tier(600, now - timedelta(days=138), now) == ("1h", 3600)
+    assert pick_tier(600, now - timedelta(days=2000), now) == ("1d", 86400)
+    assert pick_tier(30, now - timedelta(days=1), now) is None
+
+
+def test_http_probe_phase_timings_cold_and_warm():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _OkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    async def main():
+        clients = create_http_clients(max_connections=4, max_keepalive_connections=4)
+        try:
+            cold = [await probe_http(url, "GET", 2.0, clients, "cold") for _ in range(2)]
+            warm = [await probe_http(url, "GET", 2.0, clients, "warm") for _ in range(2)]
+        finally:
+            await close_http_clients(clients)
+        return cold, warm
+
+    try:
+        cold, warm = anyio.run(main)
+    finally:
+        server.shutdown()
+    assert all(r.success and not r.reused and r.connect_ms is not None for r in cold)
+    assert all(r.ttfb_ms is not None and r.ttfb_ms <= r.latency_ms for r in cold + warm)
+    assert warm[0].reused is False
+    assert warm[1].reused is True and warm[1].connect_ms is None
+
+
+def _start_fake_dns(delay_sec: float = 0.0):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+
+    def serve():
+        while True:
+            try:
+                wire, addr = sock.recvfrom(4096)
+            except OSError:
+                return
+            query = dns.message.from_wire(wire)
+            response = dns.message.make_response(query)
+            response.answer.append(dns.rrset.from_text(query.question[0].name, 60, "IN", "A", "192.0.2.1"))
+            time.sleep(delay_sec)
+            sock.sendto(response.to_wire(), addr)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock
+
+
+def test_query_nameserver_runs_on_event_loop():
+    server = _start_fake_dns()
+    port = server.getsockname()[1]
+
+    async def main():
+        return await query_nameserver("example.test", "A", f"127.0.0.1#{port}", 1.0)
+
+    try:
+        result = anyio.run(main)
+    finally:
+        server.close()
+    assert result.success and result.rcode == "NOERROR"
+    assert [a.value for a in result.answers] == ["192.0.2.1"]
+    assert result.resolver == f"127.0.0.1#{port}"
+
+
+def test_dns_fanout_queries_resolvers_concurrently():
+    servers = [_start_fake_dns(delay_sec=0.3) for _ in range(3)]
+    resolvers = [f"127.0.0.1#{s.getsockname()[1]}" for s in servers]
+
+    async def main():
+        started = time.perf_counter()
+        results = await resolve_dns_fanout(DnsQueryRequest(fqdn="example.test", resolvers=resolvers, timeout_sec=2.0))
+        return results, time.perf_counter() - started
+
+    try:
+        results, elapsed = anyio.run(main)
+    finally:
+        for s in servers:
+            s.close()
+    assert [r.resolver for r in results] == resolvers
+    assert all(r.success for r in results)
+    # Concurrent: about one server delay, not the sum of three
+    assert elapsed < 0.8
+
+
+def test_dns_fanout_reports_silent_resolver_as_timeout():
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    resolver = f"127.0.0.1#{silent.getsockname()[1]}"
+
+    async def main():
+        return await resolve_dns_fanout(DnsQueryRequest(fqdn="example.test", resolvers=[resolver], timeout_sec=0.3))
+
+    try:
+        results = anyio.run(main)
+    finally:
+        silent.close()
+    assert [(r.resolver, r.rcode, r.success) for r in results] == [(resolver, "TIMEOUT", False)]
+    assert results[0].latency_ms >= 250
+
+
+def test_dispatcher_runs_jobs_on_interval_and_counts_missed():
+    runs = {}
+    # Interval well above a loop stall the test process can hit (e.g. a full GC of its
+    # heap takes ~100 ms), so a stall delays ticks without missing any
+    interval = 0.25
+
+    async def main():
+        dispatcher = create_dispatcher({"tcp": 8, "dns": 1})
+
+        def probe(key, delay=0.0):
+            async def _run():
+                runs[key] = runs.get(key, 0) + 1
+                await anyio.sleep(delay)
+            return _run
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(dispatcher["run"])
+            for i in range(200):
+                dispatcher["add"](f"t{i}", "tcp", interval, probe(f"t{i}"))
+            dispatcher["add"]("slow", "dns", interval, probe("slow", delay=2.4 * interval))
+            await anyio.sleep(6.5 * interval)
+            tg.cancel_scope.cancel()
+        return dispatcher["stats"]()
+
+    stats = anyio.run(main)
+    tcp_runs = [runs[f"t{i}"] for i in range(200)]
+    assert min(tcp_runs) >= 5 and max(tcp_runs) <= 7
+    assert stats["kinds"]["tcp"]["missed"] == 0
+    # The slow job overruns its interval: skipped ticks are reported, not queued
+    assert runs["slow"] <= 3
+    assert stats["kinds"]["dns"]["missed"] >= 3
+    assert stats["jobs"] == 201
+
+
+def test_measurement_loop_is_not_delayed_by_main_loop_stalls():
+    async def timed(ctx, delay):
+        started = time.perf_counter()
+        await anyio.sleep(delay)
+        return (time.perf_counter() - started) * 1000.0, threading.get_ident()
+
+    async def main():
+        monitor = create_loop_monitor(tick_sec=0.005)
+        engine = create_measurement_engine(loops=2, tick_sec=0.005)
+        await engine["start"]()
+        results = {}
+
+        async def isolated():
+            results["isolated"] = await engine["run"]("tcp-a", timed, 0.05)
+
+        async def shared():
+            results["shared"] = await measure({"loop_monitor": monitor}, timed, 0.05)
+
+        async def stall():
+            await anyio.sleep(0.01)
+            time.sleep(0.2)  # e.g. a large response being serialized
+
+        async with anyio.create_task_group() as outer:
+            outer.start_soon(monitor["run"])
+            await anyio.sleep(0.05)
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(isolated)
+                tg.start_soon(shared)
+                tg.start_soon(stall)
+            outer.cancel_scope.cancel()
+        stats = engine["stats"]()
+        await engine["stop"]()
+        return results, stats
+
+    results, stats = anyio.run(main)
+    (isolated_ms, isolated_thread), isolated_lag = results["isolated"]
+    (shared_ms, _), shared_lag = results["shared"]
+    assert isolated_thread != threading.get_ident()
+    assert isolated_ms < 150 and isolated_lag < 100
+    # On the stalled loop the latency is inflated, and the lag says by how much
+    assert shared_ms >= 190 and shared_lag >= 100
+    assert stats["completed"] == 1 and stats["wakeups"] >= 1 and len(stats["loops"]) == 2
+
+
+def test_measurement_engine_stop_cancels_in_flight_probes(monkeypatch):
+    import pytest
+
+    from app.services import measurement
+
+    async def hang(ctx):
+        await anyio.sleep(30)
+
+    async def main():
+        engine = create_measurement_engine(loops=2, tick_sec=0.005)
+        await engine["start"]()
+        outcome = {}
+
+        async def probe():
+            try:
+                await engine["run"]("tcp-a", hang)
+            except anyio.get_cancelled_exc_class():
+                outcome["cancelled"] = True
+                raise
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(probe)
+            await anyio.sleep(0.05)
+            started = time.perf_counter()
+            await engine["stop"]()
+            elapsed = time.perf_counter() - started
+        return outcome, elapsed, engine["stats"]()
+
+    outcome, elapsed, stats = anyio.run(main)
+    assert elapsed < 1.0
+    assert outcome == {"cancelled": True}
+    assert stats["pending"] == 0 and stats["loops"] == []
+
+    # Shutdown errors are raised, not swallowed
+    async def broken_close(clients):
+        raise RuntimeError("close failed")
+
+    async def stop_broken():
+        engine = create_measurement_engine(loops=1, tick_sec=0.005)
+        await engine["start"]()
+        await engine["stop"]()
+
+    monkeypatch.setattr(measurement, "close_http_clients", broken_close)
+    with pytest.raises(RuntimeError, match="close failed"):
+        anyio.run(stop_broken)
+
+
+def test_dns_resolver_limits_are_per_measurement_loop(monkeypatch):
+    import zlib
+
+    from app.routers import dns as dns_router
+    from app.services.scheduler import _measure_dns
+
+    # One query in flight per resolver, so jobs on both loops contend for it
+    monkeypatch.setattr(dns_router, "RESOLVER_CONCURRENCY", 1)
+    server = _start_fake_dns(delay_sec=0.02)
+    resolver = f"127.0.0.1#{server.getsockname()[1]}"
+    keys = [f"dns-{i}" for i in range(6)]
+    assert {zlib.crc32(k.encode()) % 2 for k in keys} == {0, 1}
+
+    async def main():
+        # Idle lag monitors, so nothing else wakes a loop that was signalled from the wrong thread
+        engine = create_measurement_engine(loops=2, tick_sec=60.0)
+        await engine["start"]()
+        results = []
+
+        async def job(key):
+            samples, _ = await engine["run"](key, _measure_dns, "example.test", "A", [resolver])
+            results.extend(samples)
+
+        try:
+            with anyio.fail_after(5):
+                async with anyio.create_task_group() as tg:
+                    for key in keys:
+                        tg.start_soon(job, key)
+        finally:
+            await engine["stop"]()
+        return results
+
+    try:
+        results = anyio.run(main)
+    finally:
+        server.close()
+    assert len(results) == len(keys) and all(r["success"] for r in results)
+
+
+def test_hash_ring_shards_evenly_and_moves_few_keys():
+    keys = [f"tcp:target-{i}" for i in range(4000)]
+    four = create_hash_ring(4)["shard_of"]
+    five = create_hash_ring(5)["shard_of"]
+    sizes = [sum(1 for k in keys if four(k) == shard) for shard in range(4)]
+    assert min(sizes) > 600
+    moved = sum(1 for k in keys if four(k) != five(k))
+    assert moved < 0.3 * len(keys)
+    cfg = {"version": 3, "tcp": {f"t{i}": {"id": f"t{i}"} for i in range(50)}, "dns": {}, "http": {}}
+    parts = shard_config(cfg, 4)
+    assert sum(len(p["tcp"]) for p in parts) == 50 and all(p["version"] == 3 for p in parts)
+
+
+def test_probe_workers_stream_samples_to_main_process():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(128)
+    port = listener.getsockname()[1]
+    stop = threading.Event()
+
+    def accept():
+        listener.settimeout(0.1)
+        while not stop.is_set():
+            try:
+                listener.accept()[0].close()
+            except OSError:
+                pass
+
+    threading.Thread(target=accept, daemon=True).start()
+    records = []
+    delays = []
+
+    async def submit(kind, record):
+        records.append((kind, record))
+
+    async def main():
+        cfg = {
+            "version": 1,
+            "tcp": {
+                f"t{i}": {"id": f"t{i}", "host": "127.0.0.1", "port": port, "interval_sec": 0.2, "family": "both"}
+                for i in range(8)
+            },
+            "dns": {}, "http": {},
+        }
+        bus = create_event_bus()
+        publish = bus["publish"]
+
+        async def timed_publish(event):
+            delays.append(datetime.now(timezone.utc) - datetime.fromisoformat(event["ts"]))
+            await publish(event)
+
+        runtime = {
+            "config": cfg, "event_bus": {**bus, "publish": timed_publish}, "ring_buffer": create_ring_buffer(),
+            "sample_writer": {"submit": submit},
+        }
+        app = SimpleNamespace(state=SimpleNamespace(runtime=runtime))
+        with anyio.fail_after(30):
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(run_probe_workers, app, 2, 0.5)
+                while len({r["target_id"] for _, r in records}) < 8:
+                    await anyio.sleep(0.1)
+                tg.cancel_scope.cancel()
+        return runtime
+
+    try:
+        runtime = anyio.run(main)
+    finally:
+        stop.set()
+        listener.close()
+    shards = runtime["probe_workers"]["shards"]
+    assert all(s["entries"] > 0 for s in shards) and sum(s["entries"] for s in shards) == 8
+    assert all(kind == "tcp" and record["success"] for kind, record in records)
+    assert isinstance(records[0][1]["ts"], datetime)
+    # Main process owns the bus and ring buffer
+    assert runtime["event_bus"]["stats"]()["published"] >= 8
+    assert runtime["ring_buffer"]["stats"]()["series"] == 1
+    # Events keep the worker's timestamp: with 0.5 s flushes some arrive well after it
+    assert max(delays) > timedelta(seconds=0.2)
+
+
+def test_agent_spool_survives_outage_and_pushes_in_order(tmp_path):
+    import gzip
+    import json
+
+    import httpx
+
+    attempts = []
+    up = {"ok": False}
+
+    def central(request):
+        attempts.append(request.headers["x-batch-id"])
+        if not up["ok"]:
+            raise httpx.ConnectError("central unreachable")
+        lines = gzip.decompress(request.content).splitlines()
+        return httpx.Response(200, json={"accepted": len(lines), "rejected": 0})
+
+    spool = create_spool(str(tmp_path / "spool"))
+    spool["write"]([{"kind": "tcp", "host": "a", "ts": datetime(2030, 1, 1, tzinfo=timezone.utc)}])
+    spool["write"]([{"kind": "tcp", "host": "b"}, {"kind": "tcp", "host": "c"}])
+    first, second = spool["files"]()
+    assert json.loads(gzip.decompress(spool["read"](first)))["ts"].startswith("2030-01-01T00:00:00")
+
+    async def main():
+        wake = {"event": None}
+        async with httpx.AsyncClient(transport=httpx.MockTransport(central)) as client:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(push_spool, spool, client, "http://central/api/ingest/samples", "lab", wake)
+                await anyio.sleep(0.2)
+                # Outage: nothing is lost
+                assert spool["files"]() == [first, second]
+                up["ok"] = True
+                with anyio.fail_after(5):
+                    while spool["files"]():
+                        await anyio.sleep(0.05)
+                tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    assert attempts[0] == f"lab/{first}" and attempts[-2:] == [f"lab/{first}", f"lab/{second}"]
+    assert spool["push_stats"]["pushed"] == 2 and spool["push_stats"]["failures"] >= 1
+
+
+def test_bulk_ingest_streams_chunks_and_rolls_up_backfilled_buckets(tmp_path):
+    import gzip
+    import json
+
+    import httpx
+    from fastapi import FastAPI
+
+    from app.db.repo import prune_retention
+    from app.routers.ingest import router as ingest_router
+
+    bucket = datetime(2030, 1, 1, 12, 0, tzinfo=timezone.utc)
+    old = datetime(2029, 12, 1, 8, 0, tzinfo=timezone.utc)
+    lines = [
+        json.dumps({"kind": "tcp", "ts": (bucket + timedelta(seconds=i * 0.1)).isoformat(), "host": "h", "port": 1,
+                    "latency_ms": 2.0, "success": True})
+        for i in range(250)
+    ]
+    lines += [
+        "",
+        json.dumps({"kind": "tcp", "ts": bucket.isoformat(), "host": "h", "port": 0, "latency_ms": 1.0, "success": True}),
+        # 08:00:30 UTC written with a +02:00 offset, into a bucket the rollups have long passed
+        json.dumps({"kind": "tcp", "ts": "2029-12-01T10:00:30+02:00", "host": "h", "port": 1,
+                    "latency_ms": 3.0, "success": False}),
+        json.dumps({"kind": "dns", "ts": "2030-01-01T12:00:05Z", "fqdn": "example.com", "record_type": "A",
+                    "latency_ms": 1.5, "success": True}),
+        # Offset without a colon; an impossible date; two samples on one line
+        json.dumps({"kind": "tcp", "ts": "2029-12-01T09:00:45+0100", "host": "h", "port": 1,
+                    "latency_ms": 3.0, "success": True}),
+        json.dumps({"kind": "tcp", "ts": "2030-02-30T00:00:00Z", "host": "h", "port": 1, "latency_ms": 1.0, "success": True}),
+        json.dumps({"kind": "tcp", "ts": bucket.isoformat(), "host": "h", "port": 1, "latency_ms": 1.0, "success": True})
+        + "," + json.dumps({"kind": "tcp", "ts": bucket.isoformat(), "host": "h", "port": 1, "latency_ms": 1.0, "success": True}),
+    ]
+    text = "\n".join(lines) + "\n"
+    # Two gzip members, split mid-line
+    body = gzip.compress(text[:5000].encode()) + gzip.compress(text[5000:].encode())
+
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'b.db'}")
+        await init_schema(engine)
+        async with engine.begin() as conn:
+            await conn.execute(insert(samples_tcp), [
+                {"ts": bucket, "host": "h", "port": 1, "latency_ms": 2.0, "success": True}
+            ])
+        since = bucket - timedelta(hours=2)
+        await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, since)
+
+        api = FastAPI()
+        api.include_router(ingest_router)
+        api.state.runtime = {"db_engine": engine}
+
+        async def stream():
+            for offset in range(0, len(body), 1000):
+                yield body[offset:offset + 1000]
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api), base_url="http://test") as client:
+            response = await client.post(
+                "/api/ingest/bulk", params={"chunk_size": 100}, content=stream(),
+                headers={"Content-Encoding": "gzip", "Content-Type": "application/x-ndjson"},
+            )
+        async with engine.begin() as conn:
+            stored_old = (await conn.execute(select(samples_tcp.c.ts).where(samples_tcp.c.ts < bucket))).scalars().all()
+        # Backfilled rows are above the rollup watermark, so retention keeps them until they are aggregated
+        await prune_retention(engine, older_than=bucket - timedelta(hours=1))
+        rolled = await _rollup_table(engine, samples_tcp, ["host", "port"], aggregates_tcp_1m, since)
+        async with engine.begin() as conn:
+            counts = dict((await conn.execute(select(aggregates_tcp_1m.c.bucket, aggregates_tcp_1m.c.count))).all())
+        await engine.dispose()
+        return response.json(), stored_old, rolled, counts
+
+    result, stored_old, rolled, counts = anyio.run(main)
+    assert (result["accepted"], result["rejected"], result["batches"]) == (253, 3, 3)
+    assert [e["line"] for e in result["errors"]] == [252, 256, 257]
+    assert result["ranges"]["tcp"]["buckets"] == 2
+    assert result["ranges"]["tcp"]["first_bucket"].startswith("2029-12-01T08:00:00")
+    assert result["ranges"]["dns"]["buckets"] == 1
+    assert sorted(stored_old) == [datetime(2029, 12, 1, 8, 0, 30), datetime(2029, 12, 1, 8, 0, 45)]
+    assert rolled == 252
+    assert counts == {bucket.replace(tzinfo=None): 251, old.replace(tzinfo=None): 2}
+
+
+def test_bulk_ingest_turns_database_errors_into_partial_results(tmp_path, monkeypatch):
+    import json
+
+    import httpx
+    from fastapi import FastAPI
+    from sqlalchemy.exc import IntegrityError, OperationalError
+
+    from app.routers import ingest
+
+    calls = []
+    real_insert = ingest.insert_sample_rows
+
+    async def flaky_insert(engine, rows):
+        calls.append(len(rows["tcp"]))
+        if len(calls) == 1:
+            raise IntegrityError("INSERT", None, Exception("NOT NULL constraint failed"))
+        if len(calls) == 3:
+            raise OperationalError("INSERT", None, Exception("disk I/O error"))
+        return await real_insert(engine, rows)
+
+    monkeypatch.setattr(ingest, "insert_sample_rows", flaky_insert)
+    body = "".join(
+        json.dumps({"kind": "tcp", "ts": f"2030-01-01T12:{i // 60:02d}:{i % 60:02d}Z", "host": "h", "port": 1,
+                    "latency_ms": 1.0, "success": True}) + "\n"
+        for i in range(400)
+    ).encode()
+
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'e.db'}")
+        await init_schema(engine)
+        api = FastAPI()
+        api.include_router(ingest.router)
+        api.state.runtime = {"db_engine": engine}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api), base_url="http://test") as client:
+            partial = await client.post("/api/ingest/bulk", params={"chunk_size": 100}, content=body[:len(body) // 2])
+            failed = await client.post("/api/ingest/bulk", params={"chunk_size": 100}, content=body)
+        async with engine.begin() as conn:
+            stored = (await conn.execute(select(func.count()).select_from(samples_tcp))).scalar()
+        await engine.dispose()
+        return partial, failed, stored
+
+    partial, failed, stored = anyio.run(main)
+    assert partial.status_code == 200
+    assert (partial.json()["accepted"], partial.json()["rejected"]) == (100, 100)
+    assert partial.json()["errors"][0]["line"] == 1
+    # Third insert overall is the second request's first chunk
+    assert failed.status_code == 503 and "0 samples before it were stored" in failed.json()["detail"]
+    assert stored == 100
+
+
+def test_reconcile_only_touches_changed_jobs():
+    class _App:
+        pass
+
+    cfg = {
+        "tcp": {f"t{i}": {"id": f"t{i}", "host": f"10.0.0.{i}", "port": 443, "interval_sec": 5.0} for i in range(100)},
+        "dns": {"d1": {"id": "d1", "fqdn": "example.com", "resolvers": ["1.1.1.1"], "interval_sec": 5.0}},
+    }
+    dispatcher = create_dispatcher()
+    first = reconcile_jobs(dispatcher, _config_jobs(_App(), cfg))
+    assert first["added"] == 101
+    due_before = {key: dispatcher["get"](key)["next_due"] for key in dispatcher["keys"]()}
+    gen_before = {key: dispatcher["get"](key)["generation"] for key in dispatcher["keys"]()}
+
+    cfg["tcp"]["t5"] = dict(cfg["tcp"]["t5"], port=80)
+    del cfg["tcp"]["t7"]
+    cfg["tcp"]["new"] = {"id": "new", "host": "10.0.1.1", "port": 22, "interval_sec": 5.0}
+    summary = reconcile_jobs(dispatcher, _config_jobs(_App(), cfg))
+    assert summary == {"added": 1, "updated": 1, "removed": 1, "unchanged": 99}
+    assert dispatcher["get"]("tcp:t7") is None
+    # Untouched jobs keep their schedule; the edited one keeps its phase
+    assert dispatcher["get"]("tcp:t1")["generation"] == gen_before["tcp:t1"]
+    assert dispatcher["get"]("tcp:t5")["next_due"] == due_before["tcp:t5"]
+    assert dispatcher["get"]("tcp:t5")["generation"] == gen_before["tcp:t5"] + 1
+
+
+def test_config_registry_persists_and_reloads(tmp_path):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'cfg.db'}")
+        await init_schema(engine)
+        registry = create_config_registry(engine)
+        seeded = await registry["load"]()
+        assert seeded["tcp"] > 0
+        changes = []
+        registry = create_config_registry(engine, on_change=lambda: changes.append(1))
+        await registry["load"]()
+        version = await registry["apply"](
+            upserts={
+                "tcp": [{"id": f"t{i}", "host": f"10.0.{i // 256}.{i % 256}", "port": 443, "interval_sec": 5.0}
+                        for i in range(10000)],
+                "dns": [{"id": "d1", "fqdn": "example.com", "record_type": "A",
+                         "resolvers": ["1.1.1.1", "9.9.9.9#5353"], "interval_sec": 5.0}],
+            },
+            deletes={"http": [e["id"] for e in registry["entries"]("http")]},
+        )
+        assert version == 2 and changes == [1]
+
+        reloaded = create_config_registry(engine)
+        started = time.perf_counter()
+        counts = await reloaded["load"]()
+        elapsed = time.perf_counter() - started
+
+        # Deleting every entry survives a restart: the defaults are seeded only once
+        cleaner = create_config_registry(engine)
+        await cleaner["load"]()
+        await cleaner["apply"](deletes={kind: [e["id"] for e in cleaner["entries"](kind)] for kind in counts})
+        emptied = await create_config_registry(engine)["load"]()
+        await engine.dispose()
+        return reloaded, counts, elapsed, emptied
+
+    reloaded, counts, elapsed, emptied = anyio.run(main)
+    assert emptied == {"tcp": 0, "dns": 0, "http": 0}
+    assert counts["tcp"] == 10000 + 3 and counts["http"] == 0
+    assert reloaded["get"]("dns", "d1")["resolvers"] == ["1.1.1.1", "9.9.9.9#5353"]
+    assert reloaded["get"]("tcp", "t9999")["host"] == "10.0.39.15"
+    assert elapsed < 1.0
+
+
+def test_address_cache_ttl_negative_and_single_flight():
+    calls = []
+
+    async def lookup(host):
+        calls.append(host)
+        await anyio.sleep(0.05)
+        if host == "missing.invalid":
+            raise OSError("NXDOMAIN")
+        return ["127.0.0.1"], 0.2
+
+    async def main():
+        cache = create_address_cache(lookup=lookup, min_ttl_sec=0.1, negative_ttl_sec=0.2)
+        results = []
+
+        async def resolve(host):
+            results.append(await cache["resolve"](host))
+
+        async with anyio.create_task_group() as tg:
+            for _ in range(20):
+                tg.start_soon(resolve, "svc.local")
+        assert calls == ["svc.local"] and len(results) == 20
+        await cache["resolve"]("svc.local")
+        for _ in range(2):
+            try:
+                await cache["resolve"]("missing.invalid")
+            except OSError as exc:
+                assert "NXDOMAIN" in str(exc)
+        assert await cache["resolve"]("10.1.2.3") == ["10.1.2.3"]
+        await anyio.sleep(0.25)
+        await cache["resolve"]("svc.local")
+
+        # Resolve and connect are reported separately; latency_ms is the connect phase
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(8)
+        port = listener.getsockname()[1]
+        result = await tcp_connect_latency("svc.local", port, 1.0, address_cache=cache)
+        listener.close()
+        return cache["stats"](), result
+
+    stats, result = anyio.run(main)
+    assert calls == ["svc.local", "missing.invalid", "svc.local"]
+    assert stats["coalesced"] == 19 and stats["negative_hits"] == 1 and stats["hits"] >= 2
+    assert result.success and result.latency_ms == result.connect_ms
+    assert result.resolve_ms is not None and result.resolve_ms < 50
+
+
+def test_dns_lookup_takes_addresses_from_the_system_resolver(monkeypatch):
+    import dns.exception
+
+    from app.utils import address_cache
+
+    class FakeRRSet(list):
+        ttl = 0
+
+    class FakeResolver:
+        def __init__(self, address):
+            self.address = address
+
+        async def resolve(self, host, rdtype, lifetime):
+            if rdtype == "AAAA":
+                raise dns.exception.Timeout()
+            rrset = FakeRRSet([SimpleNamespace(address=self.address)])
+            rrset.ttl = 7
+            return SimpleNamespace(rrset=rrset)
+
+    async def main():
+        # The DNS answers differently from /etc/hosts: its TTL does not apply
+        monkeypatch.setattr(address_cache, "_resolver", FakeResolver("192.0.2.1"))
+        from_hosts = await address_cache.dns_lookup("localhost")
+        monkeypatch.setattr(address_cache, "_resolver", FakeResolver("127.0.0.1"))
+        agreeing = await address_cache.dns_lookup("localhost")
+        return from_hosts, agreeing
+
+    (addresses, ttl), (_, agreeing_ttl) = anyio.run(main)
+    assert "127.0.0.1" in addresses and "192.0.2.1" not in addresses
+    assert ttl == 60.0 and agreeing_ttl == 7.0
+
+
+def test_happy_eyeballs_order_pin_and_staggered_connect():
+    addrs = ["2001:db8::1", "2001:db8::2", "192.0.2.1", "192.0.2.2", "192.0.2.3"]
+    assert _order_addresses(addrs) == ["2001:db8::1", "192.0.2.1", "2001:db8::2", "192.0.2.2", "192.0.2.3"]
+    assert _order_addresses(addrs, "v4") == ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+    assert _order_addresses(addrs, "v6") == ["2001:db8::1", "2001:db8::2"]
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    port = listener.getsockname()[1]
+
+    async def main():
+        started = time.perf_counter()
+        # A blackholed first address must not hold up the working one beyond the attempt delay
+        address, connect_ms = await _connect(["192.0.2.1", "127.0.0.1"], port)
+        elapsed = time.perf_counter() - started
+        pinned = await tcp_connect_latency("127.0.0.1", port, 1.0, family="v6")
+        return address, connect_ms, elapsed, pinned
+
+    try:
+        address, connect_ms, elapsed, pinned = anyio.run(main)
+    finally:
+        listener.close()
+    assert address == "127.0.0.1" and elapsed < 0.6
+    assert connect_ms < 100
+    assert not pinned.success and "v6" in pinned.error
+
+
+def test_event_bus_shares_encoded_bytes_and_counts_drops():
+    async def main():
+        bus = create_event_bus(queue_size=3)
+        await bus["publish"]({"type": "tcp_sample", "data": {"host": "h"}})
+        fast, slow = bus["subscribe"](), bus["subscribe"]()
+        first_fast, first_slow = await fast.__anext__(), await slow.__anext__()
+        for i in range(10):
+            await bus["publish"]({"type": "tcp_sample", "data": {"i": i}})
+            await fast.__anext__()
+        stats = bus["stats"]()
+        await fast.aclose()
+        await slow.aclose()
+        return first_fast, first_slow, stats, bus["stats"]()
+
+    first_fast, first_slow, stats, after = anyio.run(main)
+    # Replayed entry: one encoding shared by both subscribers
+    assert first_fast[2] is first_slow[2]
+    assert first_fast[2].startswith(b"id: 1\ndata: {") and first_fast[2].endswith(b"\n\n")
+    assert stats["published"] == 11
+    assert [s["dropped"] for s in stats["subscribers"]] == [0, 7]
+    assert stats["dropped"] == 7 and after["subscribers"] == []
+
+
+def test_event_bus_resume_and_server_side_filter():
+    async def main():
+        bus = create_event_bus(max_recent_events=50)
+        for i in range(60):
+            host = "1.1.1.1" if i % 2 else "8.8.8.8"
+            await bus["publish"]({"type": "tcp_sample", "data": {"host": host, "success": i % 3 != 0}})
+        await bus["publish"]({"type": "dns_sample", "data": {"fqdn": "example.com", "success": True}})
+
+        async def drain(**kwargs):
+            stream = bus["subscribe"](**kwargs)
+            items = []
+            with anyio.move_on_after(0.05):
+                async for entry in stream:
+                    items.append(entry)
+            await stream.aclose()
+            return items
+
+        resumed = await drain(last_event_id=55)
+        after_restart = await drain(last_event_id=10_000)
+        match = build_event_filter(["tcp_sample"], {"host": ["1.1.1.1"]}, success=True)
+        filtered = await drain(last_event_id=40, match=match)
+        return resumed, after_restart, filtered, bus["stats"]()
+
+    resumed, after_restart, filtered, stats = anyio.run(main)
+    assert [e[0] for e in resumed] == [56, 57, 58, 59, 60, 61]
+    assert len(after_restart) == 50
+    assert all(e[1]["data"]["host"] == "1.1.1.1" and e[1]["data"]["success"] for e in filtered)
+    assert [e[0] for e in filtered] == [42, 44, 48, 50, 54, 56, 60]
+    assert stats["last_id"] == 61
+
+
+def test_ring_buffer_per_series_budget_and_cursor():
+    async def main():
+        ring = create_ring_buffer(maxlen=100, per_series=8, max_total=500)
+        for round_ in range(20):
+            for i in range(100):
+                await ring["append"]({"type": "tcp_sample", "data": {"host": f"10.0.0.{i}", "latency_ms": round_}})
+        await ring["append"]({"type": "dns_sample", "data": {"fqdn": "example.com", "latency_ms": 1.0}})
+        one_host = await ring["query"](targets=["10.0.0.7"], limit=50)
+        cursor = one_host[-1]["seq"]
+        await ring["append"]({"type": "tcp_sample", "data": {"host": "10.0.0.7", "latency_ms": 99.0}})
+        newer = await ring["query"](targets=["10.0.0.7"], since=cursor)
+        dns_only = await ring["query"](types=["dns_sample"])
+        mixed = await ring["query"](targets=["10.0.0.7", "example.com"], limit=3)
+        return ring["stats"](), one_host, newer, dns_only, mixed
+
+    stats, one_host, newer, dns_only, mixed = anyio.run(main)
+    # 100 series x 8 slots would be 800; the budget trims the least recently updated series
+    assert stats["samples"] <= 500 and stats["series"] == 101
+    assert 1 <= len(one_host) <= 8
+    assert [s["data"]["latency_ms"] for s in one_host] == sorted(s["data"]["latency_ms"] for s in one_host)
+    assert one_host[-1]["data"]["latency_ms"] == 19
+    assert [s["data"]["latency_ms"] for s in newer] == [99.0]
+    assert len(dns_only) == 1 and dns_only[0]["ts"]
+    assert [s["seq"] for s in mixed] == sorted(s["seq"] for s in mixed)
+    assert mixed[-1]["data"]["latency_ms"] == 99.0 and mixed[-2]["type"] == "dns_sample"
+
+
+def test_ring_buffer_keeps_ports_on_one_host_apart():
+    async def main():
+        ring = create_ring_buffer(per_series=4)
+        for i in range(10):
+            await ring["append"]({"type": "tcp_sample", "data": {"host": "h", "port": 443, "latency_ms": float(i)}})
+        await ring["append"]({"type": "tcp_sample", "data": {"host": "h", "port": 22, "latency_ms": 0.0}})
+        return ring["stats"](), await ring["query"](targets=["h"])
+
+    stats, items = anyio.run(main)
+    # The busy port does not push the quiet one out of the shared host
+    assert stats["series"] == 2
+    assert [s["data"]["port"] for s in items] == [443] * 4 + [22]
+
+
+def test_columnar_engine_matches_row_by_row_aggregation():
+    import random
+
+    rng = random.Random(7)
+    base = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+    rows = [
+        (base + rng.randrange(0, 3600), rng.choice([0.0, rng.uniform(0.1, 500.0)]), rng.random() > 0.1,
+         (rng.choice(["a", "b", "c"]), 443))
+        for _ in range(5000)
+    ]
+    ts_sec, latency, success, keys = zip(*rows)
+    grouped = group_samples(ts_sec, latency, success, keys, 300)
+
+    expected = {}
+    for ts, value, ok, key in rows:
+        bucket = bucketize(datetime.fromtimestamp(ts, tz=timezone.utc), 300)
+        agg = expected.setdefault((bucket,) + key, new_aggregate())
+        aggregate_add(agg, value, ok)
+    assert grouped.keys() == expected.keys()
+    for key, agg in expected.items():
+        got = grouped[key]
+        assert (got["count"], got["ok"], got["min"], got["max"]) == (agg["count"], agg["ok"], agg["min"], agg["max"])
+        assert abs(got["sum"] - agg["sum"]) < 1e-6
+        assert got["sketch"] == agg["sketch"]